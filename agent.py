@@ -2,57 +2,18 @@
 
 import os
 import re
+import asyncio
+import hashlib
+import itertools
 import time
-import requests
-from typing import List, Dict, Any
-from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
-from langchain_openai import ChatOpenAI
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain.tools import BaseTool
-from langchain.schema import BaseMessage, HumanMessage
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from ddgs import DDGS
+from contextlib import aclosing
+from typing import List, Dict, Optional
+from langchain_core.tools import BaseTool
 import json
-
-
-class WebScrapingTool(BaseTool):
-    """网页抓取工具"""
-    name: str = "web_scraping"
-    description: str = "抓取指定URL的网页内容，提取文本信息"
-    
-    def _run(self, url: str) -> str:
-        """执行网页抓取"""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            response.encoding = response.apparent_encoding
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # 移除脚本和样式标签
-            for script in soup(["script", "style"]):
-                script.decompose()
-            
-            # 提取文本内容
-            text = soup.get_text()
-            
-            # 清理文本
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = ' '.join(chunk for chunk in chunks if chunk)
-            
-            # 限制长度
-            if len(text) > 5000:
-                text = text[:5000] + "..."
-                
-            return text
-            
-        except Exception as e:
-            return f"抓取失败: {str(e)}"
+from http_cache import PageCache
+from llm_runner import ConcurrentLLMRunner, chat_model
+from bm25_index import BM25Index
+from near_dup import NearDuplicateIndex
 
 
 class ContentAnalysisTool(BaseTool):
@@ -62,151 +23,259 @@ class ContentAnalysisTool(BaseTool):
     
     def _run(self, content: str, query: str) -> str:
         """分析内容与查询的相关性"""
-        # 简单的关键词匹配分析
-        query_words = set(query.lower().split())
-        content_words = set(content.lower().split())
-        
-        # 计算重叠度
-        overlap = len(query_words.intersection(content_words))
-        relevance_score = overlap / len(query_words) if query_words else 0
-        
-        # 内容长度评分
-        length_score = min(len(content) / 1000, 1.0)
-        
-        # 综合评分
-        total_score = (relevance_score * 0.7 + length_score * 0.3)
-        
-        return json.dumps({
-            "relevance_score": round(relevance_score, 3),
-            "length_score": round(length_score, 3),
-            "total_score": round(total_score, 3),
-            "content_length": len(content)
-        })
+        return self.analyze_many([content], query)[0]
+
+    def relevance(self, text: str, query: str) -> float:
+        """文本覆盖的查询词比例（用于按搜索结果摘要预估网页相关性）"""
+        return float(BM25Index([text]).coverage(query)[0])
+
+    def analyze_many(self, contents: List[str], query: str) -> List[str]:
+        """一次为多份内容打分：对整批网页建一个倒排索引，查询词只切分一次，
+        相关度为网页覆盖的查询词比例（中文按字/二字组切词），并附带 BM25 得分"""
+        index = BM25Index(contents)
+        coverage = index.coverage(query)
+        bm25 = index.scores(query)
+
+        results = []
+        for content, relevance_score, bm25_score in zip(contents, coverage, bm25):
+            relevance_score = float(relevance_score)
+            # 内容长度评分
+            length_score = min(len(content) / 1000, 1.0)
+
+            # 综合评分
+            total_score = (relevance_score * 0.7 + length_score * 0.3)
+
+            results.append(json.dumps({
+                "relevance_score": round(relevance_score, 3),
+                "bm25_score": round(float(bm25_score), 3),
+                "length_score": round(length_score, 3),
+                "total_score": round(total_score, 3),
+                "content_length": len(content)
+            }))
+        return results
+
+
+def parse_title_summary(text: str) -> tuple:
+    """解析 LLM 返回的 {"title", "summary"} JSON，解析失败的字段为 None"""
+    match = re.search(r"\{.*\}", text or "", re.S)
+    if not match:
+        return None, None
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None, None
+    title = str(data.get("title") or "").strip() or None
+    summary = str(data.get("summary") or "").strip() or None
+    return title, summary
 
 
 class WebResearchAgent:
     """基于LangChain的网络研究Agent"""
     
-    def __init__(self, api_key: str, model_name: str, base_url: str):
-        self.llm = ChatOpenAI(
-            model=model_name,
-            api_key=api_key,
-            base_url=base_url,
-            temperature=0.0,
-            max_tokens=2048,
-        )
+    def __init__(self, api_key: str, model_name: str, base_url: str,
+                 max_concurrency: int = 8, per_host_limit: int = 2, scrape_deadline: float = 30,
+                 llm_concurrency: int = 4, llm_timeout: float = 60,
+                 page_cache: Optional[PageCache] = None, streaming_extract: bool = False,
+                 dedup_index: Optional[NearDuplicateIndex] = None):
+        self.llm = chat_model(model_name, api_key, base_url)
         
-        # 初始化搜索工具
+        # 初始化搜索工具（ddgs 只在真正做网络研究时导入）
+        from ddgs import DDGS
         self.ddgs = DDGS()
-        self.scraping_tool = WebScrapingTool()
+        
+        # 网页响应缓存：重复查询不再重复下载、解析同一批网页
+        self.page_cache = page_cache if page_cache is not None else PageCache()
+        # 近重复检测：转载/镜像页面在调用 LLM 生成摘要和嵌入之前就被丢弃
+        self.dedup_index = dedup_index if dedup_index is not None else NearDuplicateIndex()
         self.analysis_tool = ContentAnalysisTool()
+        
+        # 并发抓取参数
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit
+        self.scrape_deadline = scrape_deadline
+        self.streaming_extract = streaming_extract
+        
+        # LLM 标题/摘要生成：并发数、单次超时与限流重试
+        self.llm_runner = ConcurrentLLMRunner(self.llm, max_concurrency=llm_concurrency, timeout=llm_timeout)
     
-    def research_and_save(self, query: str, output_dir: str = "rag_word", max_docs: int = 10) -> List[str]:
+    def research_and_save(self, query: str, output_dir: str = "rag_word", max_docs: int = 10,
+                          quality_threshold: float = 0.5) -> List[str]:
         """执行研究并保存文档"""
         
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
-        
+        return asyncio.run(self.research_async(query, output_dir, max_docs, quality_threshold))
+
+    async def research_async(self, query: str, output_dir: str, max_docs: int = 10,
+                             quality_threshold: float = 0.5) -> List[str]:
+        """流式研究流水线：搜索 → 抓取 → 打分/去重 → 生成标题摘要并保存，各阶段互相重叠。
+
+        搜索结果一到就按摘要的相关度放进优先队列，抓取协程总是先取预估最相关的网页；
+        每个网页抓完立即打分，综合评分达到 quality_threshold 且不近重复的网页马上开始生成标题摘要。
+        合格网页凑够 max_docs 份即取消剩余抓取；抓取结束仍不足时，用未达标网页中评分最高的补足
+        """
         print(f"开始搜索相关网页: {query}")
-        
-        # 1. 使用搜索工具搜索相关网页
-        try:
-            search_results = []
-            with self.ddgs as ddgs:
-                for r in ddgs.text(query, max_results=20):
-                    search_results.append({
-                        'title': r.get('title', ''),
-                        'url': r.get('link', ''),
-                        'snippet': r.get('body', '')
-                    })
-            print(f"搜索完成，找到 {len(search_results)} 个结果")
-        except Exception as e:
-            print(f"搜索失败: {e}")
-            return []
-        
-        # 2. 提取URL
-        urls = [result['url'] for result in search_results if result['url']]
-        print(f"找到 {len(urls)} 个有效URL")
-        
-        # 3. 抓取网页内容
-        scraped_contents = []
-        for i, url in enumerate(urls[:max_docs*2]):  # 抓取更多URL以便筛选
+        loop = asyncio.get_running_loop()
+        queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        order = itertools.count()
+        # 结束标记优先级最低：只有队列中已没有搜索结果时才会被取到
+        end = (float("inf"), float("inf"), None)
+        seen_urls = set()
+        fetch_limit = max_docs * 2
+        fetched = 0
+
+        def search():
+            found = 0
             try:
-                print(f"抓取第 {i+1} 个网页: {url}")
-                content = self.scraping_tool.run(url)
-                if content and not content.startswith("抓取失败"):
-                    # 分析内容相关性
-                    analysis = self.analysis_tool.run(content, query)
-                    scraped_contents.append({
-                        'url': url,
-                        'content': content,
-                        'analysis': analysis
-                    })
+                with self.ddgs as ddgs:
+                    for r in ddgs.text(query, max_results=20):
+                        url = r.get('link', '')
+                        if not url:
+                            continue
+                        found += 1
+                        score = self.analysis_tool.relevance(f"{r.get('title', '')} {r.get('body', '')}", query)
+                        loop.call_soon_threadsafe(queue.put_nowait, (-score, next(order), url))
+                print(f"搜索完成，找到 {found} 个有效URL")
             except Exception as e:
-                print(f"抓取失败 {url}: {e}")
-                continue
-        
-        # 4. 按相关性排序并保存
-        saved_files = self._save_top_contents(scraped_contents, output_dir, max_docs)
-        
-        return saved_files
-    
+                print(f"搜索失败: {e}")
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, end)
 
-    
-    def _save_top_contents(self, scraped_contents: List[Dict], output_dir: str, max_docs: int) -> List[str]:
-        """保存最相关的内容"""
+        async def next_url() -> Optional[str]:
+            nonlocal fetched
+            while fetched < fetch_limit:
+                item = await queue.get()
+                if item is end:
+                    # 放回结束标记，让其他抓取协程也能结束
+                    queue.put_nowait(end)
+                    return None
+                if item[2] in seen_urls:
+                    continue
+                seen_urls.add(item[2])
+                fetched += 1
+                return item[2]
+            return None
+
+        searching = loop.run_in_executor(None, search)
+        semaphore = asyncio.Semaphore(self.llm_runner.max_concurrency)
+        accepted, below, describing = [], [], []
+
+        def accept(item: Dict):
+            if self._is_near_duplicate(item, accepted):
+                return
+            accepted.append(item)
+            describing.append(asyncio.ensure_future(self._describe_one(item, semaphore)))
+
+        from scraper import ConcurrentScraper
+        with ConcurrentScraper(max_concurrency=self.max_concurrency,
+                               per_host_limit=self.per_host_limit,
+                               deadline=self.scrape_deadline,
+                               cache=self.page_cache,
+                               streaming=self.streaming_extract) as scraper:
+            async with aclosing(scraper.scrape_stream(next_url)) as pages:
+                async for page in pages:
+                    item = {'url': page['url'], 'content': page['content'],
+                            'analysis': self.analysis_tool.analyze_many([page['content']], query)[0]}
+                    if self._score(item) < quality_threshold:
+                        below.append(item)
+                        continue
+                    accept(item)
+                    if len(accepted) >= max_docs:
+                        print(f"已有 {len(accepted)} 份合格文档，停止抓取")
+                        break
+        await searching
+        print(f"发起 {fetched} 个抓取，{len(accepted)} 份网页达到质量阈值 {quality_threshold}")
+        stats = self.page_cache.stats
+        print(f"网页缓存：命中 {stats['hits']}，校验后复用 {stats['revalidated']}，"
+              f"未命中 {stats['misses']}，节省 {stats['bytes_saved']} 字节")
+
+        for item in sorted(below, key=self._score, reverse=True):
+            if len(accepted) >= max_docs:
+                break
+            accept(item)
+
+        descriptions = await asyncio.gather(*describing)
         saved_files = []
-        
-        # 按相关性排序
-        def get_relevance_score(item):
-            try:
-                analysis = json.loads(item['analysis'])
-                return analysis.get('total_score', 0)
-            except:
-                return 0
-        
-        sorted_contents = sorted(scraped_contents, key=get_relevance_score, reverse=True)
-        
-        # 保存前max_docs个
-        for i, item in enumerate(sorted_contents[:max_docs], 1):
-            try:
-                filename = f"web_research_{i}.txt"
-                filepath = os.path.join(output_dir, filename)
-                
-                # 生成摘要
-                summary_prompt = f"请为以下内容生成一个简短的摘要（50字以内）：\n\n{item['content'][:1000]}"
-                try:
-                    summary_response = self.llm.invoke([{"role": "user", "content": summary_prompt}])
-                    summary = summary_response.content.strip()
-                except:
-                    summary = "内容摘要生成失败"
-                
-                # 生成标题
-                title_prompt = f"请为以下内容生成一个简短的标题（20字以内）：\n\n{item['content'][:500]}"
-                try:
-                    title_response = self.llm.invoke([{"role": "user", "content": title_prompt}])
-                    title = title_response.content.strip()
-                except:
-                    title = f"网页内容 {i}"
-                
-                with open(filepath, "w", encoding="utf-8") as f:
-                    f.write(f"标题：{title}\n")
-                    f.write(f"来源：{item['url']}\n")
-                    f.write(f"摘要：{summary}\n")
-                    f.write(f"抓取时间：{time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-                    f.write(f"相关性评分：{get_relevance_score(item):.3f}\n")
-                    f.write("-" * 50 + "\n")
-                    f.write(item['content'][:3000])  # 限制内容长度
-                
+        for i, (item, (title, summary)) in enumerate(zip(accepted, descriptions), 1):
+            filepath = self._write_document(item, title, summary, i, output_dir)
+            if filepath is not None:
                 saved_files.append(filepath)
-                print(f"已保存：{filename}")
-                
-            except Exception as e:
-                print(f"保存文件 {i} 时出错：{e}")
-                continue
-        
         return saved_files
 
+    @staticmethod
+    def _describe_prompt(item: Dict) -> List[Dict]:
+        prompt = (
+            "请为以下内容生成一个简短的标题（20字以内）和一个简短的摘要（50字以内），"
+            "只输出 JSON：{\"title\": \"标题\", \"summary\": \"摘要\"}\n\n"
+            f"{item['content'][:1000]}"
+        )
+        return [{"role": "user", "content": prompt}]
+
+    async def _describe_one(self, item: Dict, semaphore: asyncio.Semaphore) -> tuple:
+        """为单份内容生成 (标题, 摘要)，失败时为 (None, None)"""
+        try:
+            response = await self.llm_runner.ainvoke(self._describe_prompt(item), semaphore)
+        except Exception as e:
+            print(f"标题/摘要生成失败：{e}")
+            return None, None
+        return parse_title_summary(response.content)
+    
+    def _is_near_duplicate(self, item: Dict, kept: List[Dict]) -> bool:
+        """与已收录文档或 kept 中的页面近重复时返回 True；否则记下签名与内容哈希"""
+        signature = self.dedup_index.signature(item['content'])
+        match = self.dedup_index.find(signature)
+        if match is None:
+            for other in kept:
+                sim = self.dedup_index.similarity(signature, other['signature'])
+                if sim >= self.dedup_index.threshold:
+                    match = {"url": other['url'], "similarity": sim}
+                    break
+        if match is not None:
+            print(f"跳过近重复页面：{item['url']}（与 {match['url']} 相似度 {match['similarity']:.2f}）")
+            return True
+        item['signature'] = signature
+        item['content_hash'] = hashlib.sha1(item['content'].encode("utf-8")).hexdigest()
+        return False
+
+    @staticmethod
+    def _score(item: Dict) -> float:
+        """ContentAnalysisTool 给出的综合评分"""
+        try:
+            analysis = json.loads(item['analysis'])
+            return analysis.get('total_score', 0)
+        except:
+            return 0
+    
+    def _write_document(self, item: Dict, title: Optional[str], summary: Optional[str], i: int,
+                        output_dir: str) -> Optional[str]:
+        """写出一份文档并收录到近重复索引，失败时返回 None"""
+        try:
+            # 按正文内容命名：同一内容总是同一个文件，不同查询之间不再互相覆盖
+            filename = f"web_{item['content_hash'][:16]}.txt"
+            filepath = os.path.join(output_dir, filename)
+            
+            if title is None:
+                title = f"网页内容 {i}"
+            if summary is None:
+                summary = "内容摘要生成失败"
+            
+            with open(filepath, "w", encoding="utf-8") as f:
+                f.write(f"标题：{title}\n")
+                f.write(f"来源：{item['url']}\n")
+                f.write(f"摘要：{summary}\n")
+                f.write(f"抓取时间：{time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+                f.write(f"相关性评分：{self._score(item):.3f}\n")
+                f.write("-" * 50 + "\n")
+                f.write(item['content'][:3000])  # 限制内容长度
+            
+            self.dedup_index.add(item['content_hash'], item['signature'], path=filepath, url=item['url'])
+            print(f"已保存：{filename}")
+            return filepath
+            
+        except Exception as e:
+            print(f"保存文件 {i} 时出错：{e}")
+            return None
+
 
 def web_research_agent_research(query: str, api_key: str, model_name: str, base_url: str, docs_dir: str = "rag_word") -> List[str]:
     """
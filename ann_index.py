@@ -0,0 +1,86 @@
+# ann_index.py
+
+import numpy as np
+import faiss
+
+
+class FaissANNBackend:
+    """基于 FAISS 的近似最近邻后端，用于源文档级相似度排序。
+
+    在预归一化的切片向量上建立内积索引（HNSW 或 IVF），
+    召回率/延迟通过 ef_search（HNSW）或 nprobe（IVF）调节。
+    """
+
+    def __init__(self,
+                 kind: str = "hnsw",
+                 hnsw_m: int = 32,
+                 ef_construction: int = 80,
+                 ef_search: int = 64,
+                 nlist: int = None,
+                 nprobe: int = 8):
+        if kind not in ("hnsw", "ivf"):
+            raise ValueError(f"不支持的 ANN 索引类型: {kind}")
+        self.kind = kind
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.nlist = nlist
+        self._ef_search = ef_search
+        self._nprobe = nprobe
+        self.index = None
+
+    def build(self, unit_vectors: np.ndarray):
+        vectors = np.ascontiguousarray(unit_vectors, dtype=np.float32)
+        n, dim = vectors.shape
+        if self.kind == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.ef_construction
+        else:
+            # 经验值：nlist ≈ 4·sqrt(N)，且每个聚类至少有若干训练样本
+            nlist = self.nlist or max(1, min(int(4 * np.sqrt(n)), n // 39 or 1))
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            self._quantizer = quantizer
+        index.add(vectors)
+        self.index = index
+        self._apply_search_params()
+        return self
+
+    # ---------- 召回率/延迟调节 ----------
+
+    @property
+    def ef_search(self) -> int:
+        return self._ef_search
+
+    @ef_search.setter
+    def ef_search(self, value: int):
+        self._ef_search = value
+        self._apply_search_params()
+
+    @property
+    def nprobe(self) -> int:
+        return self._nprobe
+
+    @nprobe.setter
+    def nprobe(self, value: int):
+        self._nprobe = value
+        self._apply_search_params()
+
+    def _apply_search_params(self):
+        if self.index is None:
+            return
+        if self.kind == "hnsw":
+            self.index.hnsw.efSearch = self._ef_search
+        else:
+            self.index.nprobe = self._nprobe
+
+    def search(self, queries: np.ndarray, k: int):
+        """返回 (内积得分, 行号)，形状均为 (len(queries), k)，缺失位置行号为 -1"""
+        if self.index is None:
+            raise ValueError("ANN 索引尚未构建，请先调用 build()")
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k = min(k, self.index.ntotal)
+        if self.kind == "hnsw":
+            # HNSW 的候选队列不能小于 k
+            self.index.hnsw.efSearch = max(self._ef_search, k)
+        return self.index.search(queries, k)
@@ -0,0 +1,206 @@
+# batch_runner.py
+
+import os
+import json
+import time
+import asyncio
+import argparse
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from hyde_cache import normalize_query
+from rag_prompt import user_content
+from rag_server import RAGService, add_service_arguments, service_from_args
+
+
+def read_queries(path: str) -> Iterator[Tuple[int, Dict]]:
+    """逐行读取 JSONL 查询，返回 (行号, 记录)；记录 id 取 id / request_id 字段，缺省为行号"""
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield lineno, {"id": f"line-{lineno}", "error": f"JSON 解析失败: {e}"}
+                continue
+            if not isinstance(record, dict):
+                record = {"query": record}
+            record = dict(record)
+            record["id"] = str(record.get("id") or record.get("request_id") or f"line-{lineno}")
+            yield lineno, record
+
+
+def load_checkpoint(output_path: str) -> Set[str]:
+    """从已有输出中恢复已成功完成的 id；中断时写了一半的末行会被截掉"""
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            f.truncate(complete)
+    for line in data[:complete].decode("utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "error" not in record:
+            done.add(record["id"])
+    return done
+
+
+class BatchRunner:
+    """离线批处理：流式读取 JSONL 查询，有界并发处理，结果逐条追加写入 JSONL。
+
+    - 规范化后相同的查询只做一次 HyDE 与检索，最终回答仍按各自的图片分别生成；
+      已完成的检索结果只保留最近的 retrieval_cache_size 个，进行中的检索总会被复用
+    - 输出文件即检查点：重跑时跳过已成功的 id，失败的记录会重试（以后写入的记录为准）
+    - 服务配置了结果存储时，之前回答过的 (查询, 图片, 语料版本) 直接取已有回答，Baseline 同理
+    """
+
+    def __init__(self,
+                 service: RAGService,
+                 workers: int = 8,
+                 baseline: bool = False,
+                 progress_every: int = 100,
+                 retrieval_cache_size: int = 256):
+        self.service = service
+        self.workers = workers
+        self.baseline = baseline
+        self.progress_every = progress_every
+        self.stats = {"done": 0, "failed": 0, "skipped": 0, "retrieval_reused": 0, "result_cached": 0}
+        self.retrieval_cache_size = retrieval_cache_size
+        # 规范化查询 → 检索任务，按最近使用排序
+        self._retrievals: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+
+    def run(self, input_path: str, output_path: str) -> Dict:
+        return asyncio.run(self.run_async(input_path, output_path))
+
+    async def run_async(self, input_path: str, output_path: str) -> Dict:
+        done = load_checkpoint(output_path)
+        if os.path.dirname(output_path):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        start = time.perf_counter()
+        # 队列有界：读取速度受处理速度约束，数千行的输入也不会整体读入内存
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        with open(output_path, "a", encoding="utf-8") as out:
+            consumers = [asyncio.ensure_future(self._consume(queue, out)) for _ in range(self.workers)]
+            try:
+                for lineno, record in read_queries(input_path):
+                    if record["id"] in done:
+                        self.stats["skipped"] += 1
+                        continue
+                    await queue.put((lineno, record))
+                for _ in consumers:
+                    await queue.put(None)
+                await asyncio.gather(*consumers)
+            finally:
+                for task in consumers:
+                    task.cancel()
+                await self.service.close()
+
+        elapsed = time.perf_counter() - start
+        print(f"批处理完成：成功 {self.stats['done']} 条，失败 {self.stats['failed']} 条，"
+              f"跳过已完成 {self.stats['skipped']} 条，复用检索 {self.stats['retrieval_reused']} 次，"
+              f"结果存储命中 {self.stats['result_cached']} 次，"
+              f"耗时 {elapsed:.1f}s")
+        return dict(self.stats, elapsed=elapsed)
+
+    async def _consume(self, queue: asyncio.Queue, out):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            lineno, record = item
+            result = await self._process(lineno, record)
+            # 每条结果写完立即刷新，中断后最多丢失正在处理的记录
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            finished = self.stats["done"] + self.stats["failed"]
+            if self.progress_every and finished % self.progress_every == 0:
+                print(f"已处理 {finished} 条")
+
+    async def _process(self, lineno: int, record: Dict) -> Dict:
+        result = {"id": record["id"], "line": lineno}
+        query, image_url = record.get("query"), record.get("image_url")
+        if "error" in record or not isinstance(query, str) or not query.strip():
+            self.stats["failed"] += 1
+            result["error"] = record.get("error", "缺少 query 字段")
+            return result
+
+        result.update(query=query, image_url=image_url)
+        try:
+            tasks = [self._answer(query, image_url)]
+            if self.baseline:
+                tasks.append(self._baseline(query, image_url))
+            outputs = await asyncio.gather(*tasks)
+        except Exception as e:
+            self.stats["failed"] += 1
+            result["error"] = f"{type(e).__name__}: {e}"
+            return result
+
+        result.update(outputs[0])
+        if self.baseline:
+            result["baseline"] = outputs[1]
+        self.stats["done"] += 1
+        return result
+
+    async def _answer(self, query: str, image_url: Optional[str]) -> Dict:
+        cached = await self.service.cached_answer(query, image_url)
+        if cached is not None:
+            self.stats["result_cached"] += 1
+            return cached
+        retrieval = await self._retrieve(query)
+        result = await self.service.generate(retrieval, image_url)
+        await self.service.store_answer(query, image_url, retrieval, result)
+        return result
+
+    def _retrieve(self, query: str) -> asyncio.Future:
+        """相同查询共享同一个检索任务（进行中的和已完成的都复用）"""
+        key = normalize_query(query)
+        future = self._retrievals.get(key)
+        if future is not None and not (future.done() and future.exception() is not None):
+            self.stats["retrieval_reused"] += 1
+            self._retrievals.move_to_end(key)
+            return future
+        future = asyncio.ensure_future(self.service.retrieve(query))
+        self._retrievals[key] = future
+        self._retrievals.move_to_end(key)
+        # 超出上限时淘汰最久未用的已完成检索（进行中的至多 workers 个，不淘汰）
+        excess = len(self._retrievals) - self.retrieval_cache_size
+        if excess > 0:
+            for old in [k for k, f in self._retrievals.items() if f.done()][:excess]:
+                del self._retrievals[old]
+        return future
+
+    async def _baseline(self, query: str, image_url: Optional[str]) -> str:
+        store, model = self.service.result_store, self.service.model_name
+        if store is not None:
+            record = await asyncio.to_thread(store.lookup, "baseline", model, query, image_url)
+            if record is not None:
+                self.stats["result_cached"] += 1
+                return record["answer"]
+        start = time.perf_counter()
+        response = await self.service.runner.ainvoke([{"role": "user", "content": user_content(query, image_url)}])
+        if store is not None:
+            await asyncio.to_thread(store.record, "baseline", model, query, response.content, image_url=image_url,
+                                    timings={"llm": time.perf_counter() - start})
+        return response.content
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量处理 JSONL 查询（有界并发、相同查询复用检索、断点续跑）")
+    parser.add_argument("input", help="输入 JSONL，每行形如 {\"id\": ..., \"query\": ..., \"image_url\": ...}")
+    parser.add_argument("--output", default="result/batch_results.jsonl")
+    parser.add_argument("--baseline", action="store_true", help="同时生成不带检索的 Baseline 回答")
+    parser.add_argument("--progress-every", type=int, default=100)
+    parser.add_argument("--retrieval-cache", type=int, default=256, help="保留的已完成检索结果数（相同查询复用）")
+    add_service_arguments(parser)
+    args = parser.parse_args()
+
+    runner = BatchRunner(service_from_args(args), workers=args.workers, baseline=args.baseline,
+                         progress_every=args.progress_every, retrieval_cache_size=args.retrieval_cache)
+    runner.run(args.input, args.output)
@@ -0,0 +1,86 @@
+# benchmark_ann.py
+
+import json
+import time
+import argparse
+from types import SimpleNamespace
+import numpy as np
+from ann_index import FaissANNBackend
+from similarity import KnowledgeBoundaryAwareSimilarity
+
+
+def make_synthetic_index(n_sources: int, chunks_per_source: int, dim: int = 384, n_topics: int = 50, seed: int = 0):
+    """生成带主题聚类的合成切片向量：同一主题下的源彼此相近"""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim))
+    sources, vectors = [], []
+    for s in range(n_sources):
+        center = topics[s % n_topics] + 0.5 * rng.normal(size=dim)
+        for _ in range(chunks_per_source):
+            sources.append(f"rag_word/synthetic_{s}.txt")
+            vectors.append(center + 0.8 * rng.normal(size=dim))
+    return SimpleNamespace(doc_texts=[""] * len(sources),
+                           doc_sources=sources,
+                           vectors=np.asarray(vectors, dtype=np.float32))
+
+
+def recall_at_k(exact, approx) -> float:
+    truth = {src for src, _ in exact}
+    return len(truth & {src for src, _ in approx}) / len(truth) if truth else 1.0
+
+
+def run(args):
+    index = make_synthetic_index(args.sources, args.chunks, dim=args.dim)
+    rng = np.random.default_rng(1)
+    exact_calc = KnowledgeBoundaryAwareSimilarity(docs_dir="", index=index, block_size=args.block_size)
+    targets = [exact_calc.sources[i] for i in rng.choice(len(exact_calc.sources), args.queries, replace=False)]
+
+    t0 = time.perf_counter()
+    exact_calc.source_similarity_matrix()
+    matrix_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    exact = {t: exact_calc.rank_similar_documents(t, top_k=args.top_k) for t in targets}
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(targets)
+    print(f"切片数 {len(index.doc_sources)}，源文档数 {len(exact_calc.sources)}，top_k={args.top_k}")
+    print(f"exact: 构建矩阵 {matrix_s:.2f}s，查询 {exact_ms:.3f} ms/次")
+
+    results = {"chunks": len(index.doc_sources), "sources": len(exact_calc.sources),
+               "top_k": args.top_k, "exact_matrix_s": matrix_s, "exact_query_ms": exact_ms, "ann": []}
+    configs = [("hnsw", "ef_search", v) for v in args.ef_search] + [("ivf", "nprobe", v) for v in args.nprobe]
+    backends = {}
+    for kind, knob, value in configs:
+        if kind not in backends:
+            t0 = time.perf_counter()
+            backend = FaissANNBackend(kind=kind)
+            calc = KnowledgeBoundaryAwareSimilarity(docs_dir="", index=index, ann_backend=backend)
+            backends[kind] = (calc, time.perf_counter() - t0)
+        calc, build_s = backends[kind]
+        setattr(calc.ann_backend, knob, value)
+
+        t0 = time.perf_counter()
+        approx = {t: calc.rank_similar_documents(t, top_k=args.top_k) for t in targets}
+        query_ms = (time.perf_counter() - t0) * 1000 / len(targets)
+        recall = float(np.mean([recall_at_k(exact[t], approx[t]) for t in targets]))
+        print(f"{kind:>4} {knob}={value:<4} recall@{args.top_k}={recall:.3f}  "
+              f"查询 {query_ms:.3f} ms/次  (建索引 {build_s:.2f}s)")
+        results["ann"].append({"kind": kind, knob: value, "recall": recall,
+                               "query_ms": query_ms, "build_s": build_s})
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比 ANN 后端与精确实现的 recall@k 与查询延迟")
+    parser.add_argument("--sources", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=5, help="每个源文档的切片数")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--block-size", type=int, default=1024)
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[16, 64, 256])
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[1, 8, 32])
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    run(parser.parse_args())
@@ -0,0 +1,407 @@
+# benchmark_e2e.py
+
+import io
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import threading
+import subprocess
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import ddgs
+import agent
+import corpus_index
+import main as main_module
+import query_rewriter
+from ann_index import FaissANNBackend
+from corpus_index import CorpusIndex
+from embedding_service import EmbeddingService
+from query_rewriter import QueryRewriter
+from scraper import ConcurrentScraper
+from similarity import KnowledgeBoundaryAwareSimilarity
+
+
+# ---------- 离线替身 ----------
+
+class FakeChatModel:
+    """ChatOpenAI 替身：延迟 = latency + 每个输出 token 的 per_token 耗时；
+    要求输出 JSON 的提示返回标题/摘要 JSON，其余返回 tokens 个填充字"""
+
+    def __init__(self, latency: float = 0.05, per_token: float = 0.0, tokens: int = 200, **_):
+        self.latency = latency
+        self.per_token = per_token
+        self.tokens = tokens
+        self.calls = 0
+
+    def _reply(self, messages) -> SimpleNamespace:
+        self.calls += 1
+        prompt = json.dumps(messages, ensure_ascii=False)
+        if "只输出 JSON" in prompt:
+            return SimpleNamespace(content='{"title": "合成标题", "summary": "合成摘要"}')
+        return SimpleNamespace(content="文" * self.tokens)
+
+    def _delay(self) -> float:
+        return self.latency + self.per_token * self.tokens
+
+    def invoke(self, messages, **kwargs):
+        time.sleep(self._delay())
+        return self._reply(messages)
+
+    async def ainvoke(self, messages, **kwargs):
+        await asyncio.sleep(self._delay())
+        return self._reply(messages)
+
+
+class FakeDDGS:
+    """DDGS 替身：返回指向本地 HTML 服务的固定搜索结果"""
+
+    def __init__(self, urls: List[str]):
+        self.urls = urls
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def text(self, query: str, max_results: int = 20):
+        for i, url in enumerate(self.urls[:max_results]):
+            yield {"title": f"{query} 结果 {i}", "link": url, "body": f"{query} 的相关介绍 {i}"}
+
+
+class HashEmbeddings(Embeddings):
+    """离线嵌入：按字符码位哈希到固定维度后归一化（向量化实现，10 万切片也能快速嵌入）"""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        vec = np.bincount((codes * 2654435761) % self.dim, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed_documents(self, texts):
+        return [self._embed(t).tolist() for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text).tolist()
+
+
+class FixtureServer:
+    """本地 HTTP 服务：/page/<i> 轮流返回 fixtures/html 下的样例页面"""
+
+    def __init__(self, fixtures_dir: str, latency: float = 0.0):
+        pages = [open(p, "rb").read() for p in sorted(glob.glob(os.path.join(fixtures_dir, "*.html")))]
+        if not pages:
+            raise SystemExit(f"未找到 HTML 样例: {fixtures_dir}")
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    i = int(self.path.rsplit("/", 1)[-1])
+                except ValueError:
+                    self.send_error(404)
+                    return
+                time.sleep(latency)
+                # 每个地址附加编号，避免页面之间完全相同
+                body = pages[i % len(pages)] + f"<p>页面编号 {i}</p>".encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def urls(self, n: int) -> List[str]:
+        host, port = self.server.server_address
+        return [f"http://{host}:{port}/page/{i}" for i in range(n)]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ---------- 合成语料 ----------
+
+def make_synthetic_corpus(docs_dir: str, n_chunks: int, chunks_per_file: int = 10,
+                          chunk_chars: int = 900, n_topics: int = 50, seed: int = 0) -> int:
+    """生成约 n_chunks 个切片的中文语料：段落长度略小于切片大小且以空行分隔，每段恰好切成一个切片。
+    同一主题的文档共享高频词，便于检索与相似度排序得到有意义的结果。已生成过同样参数的语料时直接复用"""
+    marker = os.path.join(docs_dir, ".synthetic.json")
+    params = {"n_chunks": n_chunks, "chunks_per_file": chunks_per_file,
+              "chunk_chars": chunk_chars, "n_topics": n_topics, "seed": seed}
+    if os.path.exists(marker):
+        with open(marker, "r", encoding="utf-8") as f:
+            if json.load(f) == params:
+                return len(glob.glob(os.path.join(docs_dir, "*.txt")))
+    shutil.rmtree(docs_dir, ignore_errors=True)
+    os.makedirs(docs_dir)
+
+    rng = np.random.default_rng(seed)
+    chars = np.array([chr(c) for c in range(0x4E00, 0x4E00 + 3000)])
+    topics = [rng.choice(chars, size=(40, 2)) for _ in range(n_topics)]
+    n_files = max(1, -(-n_chunks // chunks_per_file))
+    for f in range(n_files):
+        words = ["".join(w) for w in topics[f % n_topics]]
+        paragraphs = []
+        for _ in range(min(chunks_per_file, n_chunks - f * chunks_per_file)):
+            picks = rng.integers(0, len(words), size=chunk_chars // 3)
+            filler = rng.choice(chars, size=len(picks))
+            paragraphs.append("".join(words[p] + c for p, c in zip(picks, filler)) + "。")
+        with open(os.path.join(docs_dir, f"synthetic_{f}.txt"), "w", encoding="utf-8") as out:
+            out.write("\n\n".join(paragraphs))
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(params, f)
+    return n_files
+
+
+# ---------- 计时与内存 ----------
+
+def _reset_peak_rss():
+    """Linux 上把进程的峰值 RSS（VmHWM）重置为当前值，使每个阶段单独统计峰值"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+
+def summarize(samples: List[float], items: int = None) -> Dict:
+    """延迟分位数（毫秒）与吞吐（次/秒；items 为总处理条数时按条计）"""
+    arr = np.asarray(samples, dtype=np.float64) * 1000
+    total = float(np.sum(samples))
+    return {
+        "count": len(samples),
+        "mean_ms": float(arr.mean()),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p90_ms": float(np.percentile(arr, 90)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "max_ms": float(arr.max()),
+        "throughput_per_s": (items if items is not None else len(samples)) / total if total else 0.0,
+    }
+
+
+def measure(fn, repeat: int = 1, items_per_call: int = None) -> Dict:
+    _reset_peak_rss()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    stats = summarize(samples, items_per_call * repeat if items_per_call else None)
+    stats["peak_rss_mb"] = _peak_rss_mb()
+    return stats
+
+
+def measure_import(module: str, repeat: int = 3) -> Dict:
+    """在全新的解释器中测量 import 耗时（不含解释器自身的启动时间），跟踪启动速度回退"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return summarize(samples)
+
+
+@contextlib.contextmanager
+def offline_stubs(llm_kwargs: Dict, search_urls: List[str], dim: int):
+    """把 LLM、搜索与嵌入模型替换为离线替身"""
+    service = EmbeddingService("benchmark-hash", cache_dir=None, model=HashEmbeddings(dim))
+    patches = [
+        (main_module, "chat_model", lambda *a, **kw: FakeChatModel(**llm_kwargs)),
+        (query_rewriter, "chat_model", lambda *a, **kw: FakeChatModel(**llm_kwargs)),
+        (agent, "chat_model", lambda *a, **kw: FakeChatModel(**llm_kwargs)),
+        (ddgs, "DDGS", lambda *a, **kw: FakeDDGS(search_urls)),
+        (corpus_index, "get_embedding_service", lambda *a, **kw: service),
+    ]
+    saved = [(obj, name, getattr(obj, name)) for obj, name, _ in patches]
+    for obj, name, value in patches:
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for obj, name, value in saved:
+            setattr(obj, name, value)
+
+
+# ---------- 各阶段 ----------
+
+def bench_size(args, n_chunks: int, urls: List[str]) -> Dict:
+    workdir = os.path.join(args.workdir, f"chunks_{n_chunks}")
+    docs_dir = os.path.join(workdir, "rag_word")
+    index_dir = os.path.join(workdir, "rag_index")
+    n_files = make_synthetic_corpus(docs_dir, n_chunks, chunks_per_file=args.chunks_per_file)
+    results = {}
+
+    results["index_build"] = measure(lambda: CorpusIndex(docs_dir, index_dir=index_dir, rebuild=True),
+                                     items_per_call=n_chunks)
+    corpus = CorpusIndex(docs_dir, index_dir=index_dir)
+    results["index_load"] = measure(lambda: CorpusIndex(docs_dir, index_dir=index_dir), repeat=3)
+    print(f"  语料 {n_files} 个文件 / {len(corpus)} 个切片；"
+          f"建索引 {results['index_build']['mean_ms'] / 1000:.2f}s，"
+          f"加载 {results['index_load']['p50_ms']:.1f}ms")
+
+    rewriter = QueryRewriter(api_key="bench", model_name="fake", base_url="http://127.0.0.1:1",
+                             docs_dir=docs_dir, index=corpus)
+    queries = iter([f"合成查询 {i} {corpus.doc_texts[i % len(corpus)][:20]}" for i in range(args.queries)])
+    results["rewrite_query_with_hyde"] = measure(lambda: rewriter.rewrite_query_with_hyde(next(queries), k=3),
+                                                 repeat=args.queries)
+
+    use_ann = args.rank_backend == "hnsw" or (args.rank_backend == "auto" and len(corpus) > args.exact_limit)
+    t0 = time.perf_counter()
+    sim_calc = KnowledgeBoundaryAwareSimilarity(docs_dir=docs_dir, index=corpus,
+                                                ann_backend=FaissANNBackend("hnsw") if use_ann else None)
+    if not use_ann:
+        sim_calc.source_similarity_matrix()
+    prepare_s = time.perf_counter() - t0
+    targets = iter([sim_calc.sources[i % len(sim_calc.sources)] for i in range(args.queries)])
+    results["rank_similar_documents"] = measure(
+        lambda: sim_calc.rank_similar_documents(next(targets), top_k=5), repeat=args.queries)
+    results["rank_similar_documents"].update(backend="hnsw" if use_ann else "exact", prepare_s=prepare_s)
+
+    def scrape():
+        with ConcurrentScraper(max_concurrency=8, per_host_limit=8) as scraper:
+            scraper.scrape(urls[:args.pages])
+
+    results["scrape"] = measure(scrape, repeat=args.scrape_runs, items_per_call=args.pages)
+
+    # 完整 main()：在独立工作目录中运行（main 使用相对路径 rag_word/、rag_index/）
+    main_dir = os.path.join(workdir, "main")
+    shutil.rmtree(main_dir, ignore_errors=True)
+    shutil.copytree(docs_dir, os.path.join(main_dir, "rag_word"))
+    cwd = os.getcwd()
+    os.chdir(main_dir)
+    try:
+        quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+        with quiet:
+            # 首次运行包含建索引与网页抓取；之后的运行复用磁盘索引、网页缓存与 HyDE 缓存。
+            # main_warm 每次先清空结果存储，与引入结果存储之前的 main_warm 可比；
+            # main_cached 为相同查询直接取自结果存储的耗时
+            def main_uncached():
+                for path in glob.glob(os.path.join("result", "results.db*")):
+                    os.remove(path)
+                main_module.main()
+
+            results["main_cold"] = measure(main_uncached)
+            results["main_warm"] = measure(main_uncached, repeat=args.main_runs)
+            results["main_cached"] = measure(main_module.main, repeat=args.main_runs)
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def _version() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results: Dict, baseline: Dict):
+    """按阶段对比 p50 延迟与吞吐：比值 < 1 表示当前版本更快"""
+    print(f"\n与 {baseline.get('version') or '基线'} 对比（p50 当前/基线）：")
+    groups = [("startup", results.get("startup", {}), baseline.get("startup", {}))]
+    groups += [(size, stages, baseline.get("sizes", {}).get(size, {})) for size, stages in results["sizes"].items()]
+    for size, stages, old in groups:
+        for stage, stats in stages.items():
+            if stage in old and old[stage]["p50_ms"]:
+                ratio = stats["p50_ms"] / old[stage]["p50_ms"]
+                print(f"  {size:>8} {stage:<26}{old[stage]['p50_ms']:>10.2f} → {stats['p50_ms']:>10.2f} ms"
+                      f"  ({ratio:.2f}x)")
+
+
+def run(args) -> Dict:
+    llm_kwargs = {"latency": args.llm_latency, "per_token": args.llm_per_token, "tokens": args.llm_tokens}
+    results = {"version": _version(), "config": {k: v for k, v in vars(args).items() if k != "compare"},
+               "startup": {}, "sizes": {}}
+    if args.import_runs:
+        print("=== 启动耗时（import） ===")
+        for module in ("main", "rag_server", "batch_runner"):
+            stats = results["startup"][f"import_{module}"] = measure_import(module, args.import_runs)
+            print(f"  import {module:<20}p50 {stats['p50_ms']:>10.2f}ms")
+    with FixtureServer(args.fixtures, latency=args.web_latency) as server:
+        urls = server.urls(max(args.pages, 20))
+        with offline_stubs(llm_kwargs, urls, args.dim):
+            for n_chunks in args.sizes:
+                print(f"=== 语料规模 {n_chunks} 个切片 ===")
+                stages = bench_size(args, n_chunks, urls)
+                results["sizes"][str(n_chunks)] = stages
+                for stage, stats in stages.items():
+                    rss = f"{stats['peak_rss_mb']:.0f}MB" if stats.get("peak_rss_mb") else "-"
+                    print(f"  {stage:<26}p50 {stats['p50_ms']:>10.2f}ms  p90 {stats['p90_ms']:>10.2f}ms  "
+                          f"p99 {stats['p99_ms']:>10.2f}ms  {stats['throughput_per_s']:>9.1f}/s  峰值RSS {rss}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return results
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="端到端性能基准：离线替身 LLM / 搜索 / 网页，合成多种规模的语料")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="语料切片数")
+    parser.add_argument("--workdir", default="bench_data", help="合成语料与索引的存放目录（可复用）")
+    parser.add_argument("--chunks-per-file", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=384, help="替身嵌入维度")
+    parser.add_argument("--queries", type=int, default=50, help="HyDE 重写与相似度排序的查询次数")
+    parser.add_argument("--rank-backend", choices=["auto", "exact", "hnsw"], default="auto")
+    parser.add_argument("--exact-limit", type=int, default=20000, help="auto 模式下超过该切片数改用 HNSW")
+    parser.add_argument("--pages", type=int, default=20, help="每次抓取的网页数")
+    parser.add_argument("--scrape-runs", type=int, default=5)
+    parser.add_argument("--main-runs", type=int, default=3, help="完整 main() 的热运行次数")
+    parser.add_argument("--import-runs", type=int, default=3, help="测量入口模块 import 耗时的次数（0 表示跳过）")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="替身 LLM 每次调用的基础延迟（秒）")
+    parser.add_argument("--llm-per-token", type=float, default=0.0, help="替身 LLM 每个输出 token 的耗时（秒）")
+    parser.add_argument("--llm-tokens", type=int, default=200, help="替身 LLM 的输出长度")
+    parser.add_argument("--web-latency", type=float, default=0.02, help="本地网页服务的响应延迟（秒）")
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "html"))
+    parser.add_argument("--verbose", action="store_true", help="显示 main() 的输出")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
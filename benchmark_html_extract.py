@@ -0,0 +1,74 @@
+# benchmark_html_extract.py
+
+import os
+import glob
+import json
+import time
+import argparse
+from html_extract import MAX_CHARS, extract_text_from_bytes, extract_text_streaming
+
+
+def _chunks(raw: bytes, size: int):
+    for i in range(0, len(raw), size):
+        yield raw[i:i + size]
+
+
+def _timeit(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def run(args):
+    files = sorted(glob.glob(os.path.join(args.fixtures, "*.html")))
+    if not files:
+        raise SystemExit(f"未找到 HTML 样例: {args.fixtures}")
+
+    results = []
+    print(f"{'样例':<28}{'大小KB':>8}{'一致':>6}{'BS4 ms':>10}{'流式 ms':>10}{'加速':>8}{'去nav字数':>10}")
+    for path in files:
+        raw = open(path, "rb").read()
+        # 放大页面，模拟远超字符预算的大网页
+        raw = raw * args.scale
+
+        reference = extract_text_from_bytes(raw, max_chars=args.max_chars)
+        streamed = extract_text_streaming(_chunks(raw, args.chunk_size), max_chars=args.max_chars,
+                                          skip_tags=("script", "style"))
+        without_nav = extract_text_streaming(_chunks(raw, args.chunk_size), max_chars=args.max_chars)
+
+        bs4_s = _timeit(lambda: extract_text_from_bytes(raw, max_chars=args.max_chars), args.repeat)
+        stream_s = _timeit(lambda: extract_text_streaming(_chunks(raw, args.chunk_size),
+                                                          max_chars=args.max_chars), args.repeat)
+        row = {
+            "fixture": os.path.basename(path),
+            "bytes": len(raw),
+            "equivalent": reference == streamed,
+            "bs4_ms": bs4_s * 1000,
+            "streaming_ms": stream_s * 1000,
+            "speedup": bs4_s / stream_s if stream_s else float("inf"),
+            "bs4_mb_s": len(raw) / bs4_s / 1e6,
+            "streaming_mb_s": len(raw) / stream_s / 1e6,
+            "chars": len(reference),
+            "chars_without_nav": len(without_nav),
+        }
+        results.append(row)
+        print(f"{row['fixture']:<28}{len(raw) / 1024:>8.1f}{'是' if row['equivalent'] else '否':>6}"
+              f"{row['bs4_ms']:>10.2f}{row['streaming_ms']:>10.2f}{row['speedup']:>7.1f}x"
+              f"{row['chars_without_nav']:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比 BeautifulSoup 全量解析与流式正文提取的吞吐和输出一致性")
+    parser.add_argument("--fixtures", default="fixtures/html", help="HTML 样例目录")
+    parser.add_argument("--max-chars", type=int, default=MAX_CHARS)
+    parser.add_argument("--chunk-size", type=int, default=16 * 1024)
+    parser.add_argument("--scale", type=int, default=1, help="把每个样例重复若干次以模拟大网页")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    run(parser.parse_args())
@@ -0,0 +1,71 @@
+# benchmark_vector_store.py
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+from vector_store import VectorStore
+
+
+def make_vectors(n: int, dim: int = 384, rank: int = 64, seed: int = 0) -> np.ndarray:
+    """低秩 + 噪声的单位向量，近似句向量模型输出的分布（能量集中在少数方向上）"""
+    rng = np.random.default_rng(seed)
+    basis = rng.normal(size=(rank, dim))
+    x = rng.normal(size=(n, rank)) @ basis + 0.3 * rng.normal(size=(n, dim))
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x.astype(np.float32)
+
+
+def recall_at_k(truth: np.ndarray, approx: np.ndarray) -> float:
+    return float(np.mean([len(set(t) & set(a)) / len(t) for t, a in zip(truth, approx)]))
+
+
+def run(args):
+    vectors = make_vectors(args.n + args.queries, dim=args.dim)
+    base, queries = vectors[:args.n], vectors[args.n:]
+    configs = [("float32", None), ("sq8", None)] + [("pq", m) for m in args.pq_m]
+    print(f"向量数 {args.n}，维度 {args.dim}，查询 {args.queries} 条，k={args.k}")
+
+    results = {"n": args.n, "dim": args.dim, "k": args.k, "stores": []}
+    truth = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind, m in configs:
+            t0 = time.perf_counter()
+            store = VectorStore.build(base, kind, pq_m=m)
+            build_s = time.perf_counter() - t0
+            path = os.path.join(tmp, f"{kind}_{m}.bin")
+            store.save(path)
+            store = VectorStore.open(path)
+
+            t0 = time.perf_counter()
+            _, ids = store.search(queries, args.k)
+            query_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+            if truth is None:
+                truth = ids
+            entry = {"kind": kind, "pq_m": m, "bytes_per_vector": store.nbytes / len(store),
+                     "file_mb": os.path.getsize(path) / 2 ** 20, "build_s": build_s, "query_ms": query_ms,
+                     f"recall@{args.k}": recall_at_k(truth, ids),
+                     "top1": float(np.mean(truth[:, 0] == ids[:, 0]))}
+            label = kind if m is None else f"{kind} m={m}"
+            print(f"{label:>10}  {entry['bytes_per_vector']:7.1f} 字节/向量  文件 {entry['file_mb']:7.2f} MB  "
+                  f"建库 {build_s:6.2f}s  查询 {query_ms:6.3f} ms/次  "
+                  f"recall@{args.k}={entry[f'recall@{args.k}']:.3f}  top1={entry['top1']:.3f}")
+            results["stores"].append(entry)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比 float32 / sq8 / pq 向量存储的内存占用、查询延迟与 recall@k")
+    parser.add_argument("--n", type=int, default=20000, help="库中向量数")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--pq-m", type=int, nargs="*", default=[48, 96], help="乘积量化的分段数")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    run(parser.parse_args())
@@ -0,0 +1,128 @@
+# bm25_index.py
+
+import re
+import unicodedata
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+# 连续的中日韩字符段，或连续的字母/数字（按词切分）
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+_TOKEN_RE = re.compile(f"[{_CJK}]+|[0-9a-z_]+")
+_CJK_RE = re.compile(f"[{_CJK}]")
+
+
+def tokenize(text: str) -> List[str]:
+    """中日韩文本切成单字 + 相邻二字组，字母数字按词切分（统一全半角、小写）"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if _CJK_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    """基于数组的倒排索引 + BM25 打分。
+
+    词表映射到连续编号，倒排表以 CSR 形式存放在三个 numpy 数组中：
+    offsets[t]:offsets[t+1] 为词 t 的区间，doc_ids / tfs 为对应的文档编号与词频。
+    """
+
+    def __init__(self, texts: Sequence[str] = (), k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.build(texts)
+
+    def build(self, texts: Sequence[str]) -> "BM25Index":
+        token_ids, doc_ids, doc_lens = [], [], np.zeros(len(texts), dtype=np.float32)
+        for d, text in enumerate(texts):
+            ids = [self.vocab.setdefault(tok, len(self.vocab)) for tok in tokenize(text)]
+            token_ids.extend(ids)
+            doc_ids.extend([d] * len(ids))
+            doc_lens[d] = len(ids)
+
+        n_terms = len(self.vocab)
+        pairs = np.asarray(token_ids, dtype=np.int64) * max(len(texts), 1) + np.asarray(doc_ids, dtype=np.int64)
+        # (词, 文档) 去重计数即词频；unique 的结果已按词再按文档排好序
+        pairs, tfs = np.unique(pairs, return_counts=True)
+        terms = pairs // max(len(texts), 1)
+        self.doc_ids = (pairs % max(len(texts), 1)).astype(np.int32)
+        self.tfs = tfs.astype(np.float32)
+        self.offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=n_terms), out=self.offsets[1:])
+
+        self.doc_lens = doc_lens
+        self.n_docs = len(texts)
+        self.avg_len = float(doc_lens.mean()) if len(texts) else 0.0
+        df = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        return self
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def _query_terms(self, query: str) -> np.ndarray:
+        ids = {self.vocab[tok] for tok in tokenize(query) if tok in self.vocab}
+        return np.fromiter(ids, dtype=np.int64, count=len(ids))
+
+    def _postings(self, terms: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """把若干词的倒排区间拼成 (词序号, 文档编号, 词频) 三个平铺数组"""
+        starts, ends = self.offsets[terms], self.offsets[terms + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            return np.zeros(0, np.int64), np.zeros(0, np.int32), np.zeros(0, np.float32)
+        owner = np.repeat(np.arange(len(terms)), lengths)
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[owner]
+        return owner, self.doc_ids[positions], self.tfs[positions]
+
+    def scores(self, query: str) -> np.ndarray:
+        """查询对全部文档的 BM25 得分（查询词去重）"""
+        result = np.zeros(self.n_docs, dtype=np.float32)
+        terms = self._query_terms(query)
+        if not terms.size or not self.n_docs:
+            return result
+        owner, docs, tfs = self._postings(terms)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lens[docs] / (self.avg_len or 1.0))
+        np.add.at(result, docs, self.idf[terms][owner] * tfs * (self.k1 + 1) / (tfs + norm))
+        return result
+
+    def coverage(self, query: str) -> np.ndarray:
+        """每个文档包含的查询词占查询词总数的比例"""
+        unique = set(tokenize(query))
+        result = np.zeros(self.n_docs, dtype=np.float32)
+        if not unique:
+            return result
+        terms = self._query_terms(query)
+        if terms.size:
+            _, docs, _ = self._postings(terms)
+            np.add.at(result, docs, 1.0)
+        return result / len(unique)
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回得分为正的前 k 个文档 (编号, 得分)，按得分降序"""
+        scores = self.scores(query)
+        hits = np.flatnonzero(scores > 0)
+        if k <= 0 or not hits.size:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        if hits.size > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.lexsort((hits, -scores[hits]))]
+        return hits, scores[hits]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], rrf_k: int = 60) -> List[Tuple[int, float]]:
+    """倒数排名融合：score(d) = Σ 1 / (rrf_k + rank)，rank 从 1 开始；
+    得分按理论最大值（每路都排第一）归一化到 [0, 1]，同分按首次出现顺序"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            scores[int(doc)] = scores.get(int(doc), 0.0) + 1.0 / (rrf_k + rank)
+    best = len(rankings) / (rrf_k + 1) if rankings else 1.0
+    fused = sorted(scores.items(), key=lambda kv: -kv[1])
+    return [(doc, score / best) for doc, score in fused]
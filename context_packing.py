@@ -0,0 +1,191 @@
+# context_packing.py
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from rag_prompt import CONTEXT_SEPARATOR
+
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+# 估计时的计数单位：单个中日韩字符 / 连续字母数字 / 单个其他非空白字符
+_UNIT_RE = re.compile(f"[{_CJK}]|[0-9A-Za-z]+|[^\\s0-9A-Za-z{_CJK}]")
+# 截断时优先停在句末
+_SENTENCE_END_RE = re.compile(r"[。！？；!?;\n]")
+
+
+def estimate_tokens(text: str) -> int:
+    """不依赖词表的 token 估计：中日韩字符与标点各算 1 个，字母数字串每 4 个字符算 1 个"""
+    total = 0
+    for unit in _UNIT_RE.findall(text):
+        total += -(-len(unit) // 4) if unit[0].isascii() and unit[0].isalnum() else 1
+    return total
+
+
+class TokenCounter:
+    """token 计数：encoding 指定 tiktoken 编码时第一次计数才加载它，
+    未安装或离线无法下载词表时退回 estimate_tokens；计数结果按文本缓存（切片在查询间反复出现）"""
+
+    def __init__(self, encoding: Optional[str] = "cl100k_base", cache_size: int = 65536):
+        self.encoding_name = encoding
+        # None：尚未加载；False：不可用
+        self._encoding = None if encoding else False
+        self.count = lru_cache(maxsize=cache_size)(self.count_uncached)
+
+    def _load(self):
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        except Exception as e:
+            print(f"无法加载 tiktoken 编码 {self.encoding_name}，改用字符估计: {e}")
+            self._encoding = False
+
+    def count_uncached(self, text: str) -> int:
+        if self._encoding is None:
+            self._load()
+        if self._encoding is False:
+            return estimate_tokens(text)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def __call__(self, text: str) -> int:
+        return self.count(text)
+
+
+_default_counter: Optional[TokenCounter] = None
+
+
+def default_token_counter() -> TokenCounter:
+    """进程内共享的计数器（缓存跨查询复用）"""
+    global _default_counter
+    if _default_counter is None:
+        _default_counter = TokenCounter()
+    return _default_counter
+
+
+def span_overlap(left: str, right: str, max_chars: int, min_chars: int = 20) -> int:
+    """left 的结尾与 right 的开头重合的最长字符数（切分器 chunk_overlap 造成的重复片段），不足 min_chars 视为 0"""
+    for n in range(min(len(left), len(right), max_chars), min_chars - 1, -1):
+        if left.endswith(right[:n]):
+            return n
+    return 0
+
+
+class ContextPacker:
+    """按 token 预算装配最终 RAG 提示的上下文。
+
+    切片按得分从高到低依次装入：同一来源中与已装入片段首尾重合的部分（切分重叠）去掉后拼接到该片段上，
+    被已装入内容完全包含的切片直接跳过；放不下的切片在句末截断，剩余预算不足 min_chunk_tokens 时停止。
+    预算包括查询本身（HyDE 查询与上下文一起作为用户消息发送）。
+    """
+
+    def __init__(self, budget_tokens: int = 2048, counter: Optional[TokenCounter] = None,
+                 overlap_chars: int = 200, min_chunk_tokens: int = 32):
+        self.budget_tokens = budget_tokens
+        self.counter = counter or default_token_counter()
+        self.overlap_chars = overlap_chars
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def _trim(self, text: str, budget: int, keep_end: bool = False) -> str:
+        """不超过 budget 个 token 的最长前缀（keep_end 时为最长后缀），尽量停在句子边界"""
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            part = text[len(text) - mid:] if keep_end else text[:mid]
+            if self.counter.count_uncached(part) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        if keep_end:
+            start = len(text) - lo
+            m = _SENTENCE_END_RE.search(text, start)
+            if m and m.end() - start <= lo // 2:
+                return text[m.end():]
+            return text[start:]
+        ends = [m.end() for m in _SENTENCE_END_RE.finditer(text, 0, lo)]
+        if ends and ends[-1] >= lo // 2:
+            return text[:ends[-1]]
+        return text[:lo]
+
+    def _join_adjacent(self, pieces: List[List[str]], target: List[str]) -> int:
+        """拼接后的片段可能与同源的另一个片段首尾相接（中间的切片后到），合并为一个；返回去掉的重叠字符数"""
+        for other in pieces:
+            if other is target or other[0] != target[0]:
+                continue
+            n = span_overlap(target[1], other[1], self.overlap_chars)
+            if n:
+                target[1] += other[1][n:]
+            else:
+                n = span_overlap(other[1], target[1], self.overlap_chars)
+                if not n:
+                    continue
+                target[1] = other[1][:-n] + target[1]
+            pieces.remove(other)
+            return n + self._join_adjacent(pieces, target)
+        return 0
+
+    def pack(self, docs, scores: Optional[Sequence[float]] = None, query: str = "") -> Tuple[str, Dict]:
+        """返回 (上下文文本, 报告)。scores 缺省时按 docs 的顺序视为得分从高到低；
+        报告中 original_tokens 为直接拼接全部切片的 token 数，saved_tokens 为节省的 token 数"""
+        count = self.counter
+        sep_tokens = count(CONTEXT_SEPARATOR)
+        original = CONTEXT_SEPARATOR.join(d.page_content for d in docs)
+        budget = self.budget_tokens - count.count_uncached(query)
+        order = range(len(docs)) if scores is None else sorted(range(len(docs)), key=lambda i: -float(scores[i]))
+
+        # 已装入的片段：[来源, 文本]，按装入顺序排列
+        pieces: List[List[str]] = []
+        used, trimmed, merged_chars, skipped = 0, 0, 0, 0
+        for i in order:
+            text, source = docs[i].page_content, docs[i].metadata.get("source")
+            if any(text in p[1] for p in pieces):
+                merged_chars += len(text)
+                continue
+            target, added, prepend = None, text, False
+            for piece in pieces:
+                if piece[0] != source:
+                    continue
+                n = span_overlap(piece[1], text, self.overlap_chars)
+                if n:
+                    target, added = piece, text[n:]
+                    break
+                n = span_overlap(text, piece[1], self.overlap_chars)
+                if n:
+                    target, added, prepend = piece, text[:-n], True
+                    break
+            merged_chars += len(text) - len(added)
+
+            # 新片段之间用分隔符连接，首个片段不需要
+            sep = sep_tokens if target is None and pieces else 0
+            cost = count(added) + sep
+            if used + cost > budget:
+                room = budget - used - sep
+                # 向前拼接时保留与原片段相接的末尾，否则保留开头
+                added = self._trim(added, room, keep_end=prepend) if room >= self.min_chunk_tokens else ""
+                if not added:
+                    skipped += 1
+                    continue
+                trimmed += 1
+                cost = count.count_uncached(added) + sep
+            if target is None:
+                pieces.append([source, added])
+            else:
+                target[1] = added + target[1] if prepend else target[1] + added
+                merged_chars += self._join_adjacent(pieces, target)
+            # 累加各片段（带缓存）的计数与分隔符，不重新切分已装入的整段上下文
+            used += cost
+
+        context = CONTEXT_SEPARATOR.join(p[1] for p in pieces)
+        original_tokens = count.count_uncached(original)
+        context_tokens = count.count_uncached(context)
+        report = {
+            "budget_tokens": self.budget_tokens,
+            "original_tokens": original_tokens,
+            "context_tokens": context_tokens,
+            "saved_tokens": max(original_tokens - context_tokens, 0),
+            "chunks": len(docs),
+            "pieces": len(pieces),
+            "trimmed": trimmed,
+            "skipped": skipped,
+            "deduplicated_chars": merged_chars,
+        }
+        return context, report
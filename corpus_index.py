@@ -0,0 +1,454 @@
+# corpus_index.py
+
+import os
+import json
+import hashlib
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from embedding_service import DEFAULT_EMBEDDING_MODEL, get_embedding_service
+from vector_store import KINDS, VectorStore
+import tracing
+
+# LangChain 的切分模块在第一次用到时才导入：
+# 只读缓存或持久化相似度矩阵的路径不需要加载它们
+
+
+def content_hash(data) -> str:
+    """文件/切片内容哈希"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+# 工作进程内按 (chunk_size, chunk_overlap) 缓存的切分器
+_worker_splitters: Dict[Tuple[int, int], object] = {}
+
+
+def _split_in_worker(path: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """进程池任务：读取并切分单个文件，只把切片文本传回主进程"""
+    splitter = _worker_splitters.get((chunk_size, chunk_overlap))
+    if splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        splitter = _worker_splitters[(chunk_size, chunk_overlap)] = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    with open(path, "r", encoding="utf-8") as f:
+        return splitter.split_text(f.read())
+
+
+def _list_txt_files(docs_dir: str) -> List[str]:
+    return sorted(str(p) for p in Path(docs_dir).glob("**/*.txt") if p.is_file())
+
+
+class CorpusIndex:
+    """共享语料索引：对 docs_dir 只做一次 加载→切分→嵌入，并持久化到 index_dir。
+
+    HyDE 检索（QueryRewriter）与相似度计算（KnowledgeBoundaryAwareSimilarity）
+    共用同一份切片、来源与向量：向量只存一份，即 vector_store.VectorStore 的单个 mmap 文件
+    （vector_format 可选 float32 / sq8 / pq），检索直接在其编码上暴力计算；
+    按文件内容哈希增量更新：只嵌入新增或变化的切片，删除/覆盖文件的旧向量会被移除。
+
+    摄取是流式的：文件在进程池中读取与切分，切片逐个产出，攒满 embed_batch_size 个就送去嵌入，
+    读取/切分与嵌入互相重叠，内存中不会同时存在全部 Document。
+    """
+
+    # 变化文件少于该数目时在主进程内顺序切分，省去进程池启动开销
+    POOL_MIN_FILES = 8
+
+    # 向量存储按语料版本命名（vectors.<版本>.bin），manifest 记录当前文件名：
+    # 更新时写入新文件，不覆盖其他 CorpusIndex / 相似度计算 / 服务仍在 mmap 的旧文件
+    # （Windows 上替换或删除已映射的文件会报 PermissionError）
+    VECTOR_STORE_FILE = "vectors.bin"
+    # 旧版本的 FAISS 索引与向量文件，重新保存时清理
+    LEGACY_FILES = ("index.faiss", "vectors.npy")
+    CHUNKS_FILE = "chunks.json"
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self,
+                 docs_dir: str,
+                 index_dir: str = "rag_index",
+                 embedding_model_name: str = DEFAULT_EMBEDDING_MODEL,
+                 embeddings=None,
+                 chunk_size: int = 1000,
+                 chunk_overlap: int = 200,
+                 rebuild: bool = False,
+                 vector_format: str = "float32",
+                 pq_m: Optional[int] = None,
+                 ingest_workers: Optional[int] = None,
+                 embed_batch_size: int = 256):
+        if vector_format not in KINDS:
+            raise ValueError(f"未知的向量编码: {vector_format}（可选 {', '.join(KINDS)}）")
+        self.docs_dir = docs_dir
+        self.index_dir = index_dir
+        self.embedding_model_name = embedding_model_name
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.vector_format = vector_format
+        self.pq_m = pq_m
+        # 读取/切分文件的进程数（默认 CPU 核数）与每批送去嵌入的切片数
+        self.ingest_workers = ingest_workers or os.cpu_count() or 1
+        self.embed_batch_size = embed_batch_size
+        self._embeddings = embeddings
+        self._bm25 = None
+        self._splitter = None
+
+        self.doc_texts: List[str] = []
+        self.doc_sources: List[str] = []
+        self.chunk_hashes: List[str] = []
+        self.vector_store: Optional[VectorStore] = None
+        # 当前 manifest 引用的向量存储文件名
+        self._vector_file: Optional[str] = None
+        self._manifest_stale = False
+        # path -> {"size", "mtime", "sha1"}
+        self._files: Dict[str, Dict] = {}
+        self.last_update: Dict = {}
+
+        if rebuild or not self.load():
+            self._reset()
+        self.last_update = self.update()
+
+    # ---------- 嵌入模型（按需加载） ----------
+
+    @property
+    def embeddings(self):
+        # 默认使用进程内共享的嵌入服务：模型只加载一次，向量按内容哈希缓存
+        if self._embeddings is None:
+            self._embeddings = get_embedding_service(self.embedding_model_name)
+        return self._embeddings
+
+    @property
+    def splitter(self):
+        if self._splitter is None:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+            self._splitter = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size,
+                                                            chunk_overlap=self.chunk_overlap)
+        return self._splitter
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """全部切片向量（float32）；float32 编码时是 mmap 文件上的零拷贝视图，量化编码时为解码结果"""
+        if self.vector_store is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self.vector_store.reconstruct()
+
+    # ---------- 构建与增量更新 ----------
+
+    def _reset(self):
+        self.doc_texts, self.doc_sources, self.chunk_hashes = [], [], []
+        self.vector_store = None
+        self._vector_file = None
+        self._files = {}
+        self._bm25 = None
+
+    def _list_files(self) -> List[str]:
+        return _list_txt_files(self.docs_dir)
+
+    @classmethod
+    def stored_fingerprint(cls, docs_dir: str, index_dir: str = "rag_index") -> Optional[str]:
+        """只读 manifest 得到上次保存的语料版本，不读取切片与向量。
+        docs_dir 中的文件与清单不一致（增删或大小/修改时间变化）时返回 None，由调用方按未知版本处理"""
+        try:
+            with open(os.path.join(index_dir, cls.MANIFEST_FILE), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        files = manifest.get("files") or {}
+        paths = _list_txt_files(docs_dir)
+        if manifest.get("fingerprint") is None or sorted(files) != paths:
+            return None
+        for path in paths:
+            st = os.stat(path)
+            if files[path]["size"] != st.st_size or files[path]["mtime"] != st.st_mtime:
+                return None
+        return manifest["fingerprint"]
+
+    def fingerprint(self) -> str:
+        """语料版本：切分参数、切片内容哈希与来源的摘要，切片有任何增删改或来源改名都会变化"""
+        return content_hash(json.dumps([self._settings(), self.chunk_hashes, self.doc_sources], ensure_ascii=False))
+
+    def _settings(self) -> Dict:
+        return {
+            "embedding_model_name": self.embedding_model_name,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "vector_format": self.vector_format,
+            "pq_m": self.pq_m,
+        }
+
+    def _scan(self):
+        """对比磁盘与清单：大小/修改时间未变的文件直接沿用旧哈希，否则重新计算内容哈希"""
+        current, changed = {}, []
+        for path in self._list_files():
+            st = os.stat(path)
+            old = self._files.get(path)
+            if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime:
+                current[path] = old
+                continue
+            with open(path, "rb") as f:
+                digest = content_hash(f.read())
+            current[path] = {"size": st.st_size, "mtime": st.st_mtime, "sha1": digest}
+            if not old or old["sha1"] != digest:
+                changed.append(path)
+        removed = [p for p in self._files if p not in current]
+        return current, changed, removed
+
+    def _split_file(self, path: str) -> List[str]:
+        with tracing.span("load_document", path=os.path.basename(path)):
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        with tracing.span("split", path=os.path.basename(path)) as s:
+            chunks = self.splitter.split_text(text)
+            s.set(chunks=len(chunks))
+        return chunks
+
+    def _iter_chunks(self, paths: List[str]) -> Iterator[Tuple[str, str]]:
+        """按文件顺序逐个产出 (切片文本, 来源)。文件较多时交给进程池读取与切分，
+        最多 2×workers 个文件在途：消费端（嵌入）较慢时不会把整个语料读进内存"""
+        workers = min(self.ingest_workers, len(paths))
+        if workers < 2 or len(paths) < self.POOL_MIN_FILES:
+            for path in paths:
+                for text in self._split_file(path):
+                    yield text, path
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+        todo = iter(paths)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+
+            def submit():
+                path = next(todo, None)
+                if path is not None:
+                    pending.append((path, pool.submit(_split_in_worker, path, self.chunk_size, self.chunk_overlap)))
+
+            for _ in range(2 * workers):
+                submit()
+            while pending:
+                path, future = pending.popleft()
+                with tracing.span("load_split_wait", path=os.path.basename(path)):
+                    chunks = future.result()
+                submit()
+                for text in chunks:
+                    yield text, path
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        embed = getattr(self.embeddings, "embed_array", self.embeddings.embed_documents)
+        with tracing.span("embed", chunks=len(texts)):
+            return np.asarray(embed(texts), dtype=np.float32)
+
+    def update(self) -> Dict:
+        """增量同步 docs_dir，返回本次变更报告"""
+        current, changed, removed = self._scan()
+        report = {
+            "added": [p for p in changed if p not in self._files],
+            "modified": [p for p in changed if p in self._files],
+            "removed": removed,
+            "embedded_chunks": 0,
+            "reused_chunks": 0,
+            "removed_chunks": 0,
+        }
+        if not changed and not removed:
+            if current != self._files or self._manifest_stale:
+                # 仅修改时间变化（内容相同），刷新清单即可
+                self._files = current
+                self._save_manifest()
+            return report
+
+        # 旧切片哈希 -> 行号，覆盖写入但内容未变的切片可以直接复用向量
+        stale = set(changed) | set(removed)
+        old_rows = {h: i for i, h in enumerate(self.chunk_hashes)}
+        drop = np.array([i for i, src in enumerate(self.doc_sources) if src in stale], dtype=np.int64)
+
+        # 流式摄取：切片边产出边判断能否复用旧向量，需要嵌入的攒满一批就立即嵌入
+        new_texts, new_sources, new_hashes, reuse = [], [], [], []
+        batches, batch_pos, batch_texts = [], [], []
+        for text, source in self._iter_chunks(changed):
+            h = content_hash(text)
+            row = old_rows.get(h)
+            if row is None:
+                batch_pos.append(len(new_texts))
+                batch_texts.append(text)
+            new_texts.append(text)
+            new_sources.append(source)
+            new_hashes.append(h)
+            reuse.append(row)
+            if len(batch_texts) >= self.embed_batch_size:
+                batches.append((batch_pos, self._embed_batch(batch_texts)))
+                batch_pos, batch_texts = [], []
+        if batch_texts:
+            batches.append((batch_pos, self._embed_batch(batch_texts)))
+        to_embed = [i for pos, _ in batches for i in pos]
+
+        store = self.vector_store
+        dim = store.dim if store is not None else (batches[0][1].shape[1] if batches else 0)
+        new_vectors = np.zeros((len(new_texts), dim), dtype=np.float32)
+        for pos, embedded in batches:
+            new_vectors[pos] = embedded
+        reused = [(i, row) for i, row in enumerate(reuse) if row is not None]
+        if reused:
+            new_vectors[[i for i, _ in reused]] = store.reconstruct([row for _, row in reused])
+
+        # 向量存储：移除过期行并追加新行（沿用已有量化参数），元数据按同样顺序调整
+        keep = np.ones(len(self.doc_texts), dtype=bool)
+        keep[drop] = False
+        if store is not None and keep.any():
+            self.vector_store = store.updated(keep, new_vectors)
+        elif dim and len(new_vectors):
+            self.vector_store = VectorStore.build(new_vectors, self.vector_format, pq_m=self.pq_m)
+        else:
+            self.vector_store = None
+        self.doc_texts = [t for t, k in zip(self.doc_texts, keep) if k] + new_texts
+        self.doc_sources = [s for s, k in zip(self.doc_sources, keep) if k] + new_sources
+        self.chunk_hashes = [h for h, k in zip(self.chunk_hashes, keep) if k] + new_hashes
+        self._files = current
+        self._bm25 = None
+
+        report["embedded_chunks"] = len(to_embed)
+        report["reused_chunks"] = len(new_texts) - len(to_embed)
+        report["removed_chunks"] = int(drop.size)
+        print(f"语料索引增量更新：新增 {len(report['added'])} 个文件，修改 {len(report['modified'])} 个，"
+              f"删除 {len(removed)} 个；嵌入 {report['embedded_chunks']} 个切片，"
+              f"复用 {report['reused_chunks']} 个，移除 {report['removed_chunks']} 个")
+        self.save()
+        return report
+
+    def build(self) -> Dict:
+        """丢弃已有索引，全量加载、切分并嵌入 docs_dir 下的所有 txt 文档"""
+        self._reset()
+        return self.update()
+
+    # ---------- 持久化 ----------
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        if self.vector_store is None:
+            self._vector_file = None
+        elif self._vector_file is None or self.vector_store.path != os.path.join(self.index_dir, self._vector_file):
+            self._vector_file = self._new_vector_file()
+            store_path = os.path.join(self.index_dir, self._vector_file)
+            self.vector_store.save(store_path)
+            self.vector_store = VectorStore.open(store_path)
+        for name in self.LEGACY_FILES:
+            if os.path.exists(os.path.join(self.index_dir, name)):
+                os.remove(os.path.join(self.index_dir, name))
+        with open(os.path.join(self.index_dir, self.CHUNKS_FILE), "w", encoding="utf-8") as f:
+            json.dump({"texts": self.doc_texts, "sources": self.doc_sources,
+                       "hashes": self.chunk_hashes}, f, ensure_ascii=False)
+        self._save_manifest()
+        self._remove_stale_vector_files()
+
+    def _new_vector_file(self) -> str:
+        """按语料版本命名的新文件名；同一版本重新构建时加序号，不覆盖已有文件"""
+        stem = f"vectors.{self.fingerprint()[:16]}"
+        name, n = f"{stem}.bin", 0
+        while os.path.exists(os.path.join(self.index_dir, name)):
+            n += 1
+            name = f"{stem}-{n}.bin"
+        return name
+
+    def _remove_stale_vector_files(self):
+        """manifest 写好后删除不再引用的向量文件；仍被其他实例映射而删不掉的留到下次保存"""
+        for name in os.listdir(self.index_dir):
+            if name.startswith("vectors.") and name.endswith((".bin", ".bin.tmp")) and name != self._vector_file:
+                try:
+                    os.remove(os.path.join(self.index_dir, name))
+                except OSError:
+                    pass
+
+    def _save_manifest(self):
+        # manifest 最后写入，作为整份索引写完的标志
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(os.path.join(self.index_dir, self.MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({"settings": self._settings(), "files": self._files, "vector_file": self._vector_file,
+                       "fingerprint": self.fingerprint()}, f, ensure_ascii=False)
+        self._manifest_stale = False
+
+    def load(self) -> bool:
+        """读取磁盘上的索引；不存在或参数不一致时返回 False（语料变化由 update() 增量处理）"""
+        manifest_path = os.path.join(self.index_dir, self.MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return False
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("settings") != self._settings():
+                return False
+
+            with open(os.path.join(self.index_dir, self.CHUNKS_FILE), "r", encoding="utf-8") as f:
+                chunks = json.load(f)
+            self.doc_texts = chunks["texts"]
+            self.doc_sources = chunks["sources"]
+            self.chunk_hashes = chunks["hashes"]
+            # 旧版本的索引没有记录文件名，向量存在固定的 vectors.bin 中
+            self._vector_file = manifest.get("vector_file", self.VECTOR_STORE_FILE) if self.doc_texts else None
+            store_path = os.path.join(self.index_dir, self._vector_file or self.VECTOR_STORE_FILE)
+            self.vector_store = VectorStore.open(store_path) if self.doc_texts else None
+            if self.vector_store is not None and len(self.vector_store) != len(self.doc_texts):
+                raise ValueError(f"{store_path} 的向量数与切片数不一致")
+            self._files = manifest["files"]
+            # 旧版本的 manifest 没有记录语料版本：下次 update() 时补写
+            self._manifest_stale = "fingerprint" not in manifest
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            print(f"读取语料索引失败，将重新构建: {e}")
+            return False
+
+        self._bm25 = None
+        return True
+
+    # ---------- 对外视图 ----------
+
+    def as_retriever(self, k: int = 4):
+        """LangChain 检索器（供 RetrievalQA 等链使用），直接在向量存储上检索"""
+        from corpus_retriever import CorpusRetriever
+        return CorpusRetriever(corpus=self, k=k)
+
+    @property
+    def bm25(self) -> BM25Index:
+        """切片的 BM25 倒排索引（按需在内存中构建，语料更新后重建）"""
+        if self._bm25 is None:
+            self._bm25 = BM25Index(self.doc_texts)
+        return self._bm25
+
+    def document(self, i: int):
+        # langchain_core 只在真正返回检索结果时导入（约 0.15s）
+        from langchain_core.documents import Document
+        return Document(page_content=self.doc_texts[i], metadata={"source": self.doc_sources[i]})
+
+    def _dense_search(self, query_vectors, k: int):
+        """在向量存储上批量暴力检索，返回每个查询的 (平方 L2 距离, 切片编号)"""
+        query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        if self.vector_store is None or k <= 0:
+            return [(np.zeros(0, np.float32), np.zeros(0, np.int64)) for _ in query_vectors]
+        with tracing.span("vector_search", queries=len(query_vectors), k=k, kind=self.vector_store.kind):
+            distances, ids = self.vector_store.search(query_vectors, k)
+        return list(zip(distances, ids))
+
+    def _rows(self, ids, scores):
+        if self.vector_store is not None:
+            vectors = self.vector_store.reconstruct(ids)
+        else:
+            vectors = np.zeros((0, 0), np.float32)
+        return [self.document(int(i)) for i in ids], np.asarray(scores, dtype=np.float32), vectors
+
+    def search(self, query_vectors, k: int):
+        """批量检索，每个查询返回 (切片列表, 平方 L2 距离, 切片向量)；
+        候选向量直接取自索引存储的向量，后续选择阶段无需重新嵌入"""
+        return [self._rows(ids, distances) for distances, ids in self._dense_search(query_vectors, k)]
+
+    def hybrid_search(self, texts: List[str], query_vectors, k: int, fetch_k: int = None, rrf_k: int = 60):
+        """BM25 + 向量混合检索：两路各取 fetch_k 个候选，按倒数排名融合后取前 k 个。
+        每个查询返回 (切片列表, 归一化的融合得分, 切片向量)"""
+        fetch_k = fetch_k or max(4 * k, 20)
+        results = []
+        for text, (_, dense_ids) in zip(texts, self._dense_search(query_vectors, fetch_k)):
+            with tracing.span("bm25_search", k=fetch_k):
+                lexical_ids, _ = self.bm25.search(text, fetch_k) if len(self) else ([], None)
+            fused = reciprocal_rank_fusion([dense_ids, lexical_ids], rrf_k=rrf_k)[:max(k, 0)]
+            results.append(self._rows([doc for doc, _ in fused], [score for _, score in fused]))
+        return results
+
+    def __len__(self) -> int:
+        return len(self.doc_texts)
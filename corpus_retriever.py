@@ -0,0 +1,17 @@
+# corpus_retriever.py
+
+from typing import Any, List
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+class CorpusRetriever(BaseRetriever):
+    """语料索引的 LangChain 检索器：查询嵌入后在紧凑向量存储上检索，不再另建一份 FAISS 索引。
+    单独成模块：langchain_core.retrievers 导入约 0.7s，只有 CorpusIndex.as_retriever() 才导入"""
+    corpus: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        vector = self.corpus.embeddings.embed_query(query)
+        return self.corpus.search([vector], self.k)[0][0]
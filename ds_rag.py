@@ -1,12 +1,8 @@
 # ds_rag.py
 
-import os
 from langchain_openai import ChatOpenAI
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain.chains import RetrievalQA
+from corpus_index import CorpusIndex
 
 # 1. 环境 & 模型初始化
 API_KEY = "your-api"
@@ -21,32 +17,18 @@ LLM = ChatOpenAI(
     temperature=0.0,
 )
 
-# 2. 加载文档
-loader = DirectoryLoader(
+# 2-4. 加载、切分文档并构建向量数据库（与 main.py 共用持久化的语料索引）
+corpus = CorpusIndex(
     "rag_word/",  # 你放 .txt 文档的目录
-    glob="**/*.txt",
-    loader_cls=lambda path: TextLoader(path, encoding='utf-8')  # 指定 UTF-8 编码
+    index_dir="rag_index/",
 )
-docs = loader.load()
-
-# 3. 切分文档片段
-splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-splits = splitter.split_documents(docs)
-print("📄 文档切片数:", len(splits))
-if splits:
-    print("示例片段内容：\n", splits[0].page_content)
+print("📄 文档切片数:", len(corpus))
+if len(corpus):
+    print("示例片段内容：\n", corpus.doc_texts[0])
 input("✅ 文档切片完成，按回车继续")
 
-# 4. 构建向量数据库（使用本地 HuggingFace Embedding）
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
-)
-vectorstore = FAISS.from_documents(splits, embeddings)
-print("✅ FAISS 向量库构建完成")
-input("按回车继续")
-
-# 5. 构建 RAG 检索链
-retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+# 5. 构建 RAG 检索链（检索器直接使用语料索引的向量存储）
+retriever = corpus.as_retriever(k=3)
 rag_chain = RetrievalQA.from_chain_type(
     llm=LLM,
     chain_type="stuff",  # 简单拼接检索到的片段
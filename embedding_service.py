@@ -0,0 +1,220 @@
+# embedding_service.py
+
+import os
+import time
+import queue
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+
+import tracing
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class VectorCache:
+    """按内容哈希存取向量的紧凑磁盘缓存：向量追加写入一个二进制文件，哈希按行写入 keys 文件"""
+
+    def __init__(self, cache_dir: str, dtype: str = "float32"):
+        self.cache_dir = cache_dir
+        self.dtype = np.dtype(dtype)
+        self.dim: Optional[int] = None
+        self._rows: Dict[str, int] = {}
+        self._vectors = None
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._keys_path = os.path.join(cache_dir, f"keys.{self.dtype.name}.txt")
+        self._data_path = os.path.join(cache_dir, f"vectors.{self.dtype.name}.bin")
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._keys_path) or not os.path.exists(self._data_path):
+            return
+        with open(self._keys_path, "r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        # 最后一段是最后一个换行之后的内容（完整文件中为空串，中断时可能是写了一半的键）
+        header, keys, tail = lines[0], lines[1:-1], lines[-1]
+        self.dim = int(header)
+        rowbytes = self.dim * self.dtype.itemsize
+        # 进程中断可能留下不完整的尾部记录：以两者中较短的为准，并把两个文件截到一致，
+        # 否则之后追加的向量与键会错行
+        n = min(len(keys), os.path.getsize(self._data_path) // rowbytes)
+        if os.path.getsize(self._data_path) != n * rowbytes:
+            with open(self._data_path, "r+b") as f:
+                f.truncate(n * rowbytes)
+        if n != len(keys) or tail:
+            with open(self._keys_path, "w", encoding="utf-8") as f:
+                f.write(f"{self.dim}\n" + "".join(f"{k}\n" for k in keys[:n]))
+        self._rows = {k: i for i, k in enumerate(keys[:n])}
+        self._vectors = np.memmap(self._data_path, dtype=self.dtype, mode="r", shape=(n, self.dim)) if n else None
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        with self._lock:
+            found = {}
+            for key in keys:
+                row = self._rows.get(key)
+                if row is not None:
+                    found[key] = np.asarray(self._vectors[row], dtype=np.float32)
+            return found
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            fresh = [i for i, k in enumerate(keys) if k not in self._rows]
+            if not fresh:
+                return
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._keys_path, "w", encoding="utf-8") as f:
+                    f.write(f"{self.dim}\n")
+                open(self._data_path, "wb").close()
+            start = len(self._rows)
+            with open(self._data_path, "ab") as f:
+                f.write(vectors[fresh].astype(self.dtype).tobytes())
+            with open(self._keys_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{keys[i]}\n" for i in fresh))
+            for offset, i in enumerate(fresh):
+                self._rows[keys[i]] = start + offset
+            n = len(self._rows)
+            self._vectors = np.memmap(self._data_path, dtype=self.dtype, mode="r", shape=(n, self.dim))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class EmbeddingService:
+    """进程内共享的嵌入服务：模型只加载一次，向量按内容哈希持久化缓存，
+    并发请求在 max_batch_size / max_wait_ms 预算内合并成一个批次送入模型。
+    实现 LangChain Embeddings 接口（embed_documents / embed_query），但不继承它：
+    导入本模块时不连带导入 langchain_core。"""
+
+    def __init__(self,
+                 model_name: str = DEFAULT_EMBEDDING_MODEL,
+                 cache_dir: Optional[str] = "embedding_cache",
+                 dtype: str = "float32",
+                 max_batch_size: int = 64,
+                 max_wait_ms: float = 5,
+                 model: Optional["Embeddings"] = None):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.cache = VectorCache(os.path.join(cache_dir, _safe_name(model_name)), dtype) if cache_dir else None
+        self.stats = {"cache_hits": 0, "embedded": 0, "batches": 0}
+        self._model = model
+        self._model_lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    # ---------- 模型（按需加载一次） ----------
+
+    @property
+    def model(self) -> "Embeddings":
+        with self._model_lock:
+            if self._model is None:
+                from langchain_huggingface import HuggingFaceEmbeddings
+                self._model = HuggingFaceEmbeddings(model_name=self.model_name)
+            return self._model
+
+    # ---------- Embeddings 接口 ----------
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """返回 float32 数组；缓存命中的直接读取，其余交给批处理线程"""
+        if not texts:
+            dim = self.cache.dim if self.cache is not None and self.cache.dim else 0
+            return np.zeros((0, dim), dtype=np.float32)
+        keys = [self._key(t) for t in texts]
+        found = self.cache.get_many(keys) if self.cache is not None else {}
+        self.stats["cache_hits"] += sum(1 for k in keys if k in found)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            futures = [self._submit(key, text) for key, text in missing.items()]
+            for key, future in zip(missing, futures):
+                found[key] = future.result()
+        return np.vstack([found[k] for k in keys]).astype(np.float32, copy=False)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    # ---------- 微批处理 ----------
+
+    def _submit(self, key: str, text: str) -> Future:
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((key, text, future))
+        return future
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_worker, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _run_worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0
+                                 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._embed_batch(batch)
+
+    def _embed_batch(self, batch):
+        # 同一批次内的重复文本只嵌入一次
+        unique: Dict[str, str] = {}
+        for key, text, _ in batch:
+            unique.setdefault(key, text)
+        try:
+            with tracing.span("embed_batch", texts=len(unique)):
+                vectors = np.asarray(self.model.embed_documents(list(unique.values())), dtype=np.float32)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        rows = dict(zip(unique, vectors))
+        if self.cache is not None:
+            self.cache.put_many(list(unique), vectors)
+        self.stats["embedded"] += len(unique)
+        self.stats["batches"] += 1
+        for key, _, future in batch:
+            future.set_result(rows[key])
+
+
+def _safe_name(model_name: str) -> str:
+    return model_name.replace("/", "__")
+
+
+_SERVICES: Dict[tuple, EmbeddingService] = {}
+_SERVICES_LOCK = threading.Lock()
+
+
+def get_embedding_service(model_name: str = DEFAULT_EMBEDDING_MODEL,
+                          cache_dir: Optional[str] = "embedding_cache",
+                          dtype: str = "float32") -> EmbeddingService:
+    """按 (模型, 缓存目录, 存储精度) 返回进程内唯一的嵌入服务实例"""
+    key = (model_name, cache_dir, dtype)
+    with _SERVICES_LOCK:
+        if key not in _SERVICES:
+            _SERVICES[key] = EmbeddingService(model_name, cache_dir=cache_dir, dtype=dtype)
+        return _SERVICES[key]
@@ -0,0 +1,212 @@
+# html_extract.py
+
+import re
+import codecs
+from html.parser import HTMLParser
+from typing import Iterable, Optional
+from charset_normalizer import from_bytes
+
+
+MAX_CHARS = 5000
+
+# 流式解码前用于检测编码的字节数
+SNIFF_BYTES = 16 * 1024
+
+# 流式提取时跳过的标签（整段内容不计入正文）
+SKIP_TAGS = ("script", "style", "nav")
+
+# 与 extract_text 的清理规则一致：按行（str.splitlines 的所有换行符）和连续两个空格切分
+_SEPARATOR = re.compile(r"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]|  ")
+
+
+def decode_html(raw: bytes, declared_encoding: Optional[str] = None) -> str:
+    """按检测到的编码解码网页（与 requests 的 apparent_encoding 一致）"""
+    best = from_bytes(raw).best()
+    encoding = best.encoding if best is not None else (declared_encoding or "utf-8")
+    return raw.decode(encoding, errors="replace")
+
+
+def extract_text(html: str, max_chars: int = MAX_CHARS) -> str:
+    """清理 HTML 标签并提取纯文本"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # 移除脚本和样式标签
+    for script in soup(["script", "style"]):
+        script.decompose()
+
+    # 提取文本内容
+    text = soup.get_text()
+
+    # 清理文本
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    text = ' '.join(chunk for chunk in chunks if chunk)
+
+    # 限制长度
+    if len(text) > max_chars:
+        text = text[:max_chars] + "..."
+
+    return text
+
+
+def extract_text_from_bytes(raw: bytes, declared_encoding: Optional[str] = None, max_chars: int = MAX_CHARS) -> str:
+    """解码并提取文本；供解析进程池调用，必须是模块级函数"""
+    return extract_text(decode_html(raw, declared_encoding), max_chars)
+
+
+class StreamingTextExtractor(HTMLParser):
+    """流式正文提取：边解析边跳过 script/style/nav、边规范化空白，字符预算用完立即停止。
+
+    输出与 extract_text 的规则一致（跳过同样的标签时结果相同），
+    但不构建 DOM 树，也不需要读完整个页面。
+    """
+
+    def __init__(self, max_chars: int = MAX_CHARS, skip_tags: Iterable[str] = SKIP_TAGS):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.skip_tags = frozenset(skip_tags)
+        self.done = False
+        self._skip_depth = 0
+        self._pending = ""
+        self._tokens = []
+        self._length = 0
+
+    # ---------- HTMLParser 回调 ----------
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skip_tags:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.skip_tags and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if self._skip_depth or self.done:
+            return
+        # 只扫描新追加的部分（多退一个字符，兼顾跨块的 "  " 与 "\r\n"）
+        start = max(len(self._pending) - 1, 0)
+        self._pending += data
+        last = None
+        for last in _SEPARATOR.finditer(self._pending, start):
+            pass
+        if last is not None:
+            head, self._pending = self._pending[:last.end()], self._pending[last.end():]
+            for piece in _SEPARATOR.split(head):
+                self._add_token(piece)
+        # 未结束的片段已经足以超出预算时，后续内容不会再影响输出
+        budget = self.max_chars - self._length - bool(self._tokens)
+        if not self.done and len(self._pending) > budget and len(self._pending.strip()) > budget:
+            self._add_token(self._pending)
+            self._pending = ""
+
+    def unknown_decl(self, data):
+        # 与 BeautifulSoup 一致：CDATA 段计入正文
+        if data.upper().startswith("CDATA["):
+            self.handle_data(data[6:])
+
+    def _add_token(self, piece: str):
+        piece = piece.strip()
+        if not piece or self.done:
+            return
+        self._length += len(piece) + bool(self._tokens)
+        self._tokens.append(piece)
+        if self._length > self.max_chars:
+            self.done = True
+
+    # ---------- 对外接口 ----------
+
+    def feed(self, data: str) -> bool:
+        """喂入一段 HTML，返回是否已用完字符预算（调用方应停止读取）"""
+        if not self.done:
+            super().feed(data)
+        return self.done
+
+    def result(self) -> str:
+        if not self.done:
+            self.close()
+            self._add_token(self._pending)
+            self._pending = ""
+        text = " ".join(self._tokens)
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars] + "..."
+        return text
+
+
+def charset_from_content_type(content_type: Optional[str]) -> Optional[str]:
+    """只取 Content-Type 中显式声明的 charset（不套用 HTTP 的 ISO-8859-1 默认值）"""
+    match = re.search(r"charset=[\"']?([\w.:-]+)", content_type or "", re.I)
+    return match.group(1) if match else None
+
+
+def sniff_encoding(head: bytes, declared_encoding: Optional[str] = None) -> str:
+    """流式解码只能看到页面开头：优先用响应头声明的编码，否则对开头的数据做检测"""
+    if declared_encoding:
+        try:
+            codecs.lookup(declared_encoding)
+            return declared_encoding
+        except LookupError:
+            pass
+    best = from_bytes(head).best()
+    if best is None or best.encoding == "ascii":
+        # 开头全是 ASCII 时无法区分，按 UTF-8（ASCII 的超集）解码
+        return "utf-8"
+    return best.encoding
+
+
+class StreamingPageReader:
+    """按字节块读取网页：先攒够 SNIFF_BYTES 检测编码，再增量解码并交给 StreamingTextExtractor"""
+
+    def __init__(self,
+                 declared_encoding: Optional[str] = None,
+                 max_chars: int = MAX_CHARS,
+                 skip_tags: Iterable[str] = SKIP_TAGS):
+        self.declared_encoding = declared_encoding
+        self.extractor = StreamingTextExtractor(max_chars, skip_tags)
+        self.raw = bytearray()
+        self._decoder = None
+        self._head = b""
+        if declared_encoding:
+            # 响应头已声明编码时无需等待检测
+            try:
+                codecs.lookup(declared_encoding)
+                self._start_decoder()
+            except LookupError:
+                pass
+
+    def feed(self, chunk: bytes) -> bool:
+        """喂入一个字节块，返回是否已用完字符预算（调用方应停止读取）"""
+        self.raw += chunk
+        if self._decoder is None:
+            # 避免只凭全是 ASCII 的 <head> 判断编码
+            self._head += chunk
+            if len(self._head) < SNIFF_BYTES:
+                return False
+            self._start_decoder()
+            chunk, self._head = self._head, b""
+        return self.extractor.feed(self._decoder.decode(chunk))
+
+    def _start_decoder(self):
+        encoding = sniff_encoding(self._head, self.declared_encoding)
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    def result(self) -> str:
+        if not self.extractor.done:
+            if self._decoder is None:
+                self._start_decoder()
+            self.extractor.feed(self._decoder.decode(self._head, final=True))
+            self._head = b""
+        return self.extractor.result()
+
+
+def extract_text_streaming(chunks: Iterable[bytes],
+                           declared_encoding: Optional[str] = None,
+                           max_chars: int = MAX_CHARS,
+                           skip_tags: Iterable[str] = SKIP_TAGS) -> str:
+    """从字节块迭代器中流式提取正文；预算用完后不再消费后续数据块"""
+    reader = StreamingPageReader(declared_encoding, max_chars, skip_tags)
+    for chunk in chunks:
+        if reader.feed(chunk):
+            break
+    return reader.result()
@@ -0,0 +1,123 @@
+# http_cache.py
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+
+class PageCache:
+    """网页响应磁盘缓存（SQLite）：按 URL 保存原始字节与提取后的正文。
+
+    - TTL 内命中：跳过网络请求与 HTML 解析
+    - 过期后用 ETag / Last-Modified 发条件请求，304 时直接复用缓存
+    - 总字节数超过 max_bytes 时按最近访问时间（LRU）淘汰
+    """
+
+    def __init__(self,
+                 path: str = "web_cache/pages.db",
+                 ttl: float = 24 * 3600,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "bytes_saved": 0, "evicted": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY, raw BLOB, text TEXT, max_chars INTEGER,"
+            " etag TEXT, last_modified TEXT, fetched_at REAL, last_access REAL, size INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_last_access ON pages(last_access)")
+        # 缓存总字节数单独存一行，与页面在同一事务中增减：写入时不必对整张表求和
+        self._conn.execute("CREATE TABLE IF NOT EXISTS pages_total (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)")
+        self._conn.execute("INSERT OR IGNORE INTO pages_total SELECT 0, COALESCE(SUM(size), 0) FROM pages")
+        self._conn.commit()
+
+    def lookup(self, url: str) -> Optional[Dict]:
+        """返回缓存条目（含 fresh 标志），不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT raw, text, max_chars, etag, last_modified, fetched_at FROM pages WHERE url = ?",
+                (url,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            self._conn.execute("UPDATE pages SET last_access = ? WHERE url = ?", (now, url))
+            self._conn.commit()
+        raw, text, max_chars, etag, last_modified, fetched_at = row
+        return {"raw": raw, "text": text, "max_chars": max_chars, "etag": etag,
+                "last_modified": last_modified, "fresh": now - fetched_at < self.ttl}
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict]) -> Dict[str, str]:
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def record_hit(self, entry: Dict, revalidated: bool = False):
+        self.stats["revalidated" if revalidated else "hits"] += 1
+        self.stats["bytes_saved"] += len(entry["raw"] or b"")
+
+    def record_miss(self):
+        self.stats["misses"] += 1
+
+    def refresh(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """304 之后刷新抓取时间（及服务端下发的新校验值）"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fetched_at = ?, etag = COALESCE(?, etag),"
+                " last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (time.time(), etag, last_modified, url))
+            self._conn.commit()
+
+    def put(self, url: str, raw: bytes, text: str, max_chars: int,
+            etag: Optional[str] = None, last_modified: Optional[str] = None):
+        now = time.time()
+        size = len(raw) + len(text.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM pages WHERE url = ?", (url,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, raw, text, max_chars, etag, last_modified, now, now, size))
+            self._conn.execute("UPDATE pages_total SET size = size + ? WHERE id = 0", (size - (old[0] if old else 0),))
+            self._evict()
+            self._conn.commit()
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT size FROM pages_total WHERE id = 0").fetchone()[0]
+
+    def _evict(self):
+        """总字节数超出上限时才按最近访问时间分批删除"""
+        total = self._conn.execute("SELECT size FROM pages_total WHERE id = 0").fetchone()[0]
+        evicted = 0
+        while total > self.max_bytes:
+            rows = self._conn.execute("SELECT url, size FROM pages ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+                self.stats["evicted"] += 1
+                evicted += size
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        if evicted:
+            self._conn.execute("UPDATE pages_total SET size = size - ? WHERE id = 0", (evicted,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
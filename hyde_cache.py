@@ -0,0 +1,181 @@
+# hyde_cache.py
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import List, Optional
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """查询规范化：全半角统一、小写、合并空白、去掉结尾标点"""
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip("?？。.!！~～ ")
+
+
+def context_hash(context: str, max_length: int) -> str:
+    return hashlib.sha1(f"{max_length}\0{context}".encode("utf-8")).hexdigest()
+
+
+class HyDECache:
+    """HyDE 假设文档缓存（SQLite 持久化）。
+
+    - 精确命中：规范化查询 + 检索上下文哈希
+    - 语义命中：检索上下文相同、且查询向量余弦相似度 ≥ threshold 的近似问法
+    - 超过 ttl 的条目失效，条目数超过 max_entries 时按最近访问时间淘汰
+    """
+
+    def __init__(self,
+                 path: str = "rag_index/hyde_cache.db",
+                 threshold: float = 0.95,
+                 ttl: float = 7 * 24 * 3600,
+                 max_entries: int = 10000):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evicted": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hyde ("
+            " key TEXT PRIMARY KEY, query TEXT, context_hash TEXT, embedding BLOB,"
+            " hypothetical_doc TEXT, created_at REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS hyde_last_access ON hyde(last_access)")
+        self._conn.commit()
+        self._load_vectors()
+
+    def _load_vectors(self):
+        """把未过期条目的查询向量读入内存，语义查找只做一次矩阵乘。
+        内存中的行数与表中的条目数一致；缓冲区按倍数扩容，删除时把最后一行移到空位"""
+        self._conn.execute("DELETE FROM hyde WHERE created_at < ?", (time.time() - self.ttl,))
+        self._conn.commit()
+        rows = self._conn.execute("SELECT key, context_hash, embedding FROM hyde").fetchall()
+        self._keys = [r[0] for r in rows]
+        self._rows = {key: i for i, key in enumerate(self._keys)}
+        self._size = len(rows)
+        self._contexts = np.empty(max(self._size, 16), dtype=object)
+        self._contexts[:self._size] = [r[1] for r in rows]
+        self._vectors = None
+        if rows:
+            self._vectors = np.zeros((len(self._contexts), len(rows[0][2]) // 4), dtype=np.float32)
+            for i, r in enumerate(rows):
+                self._vectors[i] = np.frombuffer(r[2], dtype=np.float32)
+
+    def _set_row(self, key: str, ctx_hash: str, vector: np.ndarray):
+        i = self._rows.get(key)
+        if i is None:
+            i = self._size
+            if self._vectors is None:
+                self._vectors = np.zeros((len(self._contexts), len(vector)), dtype=np.float32)
+            if i == len(self._contexts):
+                self._contexts = np.concatenate([self._contexts, np.empty(i, dtype=object)])
+                self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+            self._keys.append(key)
+            self._rows[key] = i
+            self._size += 1
+        self._contexts[i] = ctx_hash
+        self._vectors[i] = vector
+
+    def _remove_row(self, key: str):
+        i = self._rows.pop(key, None)
+        if i is None:
+            return
+        last = self._size - 1
+        if i != last:
+            moved = self._keys[last]
+            self._keys[i], self._rows[moved] = moved, i
+            self._contexts[i] = self._contexts[last]
+            self._vectors[i] = self._vectors[last]
+        self._keys.pop()
+        self._contexts[last] = None
+        self._size -= 1
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def make_key(query: str, ctx_hash: str) -> str:
+        return hashlib.sha1(f"{normalize_query(query)}\0{ctx_hash}".encode("utf-8")).hexdigest()
+
+    def lookup(self, query: str, context: str, query_vector, max_length: int) -> Optional[str]:
+        """返回缓存的假设文档，未命中返回 None"""
+        ctx_hash = context_hash(context, max_length)
+        key = self.make_key(query, ctx_hash)
+        with self._lock:
+            doc = self._get(key)
+            if doc is not None:
+                self.stats["exact_hits"] += 1
+                return doc
+
+            if self._size:
+                candidates = np.flatnonzero(self._contexts[:self._size] == ctx_hash)
+                if candidates.size:
+                    sims = self._vectors[candidates] @ self._unit(query_vector)
+                    # 按相似度从高到低依次尝试：最相似的条目已过期时取下一个仍在阈值之上的
+                    for j in np.argsort(-sims, kind="stable"):
+                        if sims[j] < self.threshold:
+                            break
+                        doc = self._get(self._keys[candidates[j]])
+                        if doc is not None:
+                            self.stats["semantic_hits"] += 1
+                            return doc
+
+            self.stats["misses"] += 1
+            return None
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT hypothetical_doc, created_at FROM hyde WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] >= self.ttl:
+            return None
+        self._conn.execute("UPDATE hyde SET last_access = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+        return row[0]
+
+    def put(self, query: str, context: str, query_vector, max_length: int, hypothetical_doc: str):
+        ctx_hash = context_hash(context, max_length)
+        key = self.make_key(query, ctx_hash)
+        vector = self._unit(query_vector)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hyde VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, normalize_query(query), ctx_hash, vector.tobytes(), hypothetical_doc, now, now))
+            self._set_row(key, ctx_hash, vector)
+            for evicted in self._evict():
+                self._remove_row(evicted)
+            self._conn.commit()
+
+    def _evict(self) -> List[str]:
+        """按最近访问时间淘汰超出 max_entries 的条目，返回被淘汰的键（条目数取内存中的行数，不扫描全表）"""
+        excess = self._size - self.max_entries
+        if excess <= 0:
+            return []
+        keys = [r[0] for r in self._conn.execute(
+            "SELECT key FROM hyde ORDER BY last_access LIMIT ?", (excess,)).fetchall()]
+        self._conn.executemany("DELETE FROM hyde WHERE key = ?", [(k,) for k in keys])
+        self.stats["evicted"] += len(keys)
+        return keys
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM hyde").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
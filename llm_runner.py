@@ -0,0 +1,101 @@
+# llm_runner.py
+
+import asyncio
+import random
+from typing import Any, List, Optional
+
+import tracing
+
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError"}
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def chat_model(model_name: str, api_key: str, base_url: str, **kwargs):
+    """创建 OpenAI 兼容接口的 ChatOpenAI 客户端。
+
+    langchain_openai 导入要数秒（会连带导入 openai 与 transformers），
+    只在真正需要调用 LLM 时才导入，不拖慢其余入口的启动
+    """
+    from langchain_openai import ChatOpenAI
+    kwargs.setdefault("temperature", 0.0)
+    kwargs.setdefault("max_tokens", 2048)
+    return ChatOpenAI(model=model_name, api_key=api_key, base_url=base_url, **kwargs)
+
+
+def is_retryable(error: Exception) -> bool:
+    """超时、限流（429）与服务端临时错误可以重试"""
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS or type(error).__name__ in RETRYABLE_ERRORS
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """读取限流响应中的 Retry-After（秒）"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ConcurrentLLMRunner:
+    """并发调用 LLM：信号量限制并发数，每次调用单独超时，限流/临时错误按指数退避重试"""
+
+    def __init__(self,
+                 llm,
+                 max_concurrency: int = 4,
+                 timeout: float = 60,
+                 max_retries: int = 3,
+                 backoff: float = 1.0,
+                 max_backoff: float = 30.0):
+        self.llm = llm
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    async def ainvoke(self, messages, semaphore: Optional[asyncio.Semaphore] = None, **kwargs) -> Any:
+        """单次调用（含超时与重试），失败时抛出最后一次异常"""
+        with tracing.span("llm_invoke") as s:
+            response = await self._ainvoke(messages, semaphore, s, **kwargs)
+            tracing.record_llm(s, response)
+            return response
+
+    async def _ainvoke(self, messages, semaphore, s, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            s.set(attempts=attempt + 1)
+            try:
+                if semaphore is None:
+                    return await asyncio.wait_for(self.llm.ainvoke(messages, **kwargs), self.timeout)
+                async with semaphore:
+                    return await asyncio.wait_for(self.llm.ainvoke(messages, **kwargs), self.timeout)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = min(self.backoff * (2 ** attempt), self.max_backoff) * (0.5 + random.random())
+                attempt += 1
+                print(f"LLM 调用失败（{type(e).__name__}），{delay:.1f}s 后第 {attempt} 次重试")
+                await asyncio.sleep(delay)
+
+    async def amap(self, batch: List[Any], **kwargs) -> List[Any]:
+        """并发执行一批调用；失败的位置返回异常对象，由调用方决定如何降级"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(*(self.ainvoke(messages, semaphore, **kwargs) for messages in batch),
+                                    return_exceptions=True)
+
+    def map(self, batch: List[Any], **kwargs) -> List[Any]:
+        return asyncio.run(self.amap(batch, **kwargs))
@@ -1,10 +1,18 @@
 # main.py
 
 import os
-from langchain_openai import ChatOpenAI
+import time
+from functools import lru_cache
+from corpus_index import CorpusIndex
+from hyde_cache import HyDECache
 from query_rewriter import QueryRewriter
-from similarity import KnowledgeBoundaryAwareSimilarity
-from agent import web_research_agent_research
+from selection import CandidateSelector
+from pipeline import Pipeline
+from rag_prompt import build_rag_messages, user_content
+from context_packing import ContextPacker
+from llm_runner import chat_model
+from result_store import ResultStore
+import tracing
 
 def main():
     # === 一、初始化 ===
@@ -12,6 +20,10 @@ def main():
     MODEL_NAME = "qwen/qwen2.5-vl-32b-instruct:free"
     BASE_URL   = "https://openrouter.ai/api/v1"
     DOCS_DIR   = "rag_word/"
+    INDEX_DIR  = "rag_index/"
+    RESULT_DB  = "result/results.db"
+    # 最终 RAG 提示中检索上下文 + HyDE 查询的 token 预算
+    CONTEXT_BUDGET = 2048
 
     IMAGE_URL = (
         "https://bkimg.cdn.bcebos.com/pic/"
@@ -20,98 +32,173 @@ def main():
     )
     user_query = "帮我基于这张图片，写一段微信公众号的介绍文案"
 
+    # 回答、检索来源、相似度得分与各阶段耗时只追加写入结果存储；
+    # 相同 (查询, 图片, 语料版本) 再次运行时直接取已有回答（python result_store.py 查看历史）
+    store = ResultStore(RESULT_DB)
+
+    # 多模态 RAG LLM 客户端：两个回答都取自结果存储时不会创建
+    @lru_cache(maxsize=None)
+    def llm():
+        return chat_model(MODEL_NAME, API_KEY, BASE_URL)
+
+    # === 各阶段按依赖关系组织成流水线，互不依赖的阶段并发执行 ===
+    #   baseline（独立）
+    #   corpus_version → lookup → research ┐
+    #   load_index ────────────────────────┴→ refresh_index → hyde → retrieve → select → rag
+    # lookup 按当前语料版本查结果存储，命中时跳过网络研究、索引更新、HyDE、检索与最终调用；
+    # 语料版本只读 manifest 得到，网络研究不必等完整索引（切片与 mmap）加载完
+
     # 0) 网络研究Agent - 自动爬取相关资料
-    print("=== 开始网络研究，自动爬取相关资料 ===")
-    try:
-        saved_files = web_research_agent_research(
-            query=user_query,
+    def research(cached):
+        if cached is not None:
+            return []
+        print("=== 开始网络研究，自动爬取相关资料 ===")
+        # 研究 Agent 连带导入 ddgs、aiohttp 与 langchain_core：回答取自结果存储时不导入
+        from agent import web_research_agent_research
+        try:
+            saved_files = web_research_agent_research(
+                query=user_query,
+                api_key=API_KEY,
+                model_name=MODEL_NAME,
+                base_url=BASE_URL,
+                docs_dir=DOCS_DIR
+            )
+            print(f"成功爬取并保存了 {len(saved_files)} 份文档")
+            for file_path in saved_files:
+                print(f"  - {os.path.basename(file_path)}")
+            return saved_files
+        except Exception as e:
+            print(f"网络研究过程中出现错误: {e}")
+            print("继续执行原有逻辑...")
+            return []
+
+    # 共享语料索引：只加载、切分、嵌入一次，供 HyDE 检索与相似度计算复用。
+    # 读取磁盘上的索引（同时与磁盘上的文档同步），研究结束后只增量嵌入新保存的文档
+    def load_index():
+        return CorpusIndex(DOCS_DIR, index_dir=INDEX_DIR)
+
+    # 上次运行结束时的语料就是当前索引：回答按更新后的语料版本记录，再次运行时直接命中。
+    # 文档在上次运行后被改动时版本未知，按未命中处理
+    def corpus_version():
+        return CorpusIndex.stored_fingerprint(DOCS_DIR, INDEX_DIR)
+
+    def lookup(version):
+        if version is None:
+            return None
+        return store.lookup("rag", MODEL_NAME, user_query, IMAGE_URL, version)
+
+    def refresh_index(saved_files, corpus):
+        if saved_files:
+            corpus.update()
+        return corpus
+
+    # 1) HyDE 查询重写（与 Baseline 调用重叠）
+    def hyde(cached, corpus):
+        if cached is not None:
+            return None
+        rewriter = QueryRewriter(
             api_key=API_KEY,
             model_name=MODEL_NAME,
             base_url=BASE_URL,
-            docs_dir=DOCS_DIR
+            docs_dir=DOCS_DIR,
+            index=corpus,
+            cache=HyDECache(os.path.join(INDEX_DIR, "hyde_cache.db"))
         )
-        print(f"成功爬取并保存了 {len(saved_files)} 份文档")
-        for file_path in saved_files:
-            print(f"  - {os.path.basename(file_path)}")
-    except Exception as e:
-        print(f"网络研究过程中出现错误: {e}")
-        print("继续执行原有逻辑...")
-
-    # 1) HyDE 查询重写
-    rewriter = QueryRewriter(
-        api_key=API_KEY,
-        model_name=MODEL_NAME,
-        base_url=BASE_URL,
-        docs_dir=DOCS_DIR
-    )
-    hyde_q = rewriter.rewrite_query_with_hyde(user_query, k=3)
-
-    # 2) 多模态 RAG LLM 客户端
-    llm = ChatOpenAI(
-        model=MODEL_NAME,
-        api_key=API_KEY,
-        base_url=BASE_URL,
-        temperature=0.0,
-        max_tokens=2048,
-    )
+        return rewriter, rewriter.rewrite_query_with_hyde(user_query, k=3)
 
     # === Baseline ===
-    baseline = llm.invoke([{
-        "role": "user",
-        "content": [
-            {"type": "text",      "text": user_query},
-            {"type": "image_url", "image_url": {"url": IMAGE_URL}}
-        ]
-    }])
-    result_dir = r"D:\AAAAA 安克创新\RAG\result"
-    os.makedirs(result_dir, exist_ok=True)
-    with open(os.path.join(result_dir, "baseline_answer.txt"), "w", encoding="utf-8") as f:
-        f.write("── Baseline 回答 ──\n")
-        f.write(baseline.content + "\n")
+    def baseline():
+        cached = store.lookup("baseline", MODEL_NAME, user_query, IMAGE_URL)
+        if cached is not None:
+            print("Baseline 回答取自结果存储")
+            return cached["answer"]
+        start = time.perf_counter()
+        with tracing.span("llm_invoke", purpose="baseline") as s:
+            baseline = llm().invoke([{"role": "user", "content": user_content(user_query, IMAGE_URL)}])
+            tracing.record_llm(s, baseline)
+        store.record("baseline", MODEL_NAME, user_query, baseline.content, image_url=IMAGE_URL,
+                     timings={"llm": time.perf_counter() - start})
+        return baseline.content
 
     # === HyDE + RAG with SRT & MCT ===
 
-    # SRT 阶段：检索更多候选文档
-    retriever = rewriter.vectorstore.as_retriever(search_kwargs={"k": 5})
-    candidate_docs = retriever.invoke(hyde_q)
-
-    # 初始化相似度计算器
-    sim_calc = KnowledgeBoundaryAwareSimilarity(docs_dir=DOCS_DIR)
-
-    # 选取第一个候选作为基准源
-    base_src = candidate_docs[0].metadata["source"]
-
-    # 排序并取 Top-3
-    ranked = sim_calc.rank_similar_documents(base_src, top_k=3)
-    top3_srcs = [src for src, _ in ranked]
-    srt_docs = [d for d in candidate_docs if d.metadata["source"] in top3_srcs]
-
-    # MCT 阶段：剔除冗余与高度相似的文档
-    filtered = []
-    for doc in srt_docs:
-        src = doc.metadata["source"]
-        if all(sim_calc.compute_max_similarity(src, kept.metadata["source"]) < 0.95
-               for kept in filtered):
-            filtered.append(doc)
-
-    # 拼接上下文：先是过滤后文档，再加上 Hyde 生成的 query
-    context = "\n\n---\n\n".join(d.page_content for d in filtered)
-    final_query = context + "\n\n" + hyde_q
-
-    # 最终 RAG 调用
-    rag_input = [
-        {"role": "system",
-         "content": "你是一个熟练的公众号写手，你将根据检索到的信息，请结合以下要求和图片生成一段微信公众号文案，注意以下三点：1.文辞恰当，逻辑严密，不能出现冗余片段；2.模仿人类口吻生成，注意生成的文字切合人类逻辑；3.不能使用任何攻击、对立、政治敏感等措辞，写这篇公众号。"},
-        {"role": "user",
-         "content": [
-             {"type": "text",      "text": final_query},
-             {"type": "image_url", "image_url": {"url": IMAGE_URL}}
-         ]}
-    ]
-    rag_resp = llm.invoke(rag_input)
-    with open(os.path.join(result_dir, "hyde_rag_answer.txt"), "w", encoding="utf-8") as f:
-        f.write("── HyDE+RAG（SRT+MCT）回答 ──\n")
-        f.write(rag_resp.content + "\n")
+    # SRT 阶段：BM25 + 向量混合检索更多候选文档（同时取回融合得分与切片向量）
+    def retrieve(hyde_result, corpus):
+        if hyde_result is None:
+            return None
+        _, hyde_q = hyde_result
+        query_vector = corpus.embeddings.embed_query(hyde_q)
+        return corpus.hybrid_search([hyde_q], [query_vector], 5)[0]
+
+    # SRT + MCT 一次完成：保留与首个命中最相似的 3 个来源，同时剔除冗余与高度相似的候选
+    def select(candidates):
+        if candidates is None:
+            return None
+        docs, relevance, vectors = candidates
+        return CandidateSelector(top_k=3, threshold=0.95).select_with_scores(docs, relevance, vectors)
+
+    # 最终 RAG 调用：按 token 预算装配上下文（按得分取舍切片、去掉切分重叠、必要时截断）
+    def rag(filtered, hyde_result, cached, corpus):
+        if cached is not None:
+            print("HyDE+RAG 回答取自结果存储")
+            return cached["answer"]
+        start = time.perf_counter()
+        _, hyde_q = hyde_result
+        docs, scores = filtered
+        context, packing = ContextPacker(budget_tokens=CONTEXT_BUDGET).pack(docs, scores, query=hyde_q)
+        print(f"上下文 {packing['context_tokens']} tokens（原始 {packing['original_tokens']}，"
+              f"节省 {packing['saved_tokens']}，截断 {packing['trimmed']} 个切片）")
+        tracing.count("context_tokens_saved_total", packing["saved_tokens"])
+        rag_input = build_rag_messages(docs, hyde_q, IMAGE_URL, context=context)
+        with tracing.span("llm_invoke", purpose="rag") as s:
+            rag_resp = llm().invoke(rag_input)
+            tracing.record_llm(s, rag_resp)
+        timings = {name: pipeline.timings[name]["duration"] for name in ("hyde", "retrieve", "select")}
+        timings["rag"] = time.perf_counter() - start
+        store.record("rag", MODEL_NAME, user_query, rag_resp.content, image_url=IMAGE_URL, corpus_version=corpus.fingerprint(),
+                     sources=[d.metadata["source"] for d in docs], scores=scores, timings=timings,
+                     extra={"hyde_query": hyde_q, "context": packing})
+        return rag_resp.content
+
+    pipeline = (Pipeline()
+                .add("baseline", baseline)
+                .add("load_index", load_index)
+                .add("corpus_version", corpus_version)
+                .add("lookup", lookup, deps=["corpus_version"])
+                .add("research", research, deps=["lookup"])
+                .add("refresh_index", refresh_index, deps=["research", "load_index"])
+                .add("hyde", hyde, deps=["lookup", "refresh_index"])
+                .add("retrieve", retrieve, deps=["hyde", "refresh_index"])
+                .add("select", select, deps=["retrieve"])
+                .add("rag", rag, deps=["select", "hyde", "lookup", "refresh_index"]))
+
+    # 可选的追踪：RAG_TRACE 指定 JSONL 追踪文件（同名 .prom 文件另存 Prometheus 文本），
+    # RAG_PROFILE 指定折叠栈输出文件，对本次查询做采样剖析
+    trace_path = os.environ.get("RAG_TRACE")
+    profile_path = os.environ.get("RAG_PROFILE")
+    if trace_path:
+        tracing.configure(trace_path)
+    profiler = tracing.SamplingProfiler().start() if profile_path else None
+    try:
+        with tracing.span("query"):
+            results = pipeline.run()
+        print("── Baseline 回答 ──")
+        print(results["baseline"])
+        print("── HyDE+RAG（SRT+MCT）回答 ──")
+        print(results["rag"])
+    finally:
+        # 提交缓冲中尚未写入的记录
+        store.close()
+        print("=== 各阶段耗时 ===")
+        print(pipeline.report())
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(profile_path)
+            print(f"采样剖析结果（{profiler.samples} 次采样）已写入 {profile_path}")
+        if trace_path:
+            tracing.write_prometheus(os.path.splitext(trace_path)[0] + ".prom")
+            tracing.disable()
+            print(f"追踪记录已写入 {trace_path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+# near_dup.py
+
+import os
+import re
+import time
+import zlib
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str, size: int = 5) -> List[str]:
+    """规范化后（全半角统一、小写、去掉空白与标点）的字符 size-gram"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"[\W_]+", "", text)
+    if len(text) <= size:
+        return [text] if text else []
+    return [text[i:i + size] for i in range(len(text) - size + 1)]
+
+
+class NearDuplicateIndex:
+    """网页近重复检测：MinHash 签名 + LSH 分桶，签名与桶持久化在 SQLite 中。
+
+    查询只需按 bands 个桶做索引查找，再对同桶候选估计 Jaccard 相似度，
+    开销与已收录文档数量呈次线性关系。已收录文件被删除后，对应条目会在命中时清理。
+    """
+
+    def __init__(self,
+                 path: str = "web_cache/near_duplicates.db",
+                 num_perm: int = 128,
+                 bands: int = 16,
+                 threshold: float = 0.8,
+                 shingle_size: int = 5,
+                 seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+        self.stats = {"checked": 0, "duplicates": 0, "added": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " key TEXT PRIMARY KEY, path TEXT, url TEXT, signature BLOB, created_at REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (band INTEGER, bucket BLOB, key TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets(band, bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets(key)")
+        self._conn.commit()
+
+    # ---------- 签名 ----------
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash 签名：num_perm 个 (a·x + b) mod p 哈希在全部 shingle 上的最小值"""
+        grams = shingles(text, self.shingle_size)
+        if not grams:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint32)
+        x = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in set(grams)), dtype=np.uint64) % _PRIME
+        hashed = (self._a[:, None] * x[None, :] + self._b[:, None]) % _PRIME
+        return hashed.min(axis=1).astype(np.uint32)
+
+    @staticmethod
+    def similarity(sig1: np.ndarray, sig2: np.ndarray) -> float:
+        """签名相同位置的比例即 Jaccard 相似度的估计"""
+        return float(np.mean(sig1 == sig2))
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    # ---------- 查找与收录 ----------
+
+    def find(self, signature: np.ndarray) -> Optional[Dict]:
+        """返回已收录的近重复文档 {key, path, url, similarity}，没有则返回 None"""
+        with self._lock:
+            self.stats["checked"] += 1
+            candidates = set()
+            for band, bucket in enumerate(self._band_keys(signature)):
+                rows = self._conn.execute("SELECT key FROM buckets WHERE band = ? AND bucket = ?",
+                                          (band, bucket)).fetchall()
+                candidates.update(r[0] for r in rows)
+
+            best = None
+            for key in candidates:
+                row = self._conn.execute("SELECT path, url, signature FROM documents WHERE key = ?",
+                                         (key,)).fetchone()
+                if row is None:
+                    continue
+                path, url, blob = row
+                if path and not os.path.exists(path):
+                    # 文件已被删除：清理过期条目，不再视为重复
+                    self._remove(key)
+                    continue
+                sim = self.similarity(signature, np.frombuffer(blob, dtype=np.uint32))
+                if sim >= self.threshold and (best is None or sim > best["similarity"]):
+                    best = {"key": key, "path": path, "url": url, "similarity": sim}
+            if best is not None:
+                self.stats["duplicates"] += 1
+            return best
+
+    def add(self, key: str, signature: np.ndarray, path: str = None, url: str = None):
+        with self._lock:
+            self._remove(key)
+            self._conn.execute("INSERT INTO documents VALUES (?, ?, ?, ?, ?)",
+                               (key, path, url, signature.astype(np.uint32).tobytes(), time.time()))
+            self._conn.executemany("INSERT INTO buckets VALUES (?, ?, ?)",
+                                   [(band, bucket, key) for band, bucket in enumerate(self._band_keys(signature))])
+            self._conn.commit()
+            self.stats["added"] += 1
+
+    def _remove(self, key: str):
+        self._conn.execute("DELETE FROM documents WHERE key = ?", (key,))
+        self._conn.execute("DELETE FROM buckets WHERE key = ?", (key,))
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,117 @@
+# pipeline.py
+
+import time
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import tracing
+
+
+class Pipeline:
+    """按依赖关系并发执行的阶段流水线。
+
+    每个阶段声明自己依赖的阶段，依赖全部完成后立即开始，
+    依赖的返回值按声明顺序作为位置参数传入；互不依赖的阶段并发执行。
+    同步函数放进线程池运行，协程函数直接在事件循环中等待。
+    端到端耗时由关键路径决定，而不是所有阶段耗时之和。
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict] = {}
+        # name -> {"start", "end", "duration", "status"}，时间相对流水线开始（秒）
+        self.timings: Dict[str, Dict] = {}
+        self.wall_time = 0.0
+
+    def add(self, name: str, fn: Callable, deps: Sequence[str] = ()) -> "Pipeline":
+        if name in self.stages:
+            raise ValueError(f"阶段重复定义: {name}")
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"阶段 {name} 依赖未定义的阶段: {dep}")
+        self.stages[name] = {"fn": fn, "deps": list(deps)}
+        return self
+
+    # ---------- 执行 ----------
+
+    def run(self) -> Dict[str, Any]:
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> Dict[str, Any]:
+        """执行全部阶段并返回 {阶段名: 返回值}；任一阶段失败时，
+        其下游阶段被跳过，其余阶段照常完成后抛出最先声明的那个异常"""
+        self.timings = {}
+        origin = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.ensure_future(self._run_stage(name, stage, tasks, origin))
+        outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        self.wall_time = time.perf_counter() - origin
+
+        results, errors = {}, []
+        for name, outcome in zip(tasks, outcomes):
+            if isinstance(outcome, _Skipped):
+                continue
+            if isinstance(outcome, BaseException):
+                errors.append(outcome)
+            else:
+                results[name] = outcome
+        if errors:
+            raise errors[0]
+        return results
+
+    async def _run_stage(self, name: str, stage: Dict, tasks: Dict[str, asyncio.Task], origin: float):
+        args = []
+        for dep in stage["deps"]:
+            try:
+                args.append(await tasks[dep])
+            except Exception:
+                self.timings[name] = {"start": None, "end": None, "duration": 0.0, "status": "skipped"}
+                raise _Skipped(dep)
+
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            # 阶段 span 作为父 span，线程池中的子调用通过 contextvars 继承
+            with tracing.span(f"stage.{name}"):
+                if inspect.iscoroutinefunction(stage["fn"]):
+                    return await stage["fn"](*args)
+                return await asyncio.to_thread(stage["fn"], *args)
+        except BaseException:
+            status = "failed"
+            raise
+        finally:
+            end = time.perf_counter()
+            self.timings[name] = {"start": start - origin, "end": end - origin,
+                                  "duration": end - start, "status": status}
+
+    # ---------- 耗时分析 ----------
+
+    def critical_path(self) -> List[str]:
+        """从最晚结束的阶段出发，沿着最晚完成的依赖回溯得到关键路径"""
+        finished = {n: t for n, t in self.timings.items() if t["end"] is not None}
+        if not finished:
+            return []
+        name: Optional[str] = max(finished, key=lambda n: finished[n]["end"])
+        path = []
+        while name is not None:
+            path.append(name)
+            deps = [d for d in self.stages[name]["deps"] if d in finished]
+            name = max(deps, key=lambda d: finished[d]["end"]) if deps else None
+        return path[::-1]
+
+    def report(self) -> str:
+        lines = [f"{'阶段':<16}{'开始(s)':>10}{'耗时(s)':>10}  状态"]
+        ordered = sorted(self.timings.items(),
+                         key=lambda kv: (kv[1]["start"] is None, kv[1]["start"] or 0.0))
+        for name, t in ordered:
+            start = f"{t['start']:.2f}" if t["start"] is not None else "-"
+            lines.append(f"{name:<16}{start:>10}{t['duration']:>10.2f}  {t['status']}")
+        total = sum(t["duration"] for t in self.timings.values())
+        lines.append(f"各阶段耗时之和 {total:.2f}s，端到端 {self.wall_time:.2f}s；"
+                     f"关键路径: {' → '.join(self.critical_path())}")
+        return "\n".join(lines)
+
+
+class _Skipped(Exception):
+    """上游失败而未执行的阶段"""
@@ -1,11 +1,10 @@
 # query_rewriter.py
 
-import os
-from langchain_openai import ChatOpenAI
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
+from typing import Optional
+from corpus_index import CorpusIndex
+from hyde_cache import HyDECache
+from llm_runner import chat_model
+import tracing
 
 
 class QueryRewriter:
@@ -13,36 +12,68 @@ class QueryRewriter:
                  api_key: str,
                  model_name: str,
                  base_url: str,
-                 docs_dir: str):
-        self.llm = ChatOpenAI(
-            model=model_name,
-            api_key=api_key,
-            base_url=base_url,
-            temperature=0.0,
-            max_tokens=2048,
-        )
+                 docs_dir: str,
+                 index: Optional[CorpusIndex] = None,
+                 cache: Optional[HyDECache] = None,
+                 hybrid: bool = True,
+                 llm=None):
+        # LLM 客户端在第一次生成假设文档时才创建：HyDE 缓存命中时不导入 langchain_openai
+        self._llm = llm
+        self._llm_config = (model_name, api_key, base_url)
 
-        # 构建向量库
-        loader = DirectoryLoader(
-            docs_dir,
-            glob="**/*.txt",
-            loader_cls=lambda p: TextLoader(p, encoding="utf-8"),
-        )
-        docs = loader.load()
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = splitter.split_documents(docs)
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        self.vectorstore = FAISS.from_documents(splits, embeddings)
+        # 向量库：优先复用外部传入的共享语料索引
+        self.index = index if index is not None else CorpusIndex(docs_dir)
+
+        # HyDE 缓存：相同或近似的问题（检索上下文相同）跳过 LLM 调用
+        self.cache = cache
+
+        # 初始检索是否融合 BM25（中文按字/二字组切词）与向量检索结果
+        self.hybrid = hybrid
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = chat_model(*self._llm_config)
+        return self._llm
+
+    @llm.setter
+    def llm(self, value):
+        self._llm = value
 
     def rewrite_query_with_hyde(self,
                                 original_query: str,
                                 k: int = 3,
                                 max_length: int = 512) -> str:
         """使用 HyDE 方法重写查询。"""
-        retriever = self.vectorstore.as_retriever(search_kwargs={"k": k})
-        initial_docs = retriever.invoke(original_query)[:k]
+        # 查询向量只算一次：既用于检索，也用于缓存的语义匹配
+        query_vector = self.index.embeddings.embed_query(original_query)
+        if self.hybrid:
+            initial_docs = self.index.hybrid_search([original_query], [query_vector], k)[0][0]
+        else:
+            initial_docs = self.index.search([query_vector], k)[0][0]
         initial_context = "\n\n---\n\n".join(d.page_content for d in initial_docs)
 
+        hypothetical_doc = None
+        if self.cache is not None:
+            hypothetical_doc = self.cache.lookup(original_query, initial_context, query_vector, max_length)
+        if hypothetical_doc is None:
+            hypothetical_doc = self._generate_hypothetical_doc(original_query, initial_context, max_length)
+            if self.cache is not None:
+                self.cache.put(original_query, initial_context, query_vector, max_length, hypothetical_doc)
+
+        return self.format_rewritten_query(original_query, hypothetical_doc)
+
+    @staticmethod
+    def format_rewritten_query(original_query: str, hypothetical_doc: str) -> str:
+        rewritten_query = (
+            f"{hypothetical_doc}\n\n"
+            f"基于上述内容，请对“{original_query}”做更准确的回答。"
+        )
+        return rewritten_query
+
+    @staticmethod
+    def hyde_messages(original_query: str, initial_context: str):
+        """生成假设文档的提示消息（同步调用与服务端异步调用共用）"""
         hyde_prompt = (
             "请根据以下检索到的文档片段，以及用户的原始问题，"
             "撰写一段更详尽、信息丰富的“假设文档”来回答该问题：\n\n"
@@ -50,12 +81,12 @@ class QueryRewriter:
             f"【原始问题】\n{original_query}\n\n"
             "请以段落形式输出，不要包含“假设”二字，也不输出多余说明。"
         )
-        response = self.llm.invoke([{"role": "user", "content": hyde_prompt}],
-                                   max_tokens=max_length)
-        hypothetical_doc = response.content.strip()
+        return [{"role": "user", "content": hyde_prompt}]
 
-        rewritten_query = (
-            f"{hypothetical_doc}\n\n"
-            f"基于上述内容，请对“{original_query}”做更准确的回答。"
-        )
-        return rewritten_query
+    def _generate_hypothetical_doc(self, original_query: str, initial_context: str, max_length: int) -> str:
+        """调用 LLM 生成假设文档"""
+        with tracing.span("llm_invoke", purpose="hyde") as s:
+            response = self.llm.invoke(self.hyde_messages(original_query, initial_context),
+                                       max_tokens=max_length)
+            tracing.record_llm(s, response)
+        return response.content.strip()
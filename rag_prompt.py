@@ -0,0 +1,33 @@
+# rag_prompt.py
+
+from typing import List, Optional
+
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+RAG_SYSTEM_PROMPT = (
+    "你是一个熟练的公众号写手，你将根据检索到的信息，请结合以下要求和图片生成一段微信公众号文案，"
+    "注意以下三点：1.文辞恰当，逻辑严密，不能出现冗余片段；2.模仿人类口吻生成，注意生成的文字切合人类逻辑；"
+    "3.不能使用任何攻击、对立、政治敏感等措辞，写这篇公众号。"
+)
+
+
+def user_content(text: str, image_url: Optional[str] = None) -> List[dict]:
+    """多模态用户消息内容：文本 + 可选图片"""
+    content = [{"type": "text", "text": text}]
+    if image_url:
+        content.append({"type": "image_url", "image_url": {"url": image_url}})
+    return content
+
+
+def build_rag_messages(docs, hyde_query: str, image_url: Optional[str] = None,
+                       context: Optional[str] = None) -> List[dict]:
+    """最终 RAG 调用的消息：先是过滤后文档，再加上 HyDE 生成的 query；
+    context 为 ContextPacker 按 token 预算装配好的上下文，缺省时直接拼接全部文档"""
+    if context is None:
+        context = CONTEXT_SEPARATOR.join(d.page_content for d in docs)
+    final_query = context + "\n\n" + hyde_query
+    return [
+        {"role": "system", "content": RAG_SYSTEM_PROMPT},
+        {"role": "user", "content": user_content(final_query, image_url)},
+    ]
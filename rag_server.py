@@ -0,0 +1,423 @@
+# rag_server.py
+
+import os
+import time
+import asyncio
+import argparse
+from collections import deque
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import numpy as np
+from aiohttp import web
+
+from corpus_index import CorpusIndex
+from hyde_cache import HyDECache
+from llm_runner import ConcurrentLLMRunner, chat_model
+from query_rewriter import QueryRewriter
+from rag_prompt import build_rag_messages
+from context_packing import ContextPacker
+from result_store import ResultStore
+from selection import CandidateSelector, distances_to_relevance
+import tracing
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+
+class RetrievalBatcher:
+    """跨请求合并查询嵌入与 FAISS 检索：在 max_wait_ms 内到达的查询
+    一起嵌入（一次模型前向）并一次性提交给 FAISS 做批量搜索"""
+
+    def __init__(self, corpus: CorpusIndex, max_batch_size: int = 32, max_wait_ms: float = 5,
+                 hybrid: bool = True):
+        self.corpus = corpus
+        self.hybrid = hybrid
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.stats = {"batches": 0, "queries": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def search(self, text: str, k: int) -> Tuple[np.ndarray, List["Document"], np.ndarray, np.ndarray]:
+        """返回 (查询向量, 前 k 个切片, 相关度, 切片向量)"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.ensure_future(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, k, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await asyncio.to_thread(self._search_batch, [(t, k) for t, k, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _search_batch(self, items):
+        texts = [t for t, _ in items]
+        embeddings = self.corpus.embeddings
+        embed = getattr(embeddings, "embed_array", embeddings.embed_documents)
+        vectors = np.asarray(embed(texts), dtype=np.float32)
+        self.stats["batches"] += 1
+        self.stats["queries"] += len(items)
+
+        # 嵌入整批一次完成；检索按 k 分组（混合检索的 fetch_k 与融合结果随 k 变化，
+        # 同一查询的结果不能取决于同批的其他请求）
+        groups: Dict[int, List[int]] = {}
+        for i, (_, k) in enumerate(items):
+            groups.setdefault(k, []).append(i)
+        results = [None] * len(items)
+        for k, rows in groups.items():
+            if self.hybrid:
+                hits = self.corpus.hybrid_search([texts[i] for i in rows], vectors[rows], k)
+            else:
+                hits = [(docs, distances_to_relevance(distances), doc_vectors)
+                        for docs, distances, doc_vectors in self.corpus.search(vectors[rows], k)]
+            for i, (docs, relevance, doc_vectors) in zip(rows, hits):
+                results[i] = (vectors[i], docs, relevance, doc_vectors)
+        return results
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class RAGService:
+    """常驻的 HyDE + RAG（SRT+MCT）问答服务：语料索引、嵌入模型
+    和 LLM 客户端在启动时加载一次，之后所有请求复用"""
+
+    def __init__(self,
+                 api_key: str,
+                 model_name: str,
+                 base_url: str,
+                 docs_dir: str = "rag_word/",
+                 index_dir: str = "rag_index/",
+                 llm=None,
+                 embeddings=None,
+                 workers: int = 8,
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5,
+                 llm_timeout: float = 60,
+                 hyde_cache: Optional[HyDECache] = None,
+                 hybrid: bool = True,
+                 profile_dir: str = "profiles",
+                 vector_format: str = "float32",
+                 context_budget: Optional[int] = 2048,
+                 result_store: Optional[ResultStore] = None):
+        self.corpus = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=embeddings, vector_format=vector_format)
+        self.model_name = model_name
+        # 结果存储：相同 (查询, 图片, 语料版本) 的回答直接返回；服务期间语料不变，版本只算一次
+        self.result_store = result_store
+        self.corpus_version = self.corpus.fingerprint() if result_store is not None else ""
+        if llm is None:
+            llm = chat_model(model_name, api_key, base_url)
+        self.rewriter = QueryRewriter(api_key=api_key, model_name=model_name, base_url=base_url,
+                                      docs_dir=docs_dir, index=self.corpus, cache=hyde_cache, hybrid=hybrid,
+                                      llm=llm)
+        self.selector = CandidateSelector(top_k=3, threshold=0.95)
+        # 最终提示的上下文按 token 预算装配；None 表示直接拼接选中的切片
+        self.packer = ContextPacker(budget_tokens=context_budget) if context_budget else None
+        self.runner = ConcurrentLLMRunner(llm, max_concurrency=workers, timeout=llm_timeout)
+        self.batcher = RetrievalBatcher(self.corpus, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                        hybrid=hybrid)
+        self.workers = workers
+        self.profile_dir = profile_dir
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.started_at = time.time()
+        self.metrics = {"requests": 0, "failed": 0, "in_flight": 0, "context_tokens_saved": 0, "result_cache_hits": 0}
+        self.latencies = deque(maxlen=1000)
+
+    async def answer(self, query: str, image_url: Optional[str] = None,
+                     k: int = 5, hyde_k: int = 3, max_length: int = 512, profile: bool = False) -> Dict:
+        """profile=True 时对这一次查询开启采样剖析，折叠栈写入 profile_dir，路径放在结果的 profile 字段；
+        剖析器采样的是整个进程，并发的其他请求也会出现在结果中"""
+        if not profile:
+            return await self._timed_answer(query, image_url, k, hyde_k, max_length)
+        profiler = tracing.SamplingProfiler().start()
+        try:
+            result = await self._timed_answer(query, image_url, k, hyde_k, max_length)
+        finally:
+            profiler.stop()
+        path = os.path.join(self.profile_dir, f"profile_{int(time.time() * 1000)}.folded")
+        profiler.write(path)
+        return dict(result, profile=path)
+
+    async def _timed_answer(self, query, image_url, k, hyde_k, max_length) -> Dict:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        self.metrics["requests"] += 1
+        self.metrics["in_flight"] += 1
+        start = time.perf_counter()
+        try:
+            async with self._slots:
+                with tracing.span("query"):
+                    result = await self._answer(query, image_url, k, hyde_k, max_length)
+        except Exception:
+            self.metrics["failed"] += 1
+            raise
+        finally:
+            self.metrics["in_flight"] -= 1
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    async def _answer(self, query, image_url, k, hyde_k, max_length) -> Dict:
+        cached = await self.cached_answer(query, image_url)
+        if cached is not None:
+            return cached
+        retrieval = await self.retrieve(query, k, hyde_k, max_length)
+        result = await self.generate(retrieval, image_url)
+        await self.store_answer(query, image_url, retrieval, result)
+        return result
+
+    # 结果存储与 HyDE 缓存都是同步的 SQLite 读写（提交时还要落盘），放到线程中执行，不阻塞事件循环
+
+    async def cached_answer(self, query: str, image_url: Optional[str] = None) -> Optional[Dict]:
+        """结果存储中已有的回答（带 cached 标记），未配置存储或未命中时返回 None"""
+        if self.result_store is None:
+            return None
+        record = await asyncio.to_thread(self.result_store.lookup, "rag", self.model_name, query, image_url,
+                                         self.corpus_version)
+        if record is None:
+            return None
+        self.metrics["result_cache_hits"] += 1
+        result = {"answer": record["answer"], "sources": record["sources"], "timings": record["timings"],
+                  "cached": True}
+        if "context" in record["extra"]:
+            result["context"] = record["extra"]["context"]
+        return result
+
+    async def store_answer(self, query: str, image_url: Optional[str], retrieval: Dict, result: Dict):
+        if self.result_store is None:
+            return
+        extra = {"hyde_query": retrieval["hyde_query"]}
+        if "context" in result:
+            extra["context"] = result["context"]
+        await asyncio.to_thread(self.result_store.record, "rag", self.model_name, query, result["answer"],
+                                image_url=image_url, corpus_version=self.corpus_version, sources=result["sources"],
+                                scores=retrieval.get("scores", ()), timings=result["timings"], extra=extra)
+
+    async def retrieve(self, query: str, k: int = 5, hyde_k: int = 3, max_length: int = 512) -> Dict:
+        """HyDE 重写 + SRT 检索 + MCT 去冗余；只依赖查询文本，相同查询可复用结果"""
+        timings = {}
+        t0 = time.perf_counter()
+
+        # 1) HyDE：初始检索与查询嵌入跨请求合批
+        query_vector, initial_docs, _, _ = await self.batcher.search(query, hyde_k)
+        initial_context = "\n\n---\n\n".join(d.page_content for d in initial_docs)
+        cache = self.rewriter.cache
+        hypothetical_doc = None
+        if cache is not None:
+            hypothetical_doc = await asyncio.to_thread(cache.lookup, query, initial_context, query_vector, max_length)
+        if hypothetical_doc is None:
+            response = await self.runner.ainvoke(self.rewriter.hyde_messages(query, initial_context),
+                                                 max_tokens=max_length)
+            hypothetical_doc = response.content.strip()
+            if cache is not None:
+                await asyncio.to_thread(cache.put, query, initial_context, query_vector, max_length,
+                                        hypothetical_doc)
+        hyde_q = self.rewriter.format_rewritten_query(query, hypothetical_doc)
+        t1 = time.perf_counter()
+        timings["hyde"] = t1 - t0
+
+        # 2) SRT 检索候选 + MCT 去冗余（只在候选集上，复用检索得分与向量）
+        _, candidate_docs, relevance, doc_vectors = await self.batcher.search(hyde_q, k)
+        filtered, scores = self.selector.select_with_scores(candidate_docs, relevance, doc_vectors)
+        timings["retrieve"] = time.perf_counter() - t1
+        return {"hyde_query": hyde_q, "docs": filtered, "scores": scores, "timings": timings}
+
+    async def generate(self, retrieval: Dict, image_url: Optional[str] = None) -> Dict:
+        """3) 最终 RAG 调用（上下文先按 token 预算装配）"""
+        start = time.perf_counter()
+        context, packing = None, None
+        if self.packer is not None:
+            with tracing.span("context_pack"):
+                context, packing = self.packer.pack(retrieval["docs"], retrieval.get("scores"),
+                                                    query=retrieval["hyde_query"])
+            self.metrics["context_tokens_saved"] += packing["saved_tokens"]
+        messages = build_rag_messages(retrieval["docs"], retrieval["hyde_query"], image_url, context=context)
+        response = await self.runner.ainvoke(messages)
+        timings = dict(retrieval["timings"], rag=time.perf_counter() - start)
+        result = {
+            "answer": response.content,
+            "sources": [d.metadata["source"] for d in retrieval["docs"]],
+            "timings": timings,
+        }
+        if packing is not None:
+            result["context"] = packing
+        return result
+
+    def health(self) -> Dict:
+        return {"status": "ok", "chunks": len(self.corpus), "sources": len(set(self.corpus.doc_sources)),
+                "uptime": time.time() - self.started_at}
+
+    def snapshot(self) -> Dict:
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        batch = self.batcher.stats
+        result = dict(self.metrics)
+        result.update({
+            "latency_p50": float(np.percentile(latencies, 50)),
+            "latency_p95": float(np.percentile(latencies, 95)),
+            "retrieval_batches": batch["batches"],
+            "retrieval_queries": batch["queries"],
+            "avg_batch_size": batch["queries"] / batch["batches"] if batch["batches"] else 0.0,
+        })
+        embedding_stats = getattr(self.corpus.embeddings, "stats", None)
+        if embedding_stats is not None:
+            result["embedding"] = dict(embedding_stats)
+        if self.rewriter.cache is not None:
+            result["hyde_cache"] = dict(self.rewriter.cache.stats)
+        if self.result_store is not None:
+            result["result_store"] = dict(self.result_store.stats)
+        return result
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式：服务计数 + 各 span 的耗时直方图与 token 计数（需开启追踪）"""
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE rag_requests_total counter", f"rag_requests_total {snapshot['requests']}",
+            "# TYPE rag_requests_failed_total counter", f"rag_requests_failed_total {snapshot['failed']}",
+            "# TYPE rag_requests_in_flight gauge", f"rag_requests_in_flight {snapshot['in_flight']}",
+            "# TYPE rag_retrieval_batches_total counter", f"rag_retrieval_batches_total {snapshot['retrieval_batches']}",
+            "# TYPE rag_context_tokens_saved_total counter",
+            f"rag_context_tokens_saved_total {snapshot['context_tokens_saved']}",
+            "# TYPE rag_result_cache_hits_total counter",
+            f"rag_result_cache_hits_total {snapshot['result_cache_hits']}",
+        ]
+        return "\n".join(lines) + "\n" + tracing.prometheus_text()
+
+    async def close(self):
+        await self.batcher.close()
+        if self.result_store is not None:
+            await asyncio.to_thread(self.result_store.flush)
+
+
+# ---------- HTTP 接口 ----------
+
+SERVICE_KEY = web.AppKey("service", RAGService)
+
+async def handle_query(request: web.Request) -> web.Response:
+    service: RAGService = request.app[SERVICE_KEY]
+    try:
+        payload = await request.json()
+    except ValueError:
+        return web.json_response({"error": "请求体必须是 JSON"}, status=400)
+    query = payload.get("query") if isinstance(payload, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        return web.json_response({"error": "缺少 query 字段"}, status=400)
+    k = payload.get("k", 5)
+    try:
+        if isinstance(k, bool) or (isinstance(k, float) and not k.is_integer()):
+            raise ValueError(k)
+        k = int(k)
+    except (TypeError, ValueError, OverflowError):
+        k = 0
+    if k < 1:
+        return web.json_response({"error": "k 必须是正整数"}, status=400)
+    image_url = payload.get("image_url")
+    if image_url is not None and not isinstance(image_url, str):
+        return web.json_response({"error": "image_url 必须是字符串"}, status=400)
+    try:
+        result = await service.answer(query, image_url=image_url, k=k, profile=bool(payload.get("profile")))
+    except Exception as e:
+        print(f"处理查询失败: {e}")
+        return web.json_response({"error": f"{type(e).__name__}: {e}"}, status=500)
+    return web.json_response(result)
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response(request.app[SERVICE_KEY].health())
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """默认返回 JSON；?format=prometheus 返回 Prometheus 文本格式"""
+    service: RAGService = request.app[SERVICE_KEY]
+    if request.query.get("format") == "prometheus":
+        return web.Response(text=service.prometheus(), content_type="text/plain", charset="utf-8")
+    return web.json_response(service.snapshot())
+
+
+def create_app(service: RAGService) -> web.Application:
+    app = web.Application()
+    app[SERVICE_KEY] = service
+    app.router.add_post("/query", handle_query)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+
+    async def on_cleanup(app):
+        await service.close()
+
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def add_service_arguments(parser: argparse.ArgumentParser):
+    """服务与批处理共用的命令行参数"""
+    parser.add_argument("--workers", type=int, default=8, help="同时处理的请求数")
+    parser.add_argument("--docs-dir", default="rag_word/")
+    parser.add_argument("--index-dir", default="rag_index/")
+    parser.add_argument("--model-name", default="qwen/qwen2.5-vl-32b-instruct:free")
+    parser.add_argument("--base-url", default="https://openrouter.ai/api/v1",
+                        help="OpenAI 兼容接口地址，可指向本地桩服务做测试")
+    parser.add_argument("--api-key", default=os.environ.get("OPENROUTER_API_KEY", ""))
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--llm-timeout", type=float, default=60)
+    parser.add_argument("--dense-only", action="store_true", help="只用向量检索，不融合 BM25")
+    parser.add_argument("--vector-format", choices=["float32", "sq8", "pq"], default="float32",
+                        help="切片向量的存储编码（sq8 每维 1 字节，pq 每向量 dim/8 字节）")
+    parser.add_argument("--context-budget", type=int, default=2048,
+                        help="最终提示中检索上下文 + HyDE 查询的 token 预算，0 表示不限制")
+    parser.add_argument("--result-db", default="result/results.db",
+                        help="结果存储（SQLite），相同查询+图片+语料版本直接返回已有回答；空字符串表示不使用")
+    parser.add_argument("--trace", action="store_true", help="开启各阶段 span 耗时直方图与 token 计数")
+    parser.add_argument("--trace-file", help="同时把 span 追加写入该 JSONL 文件（隐含 --trace）")
+    parser.add_argument("--trace-sample-rate", type=float, default=1.0, help="写入追踪文件的查询比例")
+
+
+def service_from_args(args) -> RAGService:
+    if args.trace or args.trace_file:
+        tracing.configure(args.trace_file, sample_rate=args.trace_sample_rate)
+    return RAGService(api_key=args.api_key, model_name=args.model_name, base_url=args.base_url,
+                      docs_dir=args.docs_dir, index_dir=args.index_dir, workers=args.workers,
+                      max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                      llm_timeout=args.llm_timeout,
+                      hyde_cache=HyDECache(os.path.join(args.index_dir, "hyde_cache.db")),
+                      hybrid=not args.dense_only, vector_format=args.vector_format,
+                      context_budget=args.context_budget or None,
+                      result_store=ResultStore(args.result_db) if args.result_db else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻 RAG 问答服务（模型与索引常驻内存，跨请求合批检索）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_service_arguments(parser)
+    args = parser.parse_args()
+
+    service = service_from_args(args)
+    print(f"RAG 服务已就绪：{len(service.corpus)} 个切片，监听 http://{args.host}:{args.port}")
+    web.run_app(create_app(service), host=args.host, port=args.port, print=None)
@@ -0,0 +1,177 @@
+# result_store.py
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from hyde_cache import normalize_query
+
+
+_COLUMNS = ("key", "stage", "model", "query", "image_url", "corpus_version",
+            "answer", "sources", "scores", "timings", "extra", "created_at")
+_JSON_COLUMNS = ("sources", "scores", "timings", "extra")
+
+
+def query_key(query: str, image_url: Optional[str] = None, corpus_version: str = "") -> str:
+    """(规范化查询, 图片, 语料版本) 的哈希；Baseline 不依赖语料，corpus_version 为空"""
+    return hashlib.sha1(f"{normalize_query(query)}\0{image_url or ''}\0{corpus_version}".encode("utf-8")).hexdigest()
+
+
+class ResultStore:
+    """问答结果与中间产物的只追加存储（SQLite WAL 模式）。
+
+    每条记录按 (查询哈希, 阶段, 模型) 索引，保存回答、检索来源、相似度得分与各阶段耗时；
+    同一键的旧记录不会被覆盖，查找时取最新的一条，历史记录即性能历史。
+    写入先进入内存缓冲，攒够 batch_size 条、距上次提交超过 flush_interval 秒或调用 flush/close 时
+    在一个事务中批量提交；缓冲中的记录同样可以被查找到。
+    """
+
+    def __init__(self, path: str = "result/results.db", batch_size: int = 64, flush_interval: float = 5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {"hits": 0, "misses": 0, "written": 0, "commits": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._last_flush = time.time()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL：写入只追加到日志文件，读取不被写事务阻塞
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, stage TEXT, model TEXT, query TEXT,"
+            " image_url TEXT, corpus_version TEXT, answer TEXT, sources TEXT, scores TEXT, timings TEXT,"
+            " extra TEXT, created_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_lookup ON results(key, stage, model)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_history ON results(stage, created_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def _encode(value) -> str:
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        return json.dumps(value, ensure_ascii=False, default=float)
+
+    def record(self, stage: str, model: str, query: str, answer: str,
+               image_url: Optional[str] = None, corpus_version: str = "",
+               sources: Sequence[str] = (), scores: Sequence[float] = (),
+               timings: Optional[Dict[str, float]] = None, extra: Optional[Dict] = None):
+        row = (query_key(query, image_url, corpus_version), stage, model, query, image_url, corpus_version,
+               answer, self._encode(list(sources)), self._encode([float(s) for s in scores]),
+               self._encode(timings or {}), self._encode(extra or {}), time.time())
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size or time.time() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def lookup(self, stage: str, model: str, query: str, image_url: Optional[str] = None,
+               corpus_version: str = "") -> Optional[Dict]:
+        """返回该 (查询, 图片, 语料版本) 在 stage/model 下最新的记录，未命中返回 None"""
+        key = query_key(query, image_url, corpus_version)
+        with self._lock:
+            for row in reversed(self._pending):
+                if row[0] == key and row[1] == stage and row[2] == model:
+                    self.stats["hits"] += 1
+                    return self._decode(row)
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM results WHERE key = ? AND stage = ? AND model = ?"
+                " ORDER BY id DESC LIMIT 1", (key, stage, model)).fetchone()
+            self.stats["hits" if row else "misses"] += 1
+        return self._decode(row) if row else None
+
+    @staticmethod
+    def _decode(row) -> Dict:
+        record = dict(zip(_COLUMNS, row))
+        for name in _JSON_COLUMNS:
+            record[name] = json.loads(record[name]) if record[name] else None
+        return record
+
+    def history(self, stage: Optional[str] = None, model: Optional[str] = None,
+                since: Optional[float] = None, limit: Optional[int] = None) -> List[Dict]:
+        """按时间倒序返回记录（含未提交的缓冲）"""
+        self.flush()
+        where, params = [], []
+        for column, value in (("stage", stage), ("model", model)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM results"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._decode(r) for r in rows]
+
+    def timing_summary(self, stage: Optional[str] = None, since: Optional[float] = None) -> Dict[str, Dict]:
+        """各 (阶段/模型, 耗时项) 的次数与 p50/p95/均值（秒）"""
+        samples: Dict[str, List[float]] = {}
+        for record in self.history(stage=stage, since=since):
+            for name, seconds in (record["timings"] or {}).items():
+                samples.setdefault(f"{record['stage']}/{record['model']}.{name}", []).append(seconds)
+        summary = {}
+        for name, values in sorted(samples.items()):
+            values = np.array(values)
+            summary[name] = {"count": len(values), "p50": float(np.percentile(values, 50)),
+                             "p95": float(np.percentile(values, 95)), "mean": float(values.mean())}
+        return summary
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.time()
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT INTO results ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                self._pending)
+        self.stats["written"] += len(self._pending)
+        self.stats["commits"] += 1
+        self._pending = []
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] + len(self._pending)
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查看结果存储中的历史回答与耗时统计")
+    parser.add_argument("db", nargs="?", default="result/results.db")
+    parser.add_argument("--stage", help="只看某个阶段（baseline / rag）")
+    parser.add_argument("--limit", type=int, default=10, help="列出最近的记录条数")
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    for record in store.history(stage=args.stage, limit=args.limit):
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["created_at"]))
+        print(f"[{created}] {record['stage']}/{record['model']}  {record['query']}")
+        print(f"  来源: {', '.join(record['sources'] or []) or '-'}  得分: {record['scores'] or '-'}")
+        print(f"  回答: {(record['answer'] or '')[:80]}")
+    print("=== 耗时统计（秒）===")
+    for name, s in store.timing_summary(stage=args.stage).items():
+        print(f"{name:<40} n={s['count']:<5} p50={s['p50']:.3f}  p95={s['p95']:.3f}  mean={s['mean']:.3f}")
+    store.close()
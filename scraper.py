@@ -0,0 +1,232 @@
+# scraper.py
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from html_extract import MAX_CHARS, StreamingPageReader, extract_text_from_bytes
+from http_cache import PageCache
+import tracing
+
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+
+class ConcurrentScraper:
+    """并发网页抓取：共享连接池 + 全局/单主机并发上限 + 整体截止时间。
+
+    HTML 解码与 BeautifulSoup 解析交给进程池，避免阻塞事件循环；
+    收集到 target 份合格文档后立即取消其余请求。
+    传入 cache（PageCache）时，新鲜的缓存直接返回，过期条目发条件请求重新校验。
+    streaming=True 时边读边提取正文，字符预算用完即停止读取连接。
+    """
+
+    def __init__(self,
+                 max_concurrency: int = 8,
+                 per_host_limit: int = 2,
+                 timeout: float = 10,
+                 deadline: float = 30,
+                 max_chars: int = MAX_CHARS,
+                 parse_workers: Optional[int] = None,
+                 executor: Optional[Executor] = None,
+                 headers: Optional[Dict[str, str]] = None,
+                 cache: Optional[PageCache] = None,
+                 streaming: bool = False,
+                 chunk_size: int = 16 * 1024):
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_chars = max_chars
+        self.parse_workers = parse_workers
+        self.headers = headers or DEFAULT_HEADERS
+        self._executor = executor
+        self._own_executor = executor is None
+        self.cache = cache
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+
+    # ---------- 解析进程池 ----------
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+        return self._executor
+
+    def close(self):
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- 抓取 ----------
+
+    def scrape(self,
+               urls: List[str],
+               target: Optional[int] = None,
+               accept: Optional[Callable[[str, str], bool]] = None) -> List[Dict]:
+        """同步入口：返回 [{'url', 'content'}]，按 urls 原始顺序排列"""
+        return asyncio.run(self.scrape_async(urls, target, accept))
+
+    async def scrape_async(self,
+                           urls: List[str],
+                           target: Optional[int] = None,
+                           accept: Optional[Callable[[str, str], bool]] = None) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        global_sem = asyncio.Semaphore(self.max_concurrency)
+        host_sems: Dict[str, asyncio.Semaphore] = {}
+        results: Dict[int, Dict] = {}
+
+        async with self._session() as session:
+            tasks = {}
+            for i, url in enumerate(urls):
+                host = urlparse(url).netloc
+                host_sem = host_sems.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+                task = asyncio.ensure_future(self._fetch_one(session, url, global_sem, host_sem))
+                tasks[task] = i
+
+            pending = set(tasks)
+            try:
+                while pending:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        print(f"抓取超过截止时间 {self.deadline}s，放弃剩余 {len(pending)} 个网页")
+                        break
+                    done, pending = await asyncio.wait(pending, timeout=remaining,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        url, content, error = task.result()
+                        if error is not None:
+                            print(f"抓取失败 {url}: {error}")
+                        elif content and (accept is None or accept(url, content)):
+                            results[tasks[task]] = {'url': url, 'content': content}
+                    if target is not None and len(results) >= target:
+                        if pending:
+                            print(f"已收集 {len(results)} 份文档，取消剩余 {len(pending)} 个抓取")
+                        break
+            finally:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        return [results[i] for i in sorted(results)]
+
+    async def scrape_stream(self, next_url: Callable[[], Awaitable[Optional[str]]]) -> AsyncIterator[Dict]:
+        """流式抓取：max_concurrency 个工作协程各自向 next_url() 领取下一个 URL（返回 None 表示没有更多），
+        每抓完一个网页立即产出 {'url', 'content'}，失败的网页不产出。
+        URL 由调用方按优先级随时补充；调用方提前结束迭代或超过截止时间时取消剩余抓取"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        global_sem = asyncio.Semaphore(self.max_concurrency)
+        host_sems: Dict[str, asyncio.Semaphore] = {}
+        finished = asyncio.Queue()
+
+        async with self._session() as session:
+            async def worker():
+                while True:
+                    url = await next_url()
+                    if url is None:
+                        return
+                    host_sem = host_sems.setdefault(urlparse(url).netloc, asyncio.Semaphore(self.per_host_limit))
+                    finished.put_nowait(await self._fetch_one(session, url, global_sem, host_sem))
+
+            workers = [asyncio.ensure_future(worker()) for _ in range(self.max_concurrency)]
+            # 全部工作协程退出后放入结束标记
+            all_done = asyncio.ensure_future(asyncio.gather(*workers))
+            all_done.add_done_callback(lambda _: finished.put_nowait(None))
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    try:
+                        item = await asyncio.wait_for(finished.get(), max(remaining, 0))
+                    except asyncio.TimeoutError:
+                        print(f"抓取超过截止时间 {self.deadline}s，放弃剩余网页")
+                        break
+                    if item is None:
+                        break
+                    url, content, error = item
+                    if error is not None:
+                        print(f"抓取失败 {url}: {error}")
+                    elif content:
+                        yield {'url': url, 'content': content}
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(all_done, return_exceptions=True)
+
+    def _session(self):
+        # aiohttp 导入约 150ms：只在真正抓取时才导入
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.per_host_limit)
+        return aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                     timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def _fetch_one(self, session, url, global_sem, host_sem):
+        """返回 (url, content, error)，异常不向外抛出"""
+        try:
+            entry = self.cache.lookup(url) if self.cache is not None else None
+            if entry and not self._covers(entry):
+                # 缓存的正文已被截断且预算比现在小，无法给出更长的正文：当作未命中重新下载
+                entry = None
+            if entry and entry["fresh"]:
+                self.cache.record_hit(entry)
+                return url, await self._cached_text(entry), None
+
+            async with global_sem, host_sem:
+                with tracing.span("http_fetch", host=urlparse(url).netloc, streaming=self.streaming) as s:
+                    async with session.get(url, headers=PageCache.conditional_headers(entry)) as response:
+                        s.set(status=response.status)
+                        if entry and response.status == 304:
+                            self.cache.refresh(url, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                            self.cache.record_hit(entry, revalidated=True)
+                            return url, await self._cached_text(entry), None
+                        response.raise_for_status()
+                        etag = response.headers.get("ETag")
+                        last_modified = response.headers.get("Last-Modified")
+                        if self.streaming:
+                            # 解析与读取交替进行，预算用完后直接释放连接，不读剩余内容
+                            reader = StreamingPageReader(response.charset, self.max_chars)
+                            async for chunk in response.content.iter_chunked(self.chunk_size):
+                                if reader.feed(chunk):
+                                    break
+                            raw, content = bytes(reader.raw), reader.result()
+                        else:
+                            raw = await response.read()
+                            charset = response.charset
+                    s.set(bytes=len(raw))
+            if not self.streaming:
+                loop = asyncio.get_running_loop()
+                with tracing.span("html_parse", bytes=len(raw)):
+                    content = await loop.run_in_executor(self.executor, extract_text_from_bytes,
+                                                         raw, charset, self.max_chars)
+            if self.cache is not None:
+                self.cache.record_miss()
+                self.cache.put(url, raw, content, self.max_chars, etag, last_modified)
+            return url, content, None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return url, None, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+    def _covers(self, entry: Dict) -> bool:
+        """缓存条目能否给出 max_chars 的正文：缓存时的预算不小于当前预算，或当时正文未被截断
+        （截断的正文以 "..." 结尾、长度超过预算；流式模式下此时原始字节也只读到一半）"""
+        return entry["max_chars"] >= self.max_chars or len(entry["text"]) <= entry["max_chars"]
+
+    async def _cached_text(self, entry: Dict) -> str:
+        """缓存的正文按 max_chars 截断；截断长度不同时从原始字节重新提取"""
+        if entry["max_chars"] == self.max_chars:
+            return entry["text"]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, extract_text_from_bytes,
+                                          entry["raw"], None, self.max_chars)
@@ -0,0 +1,112 @@
+# selection.py
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def distances_to_relevance(distances) -> np.ndarray:
+    """FAISS IndexFlatL2 返回平方 L2 距离；对单位向量 cos = 1 - d²/2"""
+    return 1.0 - np.asarray(distances, dtype=np.float32) / 2.0
+
+
+def source_max_similarity(vectors, sources: Optional[Sequence[str]] = None) -> np.ndarray:
+    """候选×候选 相似度矩阵（k×k）。给出来源时按知识边界取最大：
+    两个候选的相似度 = 各自来源在候选集内所有切片两两余弦的最大值，同源候选视为完全重复"""
+    unit = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(unit, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    unit = unit / norms
+    sims = unit @ unit.T
+    if sources is None:
+        return sims
+    _, inverse = np.unique(np.asarray(sources, dtype=object), return_inverse=True)
+    inverse = inverse.ravel()
+    n_src = inverse.max() + 1
+    per_src = np.full((n_src, n_src), -np.inf, dtype=np.float32)
+    np.maximum.at(per_src, (inverse[:, None], inverse[None, :]), sims)
+    np.fill_diagonal(per_src, 1.0)
+    return per_src[inverse][:, inverse]
+
+
+MODES = ("srt", "mmr")
+
+
+class CandidateSelector:
+    """SRT + MCT 一次完成的候选选择。
+
+    只在检索到的 k 个候选上工作：相关度直接复用检索得分（向量距离或混合检索的融合得分），
+    冗余度用候选自身的向量计算，代价与 k 相关而与语料规模无关。
+
+    mode="srt"（默认）沿用原 SRT + MCT 的选择语义：以相关度最高的候选为基准源，
+    保留与基准源最相似的 top_k 个其他来源的候选，再按候选顺序剔除与已保留结果相似度达到 threshold 的候选。
+    mode="mmr" 为 MMR 风格：每轮从剩余候选中选出 lambda_mult·相关度 − (1 − lambda_mult)·与已选的最大相似度
+    最高者，与已选结果相似度达到 threshold 的候选直接淘汰；lambda_mult=1 时即按相关度顺序的阈值去冗余。
+    """
+
+    def __init__(self, top_k: int = 3, threshold: float = 0.95, lambda_mult: float = 1.0, mode: str = "srt"):
+        if mode not in MODES:
+            raise ValueError(f"未知的选择方式: {mode}（可选 {', '.join(MODES)}）")
+        self.top_k = top_k
+        self.threshold = threshold
+        self.lambda_mult = lambda_mult
+        self.mode = mode
+
+    def select_indices(self, relevance, vectors, sources: Optional[Sequence[str]] = None) -> List[int]:
+        relevance = np.asarray(relevance, dtype=np.float32)
+        n = len(relevance)
+        if n == 0 or self.top_k <= 0:
+            return []
+        sims = source_max_similarity(vectors, sources)
+        if self.mode == "srt":
+            return self._select_srt(relevance, sims, sources)
+
+        # 与已选集合的最大相似度，随每次选择增量更新
+        redundancy = np.zeros(n, dtype=np.float32)
+        available = np.ones(n, dtype=bool)
+        selected: List[int] = []
+        while len(selected) < self.top_k and available.any():
+            score = self.lambda_mult * relevance - (1.0 - self.lambda_mult) * redundancy
+            score[~available] = -np.inf
+            best = int(np.argmax(score))
+            selected.append(best)
+            available[best] = False
+            redundancy = sims[best].copy() if len(selected) == 1 else np.maximum(redundancy, sims[best])
+            available &= redundancy < self.threshold
+        return selected
+
+    def _select_srt(self, relevance: np.ndarray, sims: np.ndarray, sources: Optional[Sequence[str]]) -> List[int]:
+        n = len(relevance)
+        if sources is None:
+            source_ids = np.arange(n)
+        else:
+            source_ids = np.unique(np.asarray(sources, dtype=object), return_inverse=True)[1].ravel()
+        base = int(np.argmax(relevance))
+
+        # SRT：其他来源按与基准源的（知识边界）相似度排序，取前 top_k 个；基准源本身不保留
+        ids, first = np.unique(source_ids, return_index=True)
+        order = np.argsort(first, kind="stable")
+        ids, first = ids[order], first[order]
+        other = ids != source_ids[base]
+        ids, first = ids[other], first[other]
+        top = ids[np.argsort(-sims[base, first], kind="stable")[:self.top_k]]
+
+        # MCT：按候选顺序保留与已保留结果相似度都低于 threshold 的候选
+        selected: List[int] = []
+        redundancy = np.full(n, -np.inf, dtype=np.float32)
+        for i in np.flatnonzero(np.isin(source_ids, top)):
+            if redundancy[i] < self.threshold:
+                selected.append(int(i))
+                redundancy = np.maximum(redundancy, sims[i])
+        return selected
+
+    def select(self, docs, relevance, vectors) -> list:
+        """docs/relevance/vectors 为同一次检索的候选切片、相关度（越大越相关）与向量；
+        纯向量检索的平方 L2 距离先用 distances_to_relevance 换算"""
+        return self.select_with_scores(docs, relevance, vectors)[0]
+
+    def select_with_scores(self, docs, relevance, vectors) -> Tuple[list, np.ndarray]:
+        """同 select，另外返回选中切片的相关度（供上下文装配按得分取舍）"""
+        sources = [d.metadata["source"] for d in docs]
+        picked = self.select_indices(relevance, vectors, sources)
+        return [docs[i] for i in picked], np.asarray(relevance, dtype=np.float32)[picked]
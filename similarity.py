@@ -1,65 +1,217 @@
 # similarity.py
 
+import os
+import json
+from typing import Optional
 import numpy as np
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from corpus_index import CorpusIndex, DEFAULT_EMBEDDING_MODEL
+from vector_store import VectorStore
+import tracing
 
 
 class KnowledgeBoundaryAwareSimilarity:
+    # 源×源 矩阵持久化在语料索引目录中，按语料版本校验；重启后直接 mmap 读取，不再读入全部切片向量
+    MATRIX_FILE = "source_similarity.npy"
+    MATRIX_META_FILE = "source_similarity.json"
+
     def __init__(self,
                  docs_dir: str,
-                 embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
-        # 加载与切分文档
-        loader = DirectoryLoader(
-            docs_dir,
-            glob="**/*.txt",
-            loader_cls=lambda p: TextLoader(p, encoding="utf-8")
-        )
-        docs = loader.load()
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = splitter.split_documents(docs)
-
-        # 初始化嵌入模型
-        self.emb = HuggingFaceEmbeddings(model_name=embedding_model_name)
-        self.doc_texts = [d.page_content for d in splits]
-        self.doc_sources = [d.metadata["source"] for d in splits]
-        self.vectors = self.emb.embed_documents(self.doc_texts)
+                 embedding_model_name: str = DEFAULT_EMBEDDING_MODEL,
+                 index: Optional[CorpusIndex] = None,
+                 block_size: Optional[int] = 1024,
+                 ann_backend=None,
+                 ann_search_k: Optional[int] = None,
+                 persist_matrix: bool = True):
+        # 复用共享语料索引中的切片与向量，不再单独加载、切分、嵌入
+        if index is None:
+            index = CorpusIndex(docs_dir, embedding_model_name=embedding_model_name)
+        self.index = index
+        self.doc_texts = index.doc_texts
+        self.doc_sources = index.doc_sources
+        # 切片向量直接读共享语料索引的紧凑向量存储（mmap，可为 sq8/pq 量化编码）；
+        # 只有普通向量数组时包装成内存中的 float32 存储
+        self.store = getattr(index, "vector_store", None)
+        if self.store is None:
+            vectors = np.asarray(index.vectors, dtype=np.float32).reshape(len(self.doc_sources), -1)
+            self.store = VectorStore("float32", vectors.shape[1], vectors)
+        # 分块矩阵乘的行数；None 表示一次性计算完整的 切片×切片 矩阵
+        self.block_size = block_size
 
         # 建立 source -> slices 的映射
         self.doc_index = {}
         for i, src in enumerate(self.doc_sources):
             self.doc_index.setdefault(src, []).append(i)
 
+        # 源文档编号：按首次出现顺序
+        self.sources = list(self.doc_index)
+        self.source_pos = {src: j for j, src in enumerate(self.sources)}
+
+        # 切片按源文档连续排列后的顺序（原始行号）、行号 → 源编号，以及每个源的起始行
+        self._order = np.fromiter((i for idxs in self.doc_index.values() for i in idxs),
+                                  dtype=np.int64, count=len(self.doc_sources))
+        self.row_source = np.repeat(np.arange(len(self.sources)),
+                                    [len(idxs) for idxs in self.doc_index.values()])
+        self.source_starts = np.searchsorted(self.row_source, np.arange(len(self.sources)))
+
+        self._unit_vectors = None
+        self._source_sim = None
+        self.persist_matrix = persist_matrix
+
+        # 可选的近似最近邻后端（如 ann_index.FaissANNBackend）：
+        # 设置后 rank_similar_documents 不再依赖全量 源×源 矩阵
+        self.ann_backend = ann_backend
+        self.ann_search_k = ann_search_k
+        if self.ann_backend is not None and len(self.unit_vectors):
+            self.ann_backend.build(self.unit_vectors)
+
+    @property
+    def unit_vectors(self) -> np.ndarray:
+        """预归一化的 float32 切片矩阵，按源文档连续排列，便于分段求最大值（首次使用时构建）"""
+        if self._unit_vectors is None:
+            self._unit_vectors = self._unit_rows(self._order)
+        return self._unit_vectors
+
+    def _unit_rows(self, rows: np.ndarray) -> np.ndarray:
+        """解码指定切片（原始行号）并归一化"""
+        unit = self.store.reconstruct(rows)
+        norms = np.linalg.norm(unit, axis=1, keepdims=True) if unit.size else np.ones((len(unit), 1), np.float32)
+        norms[norms == 0] = 1.0
+        return unit / norms
+
+    def source_similarity_matrix(self) -> np.ndarray:
+        """源×源 最大余弦相似度矩阵（首次调用时读取持久化结果或重新计算）"""
+        if self._source_sim is None:
+            self._source_sim = self._load_matrix()
+        if self._source_sim is None:
+            self._source_sim = self._compute_source_similarity()
+            self._save_matrix(self._source_sim)
+        return self._source_sim
+
+    def _matrix_paths(self):
+        index_dir = getattr(self.index, "index_dir", None)
+        if not self.persist_matrix or not index_dir or not hasattr(self.index, "fingerprint"):
+            return None
+        return os.path.join(index_dir, self.MATRIX_FILE), os.path.join(index_dir, self.MATRIX_META_FILE)
+
+    def _load_matrix(self) -> Optional[np.ndarray]:
+        paths = self._matrix_paths()
+        if paths is None or not os.path.exists(paths[1]):
+            return None
+        try:
+            with open(paths[1], "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("fingerprint") != self.index.fingerprint():
+                return None
+            return np.load(paths[0], mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+    def _save_matrix(self, matrix: np.ndarray):
+        paths = self._matrix_paths()
+        if paths is None:
+            return
+        os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+        # 先删旧版本信息、写矩阵，最后写版本信息，作为写完的标志
+        if os.path.exists(paths[1]):
+            os.remove(paths[1])
+        tmp = paths[0] + ".tmp.npy"
+        np.save(tmp, matrix)
+        os.replace(tmp, paths[0])
+        with open(paths[1], "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.index.fingerprint(), "sources": len(self.sources)}, f)
+
+    def _compute_source_similarity(self) -> np.ndarray:
+        n_src = len(self.sources)
+        result = np.full((n_src, n_src), -np.inf, dtype=np.float32)
+        n = len(self._order)
+        if n == 0:
+            return result
+
+        norms = np.sqrt(self.store.squared_norms())
+        norms[norms == 0] = 1.0
+        # 存储行号（原始顺序）→ 源编号
+        stored_source = np.empty(n, dtype=np.int64)
+        stored_source[self._order] = self.row_source
+        block = self.block_size or n
+        for r0 in range(0, n, block):
+            r1 = min(r0 + block, n)
+            # 行块按源连续排列，块内各行所属的源是连续的
+            rows = self._unit_rows(self._order[r0:r1])
+            row_src, row_starts = np.unique(self.row_source[r0:r1], return_index=True)
+            for c0 in range(0, n, block):
+                c1 = min(c0 + block, n)
+                # (b × b) 切片相似度：直接在紧凑存储的连续一段上计算，峰值内存只有一个块
+                sims = self.store.inner_products(rows, c0, c1) / norms[c0:c1]
+                # 块内的列按源稳定排序 → 沿列、沿行按源分段取最大 → (块内行源数 × 块内列源数)
+                perm = np.argsort(stored_source[c0:c1], kind="stable")
+                col_src, col_starts = np.unique(stored_source[c0:c1][perm], return_index=True)
+                reduced = np.maximum.reduceat(np.maximum.reduceat(sims[:, perm], col_starts, axis=1),
+                                              row_starts, axis=0)
+                tile = np.ix_(row_src, col_src)
+                result[tile] = np.maximum(result[tile], reduced)
+        return result
+
     def compute_max_similarity(self, src1: str, src2: str) -> float:
         """基于知识边界感知计算最大余弦相似度"""
-        idxs1 = self.doc_index.get(src1, [])
-        idxs2 = self.doc_index.get(src2, [])
-        if not idxs1 or not idxs2:
-            raise ValueError(f"未找到文档 {src1} 或 {src2} 的切片")
+        with tracing.span("compute_max_similarity"):
+            return self._max_similarity(src1, src2)
 
-        vecs1 = np.array([self.vectors[i] for i in idxs1])
-        vecs2 = np.array([self.vectors[i] for i in idxs2])
+    def _max_similarity(self, src1: str, src2: str) -> float:
+        i = self.source_pos.get(src1)
+        j = self.source_pos.get(src2)
+        if i is None or j is None:
+            raise ValueError(f"未找到文档 {src1} 或 {src2} 的切片")
+        if self._source_sim is None and self.ann_backend is not None:
+            # ANN 模式下不构建全量矩阵，只计算这一对源的切片块
+            sims = self._source_rows(i) @ self._source_rows(j).T
+            return float(np.max(sims))
+        return float(self.source_similarity_matrix()[i, j])
 
-        # 计算 pairwise cosine similarity
-        norms = np.linalg.norm(vecs1, axis=1)[:, None] * np.linalg.norm(vecs2, axis=1)[None, :]
-        sim_matrix = (vecs1 @ vecs2.T) / norms
-        return float(np.max(sim_matrix))
+    def _source_rows(self, pos: int) -> np.ndarray:
+        end = self.source_starts[pos + 1] if pos + 1 < len(self.sources) else len(self._order)
+        if self._unit_vectors is not None:
+            return self._unit_vectors[self.source_starts[pos]:end]
+        return self._unit_rows(self._order[self.source_starts[pos]:end])
 
     def rank_similar_documents(self, target_src: str, top_k=5):
         """返回与目标文档最相似的前K个文档源路径（用于SRT过滤前排序）"""
         if target_src not in self.doc_index:
             raise ValueError(f"目标文档 {target_src} 不存在")
 
-        similarities = []
-        for other_src in set(self.doc_sources):
-            if other_src == target_src:
-                continue
-            sim = self.compute_max_similarity(target_src, other_src)
-            similarities.append((other_src, sim))
+        t = self.source_pos[target_src]
+        if self.ann_backend is not None:
+            return self._rank_with_ann(t, top_k)
+        row = self.source_similarity_matrix()[t].copy()
+        row[t] = -np.inf
+        k = min(top_k, len(row) - 1)
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-row, k - 1)[:k]
+        top = top[np.argsort(-row[top], kind="stable")]
+        return [(self.sources[j], float(row[j])) for j in top]
+
+    def _rank_with_ann(self, t: int, top_k: int):
+        """用目标源的每个切片查询 ANN 索引，按源聚合最大得分"""
+        if top_k <= 0:
+            return []
+        queries = self._source_rows(t)
+        k = self.ann_search_k or max(4 * top_k, 32)
+        scores, ids = self.ann_backend.search(queries, k + len(queries))
+        scores, ids = scores.ravel(), ids.ravel()
+        valid = ids >= 0
+        scores, srcs = scores[valid], self.row_source[ids[valid]]
+        other = srcs != t
+        scores, srcs = scores[other], srcs[other]
+        if not len(srcs):
+            return []
 
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        return similarities[:top_k]
+        # 每个源只保留最高得分：按 (源, -得分) 排序后取每段第一个
+        order = np.lexsort((-scores, srcs))
+        uniq, first = np.unique(srcs[order], return_index=True)
+        best = scores[order][first]
+        top = np.argsort(-best, kind="stable")[:top_k]
+        return [(self.sources[uniq[j]], float(best[j])) for j in top]
 
     def list_documents(self):
         return sorted(set(self.doc_sources))
@@ -0,0 +1,100 @@
+# test_batch_runner.py
+
+import json
+import asyncio
+from types import SimpleNamespace
+
+from batch_runner import BatchRunner, load_checkpoint
+from rag_server import RAGService
+from test_corpus_index import FakeEmbeddings, _write_corpus
+
+
+class FakeChatModel:
+    """按提示类型计数的 LLM 替身"""
+
+    def __init__(self):
+        self.hyde_calls = 0
+        self.rag_calls = 0
+
+    async def ainvoke(self, messages, **kwargs):
+        await asyncio.sleep(0.01)
+        if messages[0]["role"] == "system":
+            self.rag_calls += 1
+            return SimpleNamespace(content=f"回答 {self.rag_calls}")
+        if isinstance(messages[0]["content"], list):
+            return SimpleNamespace(content="基线回答")
+        self.hyde_calls += 1
+        return SimpleNamespace(content="假设文档")
+
+
+def _service(tmp_path, llm, **kwargs):
+    docs_dir = str(tmp_path / "docs")
+    _write_corpus(docs_dir)
+    return RAGService(api_key="test", model_name="fake", base_url="http://127.0.0.1:1",
+                      docs_dir=docs_dir, index_dir=str(tmp_path / "index"),
+                      llm=llm, embeddings=FakeEmbeddings(), workers=4, **kwargs)
+
+
+def _write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            f.write((r if isinstance(r, str) else json.dumps(r, ensure_ascii=False)) + "\n")
+
+
+def _read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_batch_dedupes_retrieval_and_streams_results(tmp_path):
+    queries = tmp_path / "queries.jsonl"
+    _write_jsonl(queries, [
+        {"id": "a", "query": "故宫的历史"},
+        {"id": "b", "query": "故宫的历史？", "image_url": "http://example.com/1.png"},
+        {"id": "c", "query": "西湖十景"},
+        {"query": "故宫的历史"},
+        {"id": "e"},
+        "不是 JSON",
+    ])
+    llm = FakeChatModel()
+    output = tmp_path / "out" / "results.jsonl"
+    stats = BatchRunner(_service(tmp_path, llm), workers=3).run(str(queries), str(output))
+
+    records = {r["id"]: r for r in _read_jsonl(output)}
+    assert set(records) == {"a", "b", "c", "line-4", "e", "line-6"}
+    assert llm.hyde_calls == 2 and llm.rag_calls == 4
+    assert stats["done"] == 4 and stats["failed"] == 2 and stats["retrieval_reused"] == 2
+    assert records["b"]["image_url"] == "http://example.com/1.png"
+    assert records["a"]["sources"] and "error" in records["e"] and "error" in records["line-6"]
+
+
+def test_batch_resumes_from_checkpoint(tmp_path):
+    queries = tmp_path / "queries.jsonl"
+    _write_jsonl(queries, [{"id": str(i), "query": f"问题 {i}"} for i in range(5)])
+    output = tmp_path / "results.jsonl"
+    # 模拟中断：0 已完成，1 失败，2 只写了一半
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "0", "answer": "旧回答"}) + "\n")
+        f.write(json.dumps({"id": "1", "error": "超时"}) + "\n")
+        f.write('{"id": "2", "ans')
+    assert load_checkpoint(str(output)) == {"0"}
+
+    llm = FakeChatModel()
+    stats = BatchRunner(_service(tmp_path, llm), workers=2, baseline=True).run(str(queries), str(output))
+    assert stats["skipped"] == 1 and stats["done"] == 4
+    records = _read_jsonl(output)
+    assert [r["id"] for r in records[:2]] == ["0", "1"]
+    assert sorted(r["id"] for r in records[2:]) == ["1", "2", "3", "4"]
+    assert all(r["baseline"] == "基线回答" for r in records[2:])
+
+
+def test_completed_retrievals_are_bounded(tmp_path):
+    queries = tmp_path / "queries.jsonl"
+    _write_jsonl(queries, [{"id": str(i), "query": f"问题 {i % 6}"} for i in range(12)])
+    llm = FakeChatModel()
+    runner = BatchRunner(_service(tmp_path, llm), workers=1, retrieval_cache_size=2)
+    stats = runner.run(str(queries), str(tmp_path / "results.jsonl"))
+    assert stats["done"] == 12
+    # 只保留最近 2 个检索结果：6 个查询轮流出现，第二轮都已被淘汰
+    assert len(runner._retrievals) <= 2
+    assert llm.hyde_calls == 12 and stats["retrieval_reused"] == 0
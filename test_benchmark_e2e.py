@@ -0,0 +1,35 @@
+# test_benchmark_e2e.py
+
+import json
+import benchmark_e2e
+import corpus_index
+from benchmark_e2e import build_parser, make_synthetic_corpus, run
+
+
+def test_synthetic_corpus_is_reused(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    assert make_synthetic_corpus(docs_dir, 25, chunks_per_file=10) == 3
+    marker = (tmp_path / "docs" / "synthetic_0.txt").stat().st_mtime_ns
+    assert make_synthetic_corpus(docs_dir, 25, chunks_per_file=10) == 3
+    assert (tmp_path / "docs" / "synthetic_0.txt").stat().st_mtime_ns == marker
+
+
+def test_benchmark_smoke(tmp_path):
+    output = tmp_path / "bench.json"
+    originals = (corpus_index.get_embedding_service, benchmark_e2e.ddgs.DDGS, benchmark_e2e.main_module.chat_model)
+    args = build_parser().parse_args([
+        "--sizes", "60", "--workdir", str(tmp_path / "bench"), "--queries", "3", "--pages", "4",
+        "--scrape-runs", "1", "--main-runs", "1", "--import-runs", "1", "--llm-latency", "0", "--web-latency", "0",
+        "--json", str(output)])
+    results = run(args)
+
+    stages = results["sizes"]["60"]
+    assert set(stages) == {"index_build", "index_load", "rewrite_query_with_hyde", "rank_similar_documents",
+                           "scrape", "main_cold", "main_warm", "main_cached"}
+    assert stages["rewrite_query_with_hyde"]["count"] == 3
+    assert set(results["startup"]) == {"import_main", "import_rag_server", "import_batch_runner"}
+    assert all(s["p50_ms"] <= s["p99_ms"] for s in stages.values())
+    assert json.loads(output.read_text(encoding="utf-8"))["sizes"]["60"]["scrape"]["count"] == 1
+    # 替身在运行结束后被还原
+    assert (corpus_index.get_embedding_service, benchmark_e2e.ddgs.DDGS,
+            benchmark_e2e.main_module.chat_model) == originals
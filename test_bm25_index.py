@@ -0,0 +1,78 @@
+# test_bm25_index.py
+
+import json
+import math
+from collections import Counter
+
+import numpy as np
+from agent import ContentAnalysisTool
+from bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+from corpus_index import CorpusIndex
+from test_corpus_index import FakeEmbeddings, _write_corpus
+
+
+TEXTS = [
+    "北京故宫是明清两代的皇家宫殿。",
+    "上海外滩的夜景非常迷人。",
+    "杭州西湖以西湖十景闻名，West Lake 非常美。",
+    "故宫博物院收藏了大量文物，故宫每年接待游客上千万。",
+    "",
+]
+
+
+def _reference_bm25(texts, query, k1=1.5, b=0.75):
+    docs = [Counter(tokenize(t)) for t in texts]
+    lens = [sum(d.values()) for d in docs]
+    avg = sum(lens) / len(lens)
+    scores = []
+    for doc, length in zip(docs, lens):
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(1 for d in docs if term in d)
+            if not df:
+                continue
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = doc[term]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg))
+        scores.append(score)
+    return scores
+
+
+def test_tokenize_cjk_and_latin():
+    assert tokenize("故宫 Palace，ＡＢＣ") == ["故", "宫", "故宫", "palace", "abc"]
+
+
+def test_bm25_matches_reference_and_ranks():
+    index = BM25Index(TEXTS)
+    for query in ["故宫", "西湖十景", "west lake 夜景", "不存在的词"]:
+        np.testing.assert_allclose(index.scores(query), _reference_bm25(TEXTS, query), rtol=1e-5)
+    ids, scores = index.search("故宫的文物", 2)
+    assert list(ids) == [3, 0] and scores[0] > scores[1]
+    np.testing.assert_allclose(index.coverage("西湖 美景"), [0, 1 / 6, 5 / 6, 0, 0], atol=1e-6)
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], rrf_k=60)
+    assert [doc for doc, _ in fused] == [1, 3, 2]
+    assert 0 < fused[-1][1] < fused[0][1] <= 1.0
+
+
+def test_hybrid_search_surfaces_lexical_matches(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    _write_corpus(docs_dir)
+    embeddings = FakeEmbeddings()
+    corpus = CorpusIndex(docs_dir, index_dir=str(tmp_path / "index"), embeddings=embeddings)
+    query = "西湖"
+    docs, relevance, vectors = corpus.hybrid_search([query], [embeddings.embed_query(query)], 2)[0]
+    assert docs[0].metadata["source"].endswith("hangzhou.txt")
+    assert len(docs) == len(relevance) == len(vectors) == 2
+    assert relevance[0] >= relevance[1]
+
+
+def test_content_analysis_scores_chinese_pages():
+    tool = ContentAnalysisTool()
+    results = [json.loads(r) for r in tool.analyze_many(TEXTS[:4], "故宫文物")]
+    assert results[3]["relevance_score"] > results[0]["relevance_score"] > 0
+    assert results[1]["relevance_score"] == 0 and results[1]["bm25_score"] == 0
+    single = json.loads(tool.run({"content": TEXTS[3], "query": "故宫文物"}))
+    assert single["relevance_score"] == results[3]["relevance_score"]
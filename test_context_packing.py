@@ -0,0 +1,69 @@
+# test_context_packing.py
+
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from context_packing import ContextPacker, TokenCounter, estimate_tokens, span_overlap
+from rag_prompt import CONTEXT_SEPARATOR
+
+
+def _article(n: int = 30) -> str:
+    return "".join(f"第{i}句讲的是西湖边第{i}座桥的来历与传说。" for i in range(n))
+
+
+def test_estimate_tokens_and_cached_counter():
+    assert estimate_tokens("西湖") == 2
+    assert estimate_tokens("hello world!") == 2 + 2 + 1
+    counter = TokenCounter(encoding=None)
+    assert counter("西湖十景") == 4
+    counter("西湖十景")
+    assert counter.count.cache_info().hits == 1
+
+
+def test_overlapping_chunks_are_merged_back():
+    text = _article()
+    chunks = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=60, separators=["。", ""],
+                                            keep_separator="end").split_text(text)
+    assert len(chunks) > 3
+    assert span_overlap(chunks[0], chunks[1], 200) > 0
+    docs = [Document(page_content=c, metadata={"source": "xihu.txt"}) for c in chunks]
+
+    # 乱序给出得分：重叠片段去掉后按原文拼接回一个连续片段
+    scores = [0.9 if i == 2 else 0.5 - i * 0.01 for i in range(len(docs))]
+    packer = ContextPacker(budget_tokens=10_000, counter=TokenCounter(encoding=None))
+    context, report = packer.pack(docs, scores)
+    assert context == text
+    assert report["pieces"] == 1 and report["trimmed"] == 0
+    assert report["saved_tokens"] > 0 and report["deduplicated_chars"] > 0
+
+
+def test_budget_keeps_best_chunks_and_trims_at_sentence_end():
+    counter = TokenCounter(encoding=None)
+    docs = [Document(page_content=f"文档{i}：" + _article(10), metadata={"source": f"doc_{i}.txt"}) for i in range(3)]
+    docs[2] = Document(page_content="最相关：" + _article(10), metadata={"source": "best.txt"})
+    query = "介绍一下西湖"
+    packer = ContextPacker(budget_tokens=300, counter=counter, min_chunk_tokens=10)
+    context, report = packer.pack(docs, [0.2, 0.1, 0.9], query=query)
+
+    pieces = context.split(CONTEXT_SEPARATOR)
+    assert pieces[0].startswith("最相关")
+    assert report["context_tokens"] + counter(query) <= 300
+    assert report["trimmed"] == 1 and pieces[-1].endswith("。")
+    assert report["saved_tokens"] == report["original_tokens"] - report["context_tokens"] > 0
+
+
+def test_packing_tokenizes_each_chunk_once():
+    class RecordingCounter(TokenCounter):
+        chars = 0
+
+        def count_uncached(self, text):
+            RecordingCounter.chars += len(text)
+            return super().count_uncached(text)
+
+    docs = [Document(page_content=f"第{i}篇：" + "西湖十景各有来历。" * 10, metadata={"source": f"{i}.txt"})
+            for i in range(60)]
+    total = sum(len(d.page_content) for d in docs)
+    context, report = ContextPacker(budget_tokens=100_000, counter=RecordingCounter(encoding=None)).pack(docs)
+    assert report["pieces"] == 60 and report["context_tokens"] == report["original_tokens"]
+    # 每个切片、原始拼接与最终上下文各切分一次：与切片总长度成线性，而不是随已装入内容平方增长
+    assert RecordingCounter.chars <= 3 * total + 2 * len(CONTEXT_SEPARATOR) * len(docs)
@@ -0,0 +1,194 @@
+# test_corpus_index.py
+
+import os
+import zlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from corpus_index import CorpusIndex
+from similarity import KnowledgeBoundaryAwareSimilarity
+
+
+class FakeEmbeddings(Embeddings):
+    """离线测试用嵌入：按字符哈希到固定维度并归一化，同时记录嵌入次数"""
+
+    def __init__(self, dim: int = 32):
+        self.dim = dim
+        self.calls = 0
+
+    def _embed(self, text: str):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for ch in text:
+            vec[zlib.crc32(ch.encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _write_corpus(docs_dir):
+    os.makedirs(docs_dir, exist_ok=True)
+    files = {
+        "beijing.txt": "北京故宫是明清两代的皇家宫殿。",
+        "shanghai.txt": "上海外滩的夜景非常迷人。",
+        "hangzhou.txt": "杭州西湖以西湖十景闻名。",
+    }
+    for name, text in files.items():
+        with open(os.path.join(docs_dir, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def test_corpus_index_persist_and_reload(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    index_dir = str(tmp_path / "index")
+    _write_corpus(docs_dir)
+
+    emb = FakeEmbeddings()
+    corpus = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=emb)
+    assert len(corpus) == 3
+    assert emb.calls == 3
+
+    # 语料未变化：重启后直接读取磁盘索引，不再嵌入
+    emb2 = FakeEmbeddings()
+    reloaded = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=emb2)
+    assert emb2.calls == 0
+    assert reloaded.doc_sources == corpus.doc_sources
+    assert np.allclose(reloaded.vectors, corpus.vectors)
+
+    docs = reloaded.as_retriever(k=1).invoke("上海外滩的夜景")
+    assert docs[0].metadata["source"].endswith("shanghai.txt")
+
+    # HyDE 检索与相似度计算共用同一份切片与向量
+    sim_calc = KnowledgeBoundaryAwareSimilarity(docs_dir=docs_dir, index=reloaded)
+    assert sim_calc.list_documents() == sorted(set(reloaded.doc_sources))
+
+
+def test_corpus_index_incremental_update(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    index_dir = str(tmp_path / "index")
+    _write_corpus(docs_dir)
+    CorpusIndex(docs_dir, index_dir=index_dir, embeddings=FakeEmbeddings())
+
+    # 新增文件：只嵌入新文件的切片
+    with open(os.path.join(docs_dir, "shenzhen.txt"), "w", encoding="utf-8") as f:
+        f.write("深圳大梅沙是热门的海滨度假区。")
+    emb = FakeEmbeddings()
+    corpus = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=emb)
+    assert emb.calls == 1
+    assert [os.path.basename(p) for p in corpus.last_update["added"]] == ["shenzhen.txt"]
+    assert len(corpus.vector_store) == len(corpus) == 4
+
+    # 覆盖写入 + 删除：旧向量从向量存储中移除
+    with open(os.path.join(docs_dir, "beijing.txt"), "w", encoding="utf-8") as f:
+        f.write("北京天坛是明清皇帝祭天的场所。")
+    os.remove(os.path.join(docs_dir, "hangzhou.txt"))
+    emb = FakeEmbeddings()
+    corpus = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=emb)
+    report = corpus.last_update
+    assert emb.calls == 1
+    assert [os.path.basename(p) for p in report["modified"]] == ["beijing.txt"]
+    assert [os.path.basename(p) for p in report["removed"]] == ["hangzhou.txt"]
+    assert report["removed_chunks"] == 2
+    assert len(corpus.vector_store) == len(corpus) == 3
+    assert not any(src.endswith("hangzhou.txt") for src in corpus.doc_sources)
+    assert "北京天坛是明清皇帝祭天的场所。" in corpus.doc_texts
+
+    # 向量、存储行与切片保持一一对应
+    for i, text in enumerate(corpus.doc_texts):
+        assert np.allclose(corpus.vectors[i], emb._embed(text))
+        assert np.allclose(corpus.vector_store.reconstruct([i])[0], emb._embed(text))
+
+    # 只改修改时间、内容不变：不重新嵌入
+    os.utime(os.path.join(docs_dir, "shanghai.txt"))
+    emb = FakeEmbeddings()
+    corpus = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=emb)
+    assert emb.calls == 0
+    assert not corpus.last_update["modified"]
+
+
+def test_corpus_index_streaming_ingest_with_process_pool(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    os.makedirs(docs_dir)
+    for i in range(CorpusIndex.POOL_MIN_FILES + 2):
+        with open(os.path.join(docs_dir, f"doc_{i:02d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(f"第{i}篇文档的第{j}段：" + "西湖龙井" * 20 for j in range(3)))
+
+    class BatchRecorder(FakeEmbeddings):
+        def embed_documents(self, texts):
+            self.batches = getattr(self, "batches", []) + [len(texts)]
+            return super().embed_documents(texts)
+
+    serial = CorpusIndex(docs_dir, index_dir=str(tmp_path / "serial"), embeddings=FakeEmbeddings(),
+                         chunk_size=60, chunk_overlap=0, ingest_workers=1)
+    emb = BatchRecorder()
+    pooled = CorpusIndex(docs_dir, index_dir=str(tmp_path / "pooled"), embeddings=emb,
+                         chunk_size=60, chunk_overlap=0, ingest_workers=2, embed_batch_size=7)
+
+    # 进程池切分的结果与顺序切分完全一致，嵌入按固定大小分批
+    assert pooled.doc_texts == serial.doc_texts and pooled.doc_sources == serial.doc_sources
+    assert np.allclose(pooled.vectors, serial.vectors)
+    assert all(n == 7 for n in emb.batches[:-1]) and sum(emb.batches) == len(pooled)
+
+
+def test_update_never_replaces_a_mapped_vector_file(tmp_path, monkeypatch):
+    import vector_store
+    docs_dir = str(tmp_path / "docs")
+    index_dir = str(tmp_path / "index")
+    _write_corpus(docs_dir)
+    corpus = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=FakeEmbeddings())
+    # 另一个实例（相似度计算、服务）仍在 mmap 旧文件
+    held = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=FakeEmbeddings()).vector_store
+    before = held.reconstruct().copy()
+
+    # 模拟 Windows：已被映射的文件不能被替换或删除
+    mapped = {os.path.abspath(held.path)}
+    replace, remove = os.replace, os.remove
+
+    def guarded_replace(src, dst):
+        if os.path.abspath(dst) in mapped:
+            raise PermissionError(dst)
+        replace(src, dst)
+
+    def guarded_remove(path):
+        if os.path.abspath(path) in mapped:
+            raise PermissionError(path)
+        remove(path)
+
+    monkeypatch.setattr(vector_store.os, "replace", guarded_replace)
+    monkeypatch.setattr(os, "remove", guarded_remove)
+    with open(os.path.join(docs_dir, "shenzhen.txt"), "w", encoding="utf-8") as f:
+        f.write("深圳大梅沙是热门的海滨度假区。")
+    corpus.update()
+
+    assert corpus.vector_store.path != held.path
+    assert os.path.exists(held.path)
+    assert np.array_equal(held.reconstruct(), before)
+    reloaded = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=FakeEmbeddings())
+    assert len(reloaded.vector_store) == len(reloaded) == 4
+
+    # 旧文件不再被映射后，下一次保存时清理
+    mapped.clear()
+    os.remove(os.path.join(docs_dir, "shenzhen.txt"))
+    corpus.update()
+    assert sorted(n for n in os.listdir(index_dir) if n.startswith("vectors.")) == \
+        [os.path.basename(corpus.vector_store.path)]
+
+
+def test_stored_fingerprint_reads_only_the_manifest(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    index_dir = str(tmp_path / "index")
+    assert CorpusIndex.stored_fingerprint(docs_dir, index_dir) is None
+    _write_corpus(docs_dir)
+    corpus = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=FakeEmbeddings())
+    assert CorpusIndex.stored_fingerprint(docs_dir, index_dir) == corpus.fingerprint()
+
+    # 文档在保存后被改动：版本未知
+    with open(os.path.join(docs_dir, "shenzhen.txt"), "w", encoding="utf-8") as f:
+        f.write("深圳大梅沙是热门的海滨度假区。")
+    assert CorpusIndex.stored_fingerprint(docs_dir, index_dir) is None
+    corpus.update()
+    assert CorpusIndex.stored_fingerprint(docs_dir, index_dir) == corpus.fingerprint()
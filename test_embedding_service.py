@@ -0,0 +1,93 @@
+# test_embedding_service.py
+
+import time
+import threading
+import numpy as np
+from embedding_service import EmbeddingService, VectorCache
+from test_corpus_index import FakeEmbeddings
+
+
+class SlowFakeEmbeddings(FakeEmbeddings):
+    """记录每次调用的批大小，并模拟模型前向耗时"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.batch_sizes = []
+
+    def embed_documents(self, texts):
+        self.batch_sizes.append(len(texts))
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+
+def test_cache_hits_are_persisted_across_instances(tmp_path):
+    model = SlowFakeEmbeddings()
+    service = EmbeddingService("fake", cache_dir=str(tmp_path), model=model)
+    texts = ["故宫", "西湖", "故宫", "外滩"]
+    first = service.embed_array(texts)
+    assert first.shape == (4, 32) and first.dtype == np.float32
+    assert model.calls == 3  # 重复文本只嵌入一次
+    np.testing.assert_allclose(first[0], first[2])
+    np.testing.assert_allclose(first[1], model._embed("西湖"), rtol=1e-6)
+
+    reopened = EmbeddingService("fake", cache_dir=str(tmp_path), model=SlowFakeEmbeddings())
+    np.testing.assert_allclose(reopened.embed_array(texts), first)
+    assert reopened.model.calls == 0
+    assert reopened.stats["cache_hits"] == 4
+
+    # 不同模型名不共享缓存
+    other = EmbeddingService("other", cache_dir=str(tmp_path), model=SlowFakeEmbeddings())
+    other.embed_query("故宫")
+    assert other.model.calls == 1
+
+
+def test_partial_tail_is_truncated_before_appending(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(4, 8)).astype(np.float32)
+    cache = VectorCache(str(tmp_path))
+    cache.put_many(["a", "b"], vectors[:2])
+
+    # 模拟中断：向量已追加（一整行加半行）但键还没写，另有一个写了一半的键
+    with open(cache._data_path, "ab") as f:
+        f.write(rng.normal(size=12).astype(np.float32).tobytes())
+    with open(cache._keys_path, "a", encoding="utf-8") as f:
+        f.write("hal")
+
+    reopened = VectorCache(str(tmp_path))
+    assert len(reopened) == 2
+    reopened.put_many(["c", "d"], vectors[2:])
+    again = VectorCache(str(tmp_path))
+    found = again.get_many(["a", "b", "c", "d", "hal"])
+    assert set(found) == {"a", "b", "c", "d"}
+    for i, key in enumerate("abcd"):
+        np.testing.assert_array_equal(found[key], vectors[i])
+
+
+def test_float16_storage(tmp_path):
+    service = EmbeddingService("fake", cache_dir=str(tmp_path), dtype="float16", model=SlowFakeEmbeddings())
+    expected = service.embed_array(["北京故宫是明清两代的皇家宫殿。"])
+    reopened = EmbeddingService("fake", cache_dir=str(tmp_path), dtype="float16", model=SlowFakeEmbeddings())
+    cached = reopened.embed_array(["北京故宫是明清两代的皇家宫殿。"])
+    assert reopened.model.calls == 0
+    np.testing.assert_allclose(cached, expected, atol=1e-3)
+
+
+def test_concurrent_requests_are_micro_batched(tmp_path):
+    model = SlowFakeEmbeddings(latency=0.02)
+    service = EmbeddingService("fake", cache_dir=None, max_batch_size=16, max_wait_ms=20, model=model)
+    results = {}
+
+    def worker(i):
+        results[i] = service.embed_query(f"查询{i}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 16
+    assert sum(model.batch_sizes) == 16
+    assert len(model.batch_sizes) < 16
+    np.testing.assert_allclose(results[3], model._embed("查询3"), rtol=1e-6)
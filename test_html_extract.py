@@ -0,0 +1,46 @@
+# test_html_extract.py
+
+import os
+import glob
+import pytest
+from html_extract import extract_text, extract_text_from_bytes, extract_text_streaming
+
+
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "fixtures", "html", "*.html")))
+
+
+def _chunks(raw: bytes, size: int):
+    for i in range(0, len(raw), size):
+        yield raw[i:i + size]
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+@pytest.mark.parametrize("chunk_size", [7, 1024, 1 << 20])
+def test_streaming_matches_full_parse(path, chunk_size):
+    raw = open(path, "rb").read()
+    for max_chars in (300, 5000, 10 ** 6):
+        expected = extract_text_from_bytes(raw, max_chars=max_chars)
+        streamed = extract_text_streaming(_chunks(raw, chunk_size), max_chars=max_chars,
+                                          skip_tags=("script", "style"))
+        assert streamed == expected
+
+
+def test_streaming_skips_nav_and_normalizes_whitespace():
+    html = ("<html><head><title>故宫  介绍</title><style>p {}</style></head><body>"
+            "<nav><a>首页</a></nav><p>明清\n\n  皇家宫殿 &amp; 博物院</p><script>var a;</script></body></html>")
+    assert extract_text(html) == "故宫 介绍首页明清 皇家宫殿 & 博物院"
+    assert extract_text_streaming([html.encode("utf-8")]) == "故宫 介绍明清 皇家宫殿 & 博物院"
+
+
+def test_streaming_stops_reading_once_budget_is_hit():
+    consumed = []
+
+    def chunks():
+        yield "<html><body>".encode("utf-8")
+        for i in range(10000):
+            consumed.append(i)
+            yield f"<p>第{i}段正文内容</p>\n".encode("utf-8")
+
+    text = extract_text_streaming(chunks(), declared_encoding="utf-8", max_chars=200)
+    assert len(text) == 203 and text.endswith("...")
+    assert len(consumed) < 100
@@ -0,0 +1,98 @@
+# test_hyde_cache.py
+
+import time
+from types import SimpleNamespace
+import numpy as np
+from corpus_index import CorpusIndex
+from hyde_cache import HyDECache, normalize_query
+from query_rewriter import QueryRewriter
+from test_corpus_index import FakeEmbeddings, _write_corpus
+
+
+class CountingLLM:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(content=f"假设文档 {self.calls}")
+
+
+def test_hyde_cache_exact_semantic_and_persistence(tmp_path):
+    path = str(tmp_path / "hyde.db")
+    cache = HyDECache(path, threshold=0.9)
+    vec = np.array([1.0, 0.0, 0.0])
+    cache.put("故宫有什么历史？", "上下文A", vec, 512, "文档A")
+
+    assert normalize_query(" 故宫有什么历史? ") == normalize_query("故宫有什么历史？")
+    assert cache.lookup(" 故宫有什么历史? ", "上下文A", vec, 512) == "文档A"
+    # 近似问法：上下文相同、向量足够接近
+    assert cache.lookup("介绍一下故宫的历史", "上下文A", [0.99, 0.05, 0.0], 512) == "文档A"
+    # 上下文变化或向量差异过大都不命中
+    assert cache.lookup("故宫有什么历史？", "上下文B", vec, 512) is None
+    assert cache.lookup("西湖十景", "上下文A", [0.0, 1.0, 0.0], 512) is None
+    assert cache.stats == {"exact_hits": 1, "semantic_hits": 1, "misses": 2, "evicted": 0}
+    cache.close()
+
+    reopened = HyDECache(path, threshold=0.9)
+    assert reopened.lookup("介绍一下故宫的历史", "上下文A", [0.99, 0.05, 0.0], 512) == "文档A"
+
+    reopened.ttl = 0
+    assert reopened.lookup("故宫有什么历史？", "上下文A", vec, 512) is None
+
+
+def test_semantic_lookup_skips_expired_best_match(tmp_path):
+    cache = HyDECache(str(tmp_path / "hyde.db"), threshold=0.9)
+    cache.put("故宫的历史", "上下文A", [1.0, 0.0, 0.0], 512, "过期文档")
+    cache.put("故宫历史介绍", "上下文A", [0.95, 0.2, 0.0], 512, "有效文档")
+    cache.put("西湖十景", "上下文A", [0.0, 1.0, 0.0], 512, "无关文档")
+    cache._conn.execute("UPDATE hyde SET created_at = 0 WHERE hypothetical_doc = '过期文档'")
+    # 最相似的条目已过期：取下一个仍在阈值之上的条目
+    assert cache.lookup("介绍一下故宫的历史", "上下文A", [1.0, 0.01, 0.0], 512) == "有效文档"
+    # 阈值之上的条目都过期时不命中，不会退到阈值以下的条目
+    cache._conn.execute("UPDATE hyde SET created_at = 0 WHERE hypothetical_doc = '有效文档'")
+    assert cache.lookup("介绍一下故宫的历史", "上下文A", [1.0, 0.01, 0.0], 512) is None
+    assert cache.stats["semantic_hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_hyde_cache_lru_eviction(tmp_path):
+    cache = HyDECache(str(tmp_path / "hyde.db"), max_entries=2)
+    cache.put("q1", "c", [1.0, 0.0], 512, "d1")
+    cache.put("q2", "c", [0.0, 1.0], 512, "d2")
+    cache.lookup("q1", "c", [1.0, 0.0], 512)
+    cache.put("q3", "c", [0.7, 0.7], 512, "d3")
+    assert len(cache) == 2
+    assert cache.lookup("q2", "c", [0.0, 1.0], 512) is None
+    assert cache.lookup("q1", "c", [1.0, 0.0], 512) == "d1"
+
+
+def test_hyde_cache_eviction_updates_rows_in_place(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 16))
+    cache = HyDECache(str(tmp_path / "hyde.db"), threshold=0.99, max_entries=10)
+    # 淘汰只删除被淘汰的行，不再从 SQLite 重新读入全部向量
+    cache._load_vectors = None
+    for i, vec in enumerate(vectors):
+        cache.put(f"问题{i}", f"上下文{i % 3}", vec, 512, f"文档{i}")
+        time.sleep(0.001)
+    assert len(cache) == 10 and cache._size == 10 and cache.stats["evicted"] == 40
+
+    # 行被移动后，语义查找仍然返回各自的文档；被淘汰的条目不再命中
+    for i, vec in enumerate(vectors):
+        found = cache.lookup(f"另一种问法{i}", f"上下文{i % 3}", vec + 0.01, 512)
+        assert found == (f"文档{i}" if i >= 40 else None), i
+
+
+def test_rewriter_skips_llm_on_cache_hit(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    _write_corpus(docs_dir)
+    corpus = CorpusIndex(docs_dir, index_dir=str(tmp_path / "index"), embeddings=FakeEmbeddings())
+    rewriter = QueryRewriter(api_key="test", model_name="fake", base_url="http://127.0.0.1:1",
+                             docs_dir=docs_dir, index=corpus, cache=HyDECache(str(tmp_path / "hyde.db")))
+    rewriter.llm = CountingLLM()
+
+    first = rewriter.rewrite_query_with_hyde("故宫的历史", k=2)
+    second = rewriter.rewrite_query_with_hyde("故宫的历史？", k=2)
+    assert rewriter.llm.calls == 1
+    assert first.startswith("假设文档 1") and second.startswith("假设文档 1")
+    assert "故宫的历史？" in second
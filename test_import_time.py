@@ -0,0 +1,52 @@
+# test_import_time.py
+
+import os
+import sys
+import json
+import subprocess
+
+from corpus_index import CorpusIndex
+from similarity import KnowledgeBoundaryAwareSimilarity
+from test_corpus_index import FakeEmbeddings, _write_corpus
+
+
+# 只在真正需要时才允许导入的重量级依赖（导入耗时从数百毫秒到数秒不等）
+HEAVY_MODULES = ["langchain_openai", "openai", "transformers", "torch", "sentence_transformers",
+                 "langchain_huggingface", "langchain_community", "langchain_text_splitters",
+                 "langchain.agents", "faiss", "bs4", "langchain_core", "ddgs", "aiohttp"]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run(code: str, heavy_modules=HEAVY_MODULES) -> dict:
+    """在全新的解释器中执行 code，返回其中已导入的重量级模块与 code 设置的 result"""
+    script = (f"import sys, json\n{code}\n"
+              f"heavy = [m for m in {list(heavy_modules)!r} if m in sys.modules]\n"
+              f"print(json.dumps({{'heavy': heavy, 'result': globals().get('result')}}))")
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=HERE, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_entry_points_do_not_import_heavy_dependencies():
+    # 结果存储命中的 main 不抓取网页、不构建检索器
+    assert _run("import main, similarity")["heavy"] == []
+    # aiohttp 是 HTTP 服务本身的框架，服务与批处理入口必然导入
+    server_heavy = [m for m in HEAVY_MODULES if m != "aiohttp"]
+    assert _run("import rag_server, batch_runner", server_heavy)["heavy"] == []
+
+
+def test_persisted_similarity_lookup_skips_faiss_and_splitter(tmp_path):
+    docs_dir, index_dir = str(tmp_path / "docs"), str(tmp_path / "index")
+    _write_corpus(docs_dir)
+    index = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=FakeEmbeddings())
+    sim_calc = KnowledgeBoundaryAwareSimilarity(docs_dir, index=index)
+    a, b = sim_calc.list_documents()[:2]
+    expected = sim_calc.compute_max_similarity(a, b)
+
+    out = _run(f"from corpus_index import CorpusIndex\n"
+               f"from similarity import KnowledgeBoundaryAwareSimilarity\n"
+               f"index = CorpusIndex({docs_dir!r}, index_dir={index_dir!r})\n"
+               f"result = KnowledgeBoundaryAwareSimilarity({docs_dir!r}, index=index)"
+               f".compute_max_similarity({a!r}, {b!r})")
+    assert out["heavy"] == []
+    assert abs(out["result"] - expected) < 1e-6
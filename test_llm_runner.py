@@ -0,0 +1,106 @@
+# test_llm_runner.py
+
+import time
+import asyncio
+from types import SimpleNamespace
+
+from html_extract import MAX_CHARS
+from http_cache import PageCache
+from llm_runner import ConcurrentLLMRunner
+from near_dup import NearDuplicateIndex
+from agent import WebResearchAgent, parse_title_summary
+
+
+class FakeChatModel:
+    """离线 LLM 替身：可配置延迟，前 fail_times 次调用抛出限流错误"""
+
+    def __init__(self, latency: float = 0.0, reply: str = '{"title": "故宫", "summary": "明清皇宫"}',
+                 fail_times: int = 0):
+        self.latency = latency
+        self.reply = reply
+        self.fail_times = fail_times
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def ainvoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise RateLimitError()
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        return SimpleNamespace(content=self.reply)
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def research_agent(monkeypatch, tmp_path, pages, llm, **kwargs) -> WebResearchAgent:
+    """离线的研究 Agent：搜索结果为 pages 的 URL，网页内容预先放进网页缓存（不发网络请求）"""
+    cache = PageCache(str(tmp_path / "pages.db"))
+    for url, content in pages:
+        cache.put(url, content.encode("utf-8"), content, MAX_CHARS)
+
+    class FakeDDGS:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def text(self, query, max_results=20):
+            for url, content in pages:
+                yield {"title": content[:10], "link": url, "body": content[:50]}
+
+    monkeypatch.setattr("ddgs.DDGS", FakeDDGS)
+    research = WebResearchAgent(api_key="test", model_name="fake", base_url="http://127.0.0.1:1",
+                                page_cache=cache, **kwargs)
+    research.llm_runner = ConcurrentLLMRunner(llm, max_concurrency=10)
+    return research
+
+
+def test_runner_bounded_concurrency():
+    llm = FakeChatModel(latency=0.2)
+    runner = ConcurrentLLMRunner(llm, max_concurrency=5)
+    start = time.perf_counter()
+    results = runner.map([[{"role": "user", "content": str(i)}] for i in range(10)])
+    elapsed = time.perf_counter() - start
+    assert len(results) == 10 and all(r.content for r in results)
+    assert llm.max_active == 5
+    assert elapsed < 1.0  # 串行需要 2s
+
+
+def test_runner_retries_rate_limit_and_times_out():
+    llm = FakeChatModel(fail_times=2)
+    runner = ConcurrentLLMRunner(llm, max_retries=3, backoff=0.01)
+    assert runner.map([[{"role": "user", "content": "hi"}]])[0].content
+    assert llm.calls == 3
+
+    slow = ConcurrentLLMRunner(FakeChatModel(latency=1.0), timeout=0.05, max_retries=1, backoff=0.01)
+    result = slow.map([[{"role": "user", "content": "hi"}]])[0]
+    assert isinstance(result, asyncio.TimeoutError)
+
+
+def test_research_single_call_per_document(monkeypatch, tmp_path):
+    # 每份网页内容各不相同（避免被当作近重复页面）
+    pages = [(f"http://site{i}.example/", f"故宫博物院第{i}篇：" + "".join(chr(0x4E00 + i * 97 + j) for j in range(300)))
+             for i in range(10)]
+    llm = FakeChatModel(latency=0.1)
+    research = research_agent(monkeypatch, tmp_path, pages, llm,
+                              dedup_index=NearDuplicateIndex(str(tmp_path / "dup.db")))
+    start = time.perf_counter()
+    saved = research.research_and_save("故宫博物院", str(tmp_path / "docs"), max_docs=10)
+    assert len(saved) == 10 and llm.calls == 10
+    assert llm.max_active > 1 and time.perf_counter() - start < 1.0  # 串行需要 1s
+    assert all(open(p, encoding="utf-8").read().startswith("标题：故宫\n") for p in saved)
+
+
+def test_parse_title_summary_fallbacks():
+    assert parse_title_summary('```json\n{"title": "西湖", "summary": "十景"}\n```') == ("西湖", "十景")
+    assert parse_title_summary("不是 JSON") == (None, None)
+    assert parse_title_summary('{"title": "西湖"}') == ("西湖", None)
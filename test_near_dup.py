@@ -0,0 +1,50 @@
+# test_near_dup.py
+
+import os
+from near_dup import NearDuplicateIndex
+from test_llm_runner import FakeChatModel, research_agent
+
+
+ARTICLE = ("故宫又称紫禁城，是中国明清两代的皇家宫殿，位于北京中轴线的中心。"
+           "故宫以三大殿为中心，占地面积约七十二万平方米，建筑面积约十五万平方米，"
+           "有大小宫殿七十多座，房屋九千余间，是世界上现存规模最大、保存最为完整的木质结构古建筑之一。") * 3
+MIRROR = "【转载】" + ARTICLE.replace("世界上", "全世界") + "（来源：某某网）"
+OTHER = ("西湖位于浙江省杭州市西湖区龙井路，是中国大陆首批国家重点风景名胜区和中国十大风景名胜之一。"
+         "西湖三面环山，面积约六点三九平方千米，湖中被孤山、白堤、苏堤、杨公堤分隔。") * 3
+
+
+def test_minhash_detects_mirrors_and_persists(tmp_path):
+    path = str(tmp_path / "dup.db")
+    index = NearDuplicateIndex(path)
+    sig, mirror, other = index.signature(ARTICLE), index.signature(MIRROR), index.signature(OTHER)
+    assert index.similarity(sig, mirror) >= 0.8
+    assert index.similarity(sig, other) < 0.2
+
+    saved = tmp_path / "web_a.txt"
+    saved.write_text(ARTICLE, encoding="utf-8")
+    index.add("a", sig, path=str(saved), url="http://a.example/")
+    assert index.find(mirror)["url"] == "http://a.example/"
+    assert index.find(other) is None
+    index.close()
+
+    reopened = NearDuplicateIndex(path)
+    assert reopened.find(mirror)["key"] == "a"
+    # 已收录的文件被删除后不再视为重复，条目随之清理
+    os.remove(saved)
+    assert reopened.find(mirror) is None and len(reopened) == 0
+
+
+def test_agent_drops_duplicates_before_llm_and_names_by_content(monkeypatch, tmp_path):
+    llm = FakeChatModel()
+    pages = [("http://a.example/", ARTICLE), ("http://mirror.example/", MIRROR), ("http://b.example/", OTHER)]
+    agent = research_agent(monkeypatch, tmp_path, pages, llm,
+                           dedup_index=NearDuplicateIndex(str(tmp_path / "dup.db")))
+    out = str(tmp_path / "docs")
+    first = agent.research_and_save("故宫", out, max_docs=10)
+    assert llm.calls == 2
+    assert len(first) == 2 and all(os.path.basename(p).startswith("web_") for p in first)
+
+    # 再次运行：内容已收录，不再调用 LLM，也不会写出新文件
+    second = agent.research_and_save("故宫", out, max_docs=10)
+    assert second == [] and llm.calls == 2
+    assert sorted(os.listdir(out)) == sorted(os.path.basename(p) for p in first)
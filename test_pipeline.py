@@ -0,0 +1,55 @@
+# test_pipeline.py
+
+import time
+import asyncio
+import pytest
+from pipeline import Pipeline
+
+
+def _sleep(seconds, value=None):
+    def fn(*args):
+        time.sleep(seconds)
+        return value if value is not None else args
+    return fn
+
+
+def test_independent_stages_overlap_and_results_flow():
+    async def doubled(x):
+        await asyncio.sleep(0.01)
+        return x * 2
+
+    pipeline = (Pipeline()
+                .add("baseline", _sleep(0.2, "baseline"))
+                .add("research", _sleep(0.1, 1))
+                .add("load_index", _sleep(0.1, 2))
+                .add("refresh", lambda a, b: a + b, deps=["research", "load_index"])
+                .add("hyde", doubled, deps=["refresh"]))
+    results = pipeline.run()
+
+    assert results == {"baseline": "baseline", "research": 1, "load_index": 2, "refresh": 3, "hyde": 6}
+    total = sum(t["duration"] for t in pipeline.timings.values())
+    assert pipeline.wall_time < total - 0.1
+    assert pipeline.timings["refresh"]["start"] >= pipeline.timings["research"]["end"]
+    assert pipeline.critical_path() == ["baseline"]
+    assert "关键路径: baseline" in pipeline.report()
+
+
+def test_failure_skips_dependents_but_finishes_others():
+    def boom():
+        raise RuntimeError("索引损坏")
+
+    pipeline = (Pipeline()
+                .add("baseline", _sleep(0.05, "ok"))
+                .add("load_index", boom)
+                .add("hyde", _sleep(0), deps=["load_index"])
+                .add("rag", _sleep(0), deps=["hyde"]))
+    with pytest.raises(RuntimeError, match="索引损坏"):
+        pipeline.run()
+    assert pipeline.timings["baseline"]["status"] == "ok"
+    assert pipeline.timings["load_index"]["status"] == "failed"
+    assert pipeline.timings["hyde"]["status"] == pipeline.timings["rag"]["status"] == "skipped"
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError):
+        Pipeline().add("rag", _sleep(0), deps=["select"])
@@ -0,0 +1,170 @@
+# test_rag_server.py
+
+import time
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from corpus_index import CorpusIndex
+from rag_server import RAGService, RetrievalBatcher, create_app
+from result_store import ResultStore
+from test_corpus_index import FakeEmbeddings, _write_corpus
+
+
+def _stub_llm_app(calls):
+    """OpenAI 兼容的桩 LLM 接口：记录请求并返回固定回答"""
+
+    async def completions(request):
+        body = await request.json()
+        calls.append(body)
+        await asyncio.sleep(0.02)
+        return web.json_response({
+            "id": f"stub-{len(calls)}", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": f"桩回答 {len(calls)}"}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    return app
+
+
+def test_server_answers_with_stub_llm_and_batches_retrieval(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    _write_corpus(docs_dir)
+    calls = []
+
+    async def scenario():
+        async with TestServer(_stub_llm_app(calls)) as llm_server:
+            service = RAGService(api_key="test", model_name="stub", base_url=str(llm_server.make_url("/v1")),
+                                 docs_dir=docs_dir, index_dir=str(tmp_path / "index"),
+                                 embeddings=FakeEmbeddings(), workers=4, max_wait_ms=20)
+            async with TestClient(TestServer(create_app(service))) as client:
+                health = await (await client.get("/health")).json()
+                assert health["status"] == "ok" and health["chunks"] == 3
+
+                queries = [f"介绍一下故宫 {i}" for i in range(8)]
+                responses = await asyncio.gather(*(
+                    client.post("/query", json={"query": q, "image_url": "http://example.com/a.png"})
+                    for q in queries))
+                bodies = [await r.json() for r in responses]
+                assert all(r.status == 200 for r in responses)
+                assert all(b["answer"].startswith("桩回答") and b["sources"] for b in bodies)
+                assert all(b["context"]["context_tokens"] <= b["context"]["budget_tokens"] for b in bodies)
+
+                bad = await client.post("/query", json={"text": "缺字段"})
+                assert bad.status == 400
+                for k in ("abc", 0, -1, 2.5, "1.5", "²", None, True, [3]):
+                    bad = await client.post("/query", json={"query": "故宫", "k": k})
+                    assert bad.status == 400, k
+
+                return await (await client.get("/metrics")).json()
+
+    metrics = asyncio.run(scenario())
+    # 每个查询两次 LLM 调用（HyDE + 最终回答），图片只随最终回答发送
+    assert len(calls) == 16
+    assert sum("image_url" in str(c["messages"]) for c in calls) == 8
+    assert metrics["requests"] == 8 and metrics["failed"] == 0 and metrics["in_flight"] == 0
+    assert metrics["retrieval_queries"] == 16
+    assert metrics["avg_batch_size"] > 1
+
+
+def test_prometheus_metrics_and_single_query_profile(tmp_path):
+    import tracing
+
+    docs_dir = str(tmp_path / "docs")
+    _write_corpus(docs_dir)
+    calls = []
+    trace_path = tmp_path / "trace.jsonl"
+    tracing.configure(str(trace_path))
+
+    async def scenario():
+        async with TestServer(_stub_llm_app(calls)) as llm_server:
+            service = RAGService(api_key="test", model_name="stub", base_url=str(llm_server.make_url("/v1")),
+                                 docs_dir=docs_dir, index_dir=str(tmp_path / "index"),
+                                 embeddings=FakeEmbeddings(), profile_dir=str(tmp_path / "profiles"))
+            async with TestClient(TestServer(create_app(service))) as client:
+                body = await (await client.post("/query", json={"query": "介绍一下故宫", "profile": True})).json()
+                response = await client.get("/metrics", params={"format": "prometheus"})
+                return body, response.content_type, await response.text()
+
+    try:
+        body, content_type, text = asyncio.run(scenario())
+    finally:
+        tracing.disable()
+        tracing.reset()
+
+    assert content_type == "text/plain"
+    assert "rag_requests_total 1" in text
+    assert 'rag_span_seconds_count{span="llm_invoke"} 2' in text
+    assert 'rag_span_seconds_count{span="vector_search"}' in text
+    assert 'rag_llm_tokens_total{kind="prompt"} 2' in text
+    with open(body["profile"], encoding="utf-8") as f:
+        assert f.read().strip()
+    names = {line.split('"name": "')[1].split('"')[0] for line in trace_path.read_text(encoding="utf-8").splitlines()}
+    assert {"query", "llm_invoke", "vector_search"} <= names
+
+
+def test_batched_retrieval_does_not_depend_on_other_requests(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    _write_corpus(docs_dir)
+    corpus = CorpusIndex(docs_dir, index_dir=str(tmp_path / "index"), embeddings=FakeEmbeddings())
+    ks = []
+    hybrid_search = corpus.hybrid_search
+
+    def spy(texts, vectors, k, **kwargs):
+        ks.append((len(texts), k))
+        return hybrid_search(texts, vectors, k, **kwargs)
+
+    corpus.hybrid_search = spy
+    batcher = RetrievalBatcher(corpus, max_wait_ms=50)
+
+    async def scenario():
+        alone = await batcher.search("西湖十景", 1)
+        batched = await asyncio.gather(batcher.search("西湖十景", 1), batcher.search("故宫", 3),
+                                       batcher.search("北京故宫", 1))
+        await batcher.close()
+        return alone, batched
+
+    alone, batched = asyncio.run(scenario())
+    # 同一批按 k 分组检索：k=1 的两个查询一组，k=3 的一组
+    assert ks == [(1, 1), (2, 1), (1, 3)]
+    assert batcher.stats["batches"] == 2
+    assert [d.page_content for d in batched[0][1]] == [d.page_content for d in alone[1]]
+    assert len(batched[1][1]) == 3
+
+
+def test_result_store_reads_do_not_block_the_event_loop(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    _write_corpus(docs_dir)
+
+    class SlowStore(ResultStore):
+        def lookup(self, *args, **kwargs):
+            time.sleep(0.2)
+            return super().lookup(*args, **kwargs)
+
+    store = SlowStore(str(tmp_path / "results.db"))
+    service = RAGService(api_key="test", model_name="stub", base_url="http://127.0.0.1:1", docs_dir=docs_dir,
+                         index_dir=str(tmp_path / "index"), embeddings=FakeEmbeddings(), llm=object(),
+                         result_store=store)
+    store.record("rag", "stub", "故宫", "已有回答", corpus_version=service.corpus_version)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    async def scenario():
+        task = asyncio.ensure_future(ticker())
+        results = await asyncio.gather(*(service.cached_answer("故宫") for _ in range(3)))
+        task.cancel()
+        await service.close()
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(r["answer"] == "已有回答" and r["cached"] for r in results)
+    # 查找在线程中执行：等待期间事件循环照常调度其他协程
+    assert ticks >= 10
@@ -0,0 +1,60 @@
+# test_result_store.py
+
+import sqlite3
+
+import numpy as np
+
+from batch_runner import BatchRunner
+from result_store import ResultStore
+from test_batch_runner import FakeChatModel, _service, _write_jsonl
+
+
+def test_record_lookup_and_history_are_append_only(tmp_path):
+    path = str(tmp_path / "results.db")
+    store = ResultStore(path, batch_size=3, flush_interval=3600)
+    store.record("rag", "m", "故宫的历史", "旧回答", image_url="a.png", corpus_version="v1",
+                 sources=["gugong.txt"], scores=np.array([0.9], dtype=np.float32), timings={"rag": 0.5})
+    # 缓冲中的记录也能查到；规范化后相同的查询共用一个键
+    assert store.lookup("rag", "m", "故宫的历史？", "a.png", "v1")["answer"] == "旧回答"
+    assert store.stats["commits"] == 0
+
+    store.record("rag", "m", "故宫的历史", "新回答", image_url="a.png", corpus_version="v1", timings={"rag": 1.5})
+    store.record("baseline", "m", "故宫的历史", "基线", image_url="a.png", timings={"llm": 0.2})
+    assert store.stats["commits"] == 1 and store.stats["written"] == 3
+
+    # 语料版本、图片或模型不同都不命中
+    assert store.lookup("rag", "m", "故宫的历史", "a.png", "v2") is None
+    assert store.lookup("rag", "m", "故宫的历史", None, "v1") is None
+    assert store.lookup("rag", "other", "故宫的历史", "a.png", "v1") is None
+    store.close()
+
+    reopened = ResultStore(path)
+    record = reopened.lookup("rag", "m", "故宫的历史", "a.png", "v1")
+    assert record["answer"] == "新回答" and record["timings"] == {"rag": 1.5}
+    assert [r["answer"] for r in reopened.history(stage="rag")] == ["新回答", "旧回答"]
+    assert reopened.history(stage="rag")[1]["scores"] == [0.8999999761581421]
+    assert reopened.timing_summary(stage="rag")["rag/m.rag"]["count"] == 2
+    assert len(reopened) == 3
+    reopened.close()
+    assert sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_batch_rerun_is_served_from_result_store(tmp_path):
+    queries = tmp_path / "queries.jsonl"
+    _write_jsonl(queries, [{"id": "a", "query": "故宫的历史", "image_url": "http://example.com/1.png"},
+                           {"id": "b", "query": "西湖十景"}])
+    db = str(tmp_path / "results.db")
+
+    llm = FakeChatModel()
+    service = _service(tmp_path, llm, result_store=ResultStore(db))
+    first = BatchRunner(service, workers=2, baseline=True).run(str(queries), str(tmp_path / "out1.jsonl"))
+    assert first["result_cached"] == 0 and llm.rag_calls == 2
+    service.result_store.close()
+
+    # 新的输出文件、重新打开的存储：回答与 Baseline 全部取自存储，不再调用 LLM
+    llm = FakeChatModel()
+    service = _service(tmp_path, llm, result_store=ResultStore(db))
+    second = BatchRunner(service, workers=2, baseline=True).run(str(queries), str(tmp_path / "out2.jsonl"))
+    assert second["done"] == 2 and second["result_cached"] == 4
+    assert llm.rag_calls == 0 and llm.hyde_calls == 0
+    assert service.snapshot()["result_cache_hits"] == 2
@@ -0,0 +1,229 @@
+# test_scraper.py
+
+import time
+import sqlite3
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from http_cache import PageCache
+from scraper import ConcurrentScraper
+
+
+PAGE = "<html><head><style>p {{}}</style><script>var x = 1;</script></head><body><p>{}</p></body></html>"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """本地替身服务器：/page/<名字> 正常返回，/slow 延迟返回，/fail 返回 500"""
+    active = 0
+    max_active = 0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.requests += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            if self.path.startswith("/etag") and self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            if self.path.startswith("/fail"):
+                self.send_response(500)
+                self.end_headers()
+                return
+            if self.path.startswith("/slow"):
+                time.sleep(3)
+            elif self.path.startswith("/busy"):
+                time.sleep(0.2)
+            body = PAGE.format(f"故宫博物院 {self.path}").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if self.path.startswith("/etag"):
+                self.send_header("ETag", '"v1"')
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 被取消的慢请求会在写回时断开连接，忽略即可
+        pass
+
+
+@pytest.fixture
+def server():
+    # 每个测试单独的处理器类，避免上一个测试残留的慢请求影响并发计数
+    handler = type("Handler", (_Handler,), {"active": 0, "max_active": 0, "requests": 0,
+                                            "lock": threading.Lock()})
+    httpd = _Server(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield SimpleNamespace(url=f"http://127.0.0.1:{httpd.server_address[1]}", handler=handler)
+    httpd.shutdown()
+
+
+def _scraper(**kwargs):
+    return ConcurrentScraper(executor=ThreadPoolExecutor(max_workers=2), **kwargs)
+
+
+def test_scrape_skips_failures_and_keeps_order(server):
+    server = server.url
+    with _scraper() as scraper:
+        pages = scraper.scrape([f"{server}/page/a", f"{server}/fail", f"{server}/page/b"])
+    assert [p["url"] for p in pages] == [f"{server}/page/a", f"{server}/page/b"]
+    assert pages[0]["content"] == "故宫博物院 /page/a"
+
+
+def test_scrape_streaming_mode(server):
+    with _scraper(streaming=True) as scraper:
+        pages = scraper.scrape([f"{server.url}/page/a", f"{server.url}/fail"])
+    assert pages == [{"url": f"{server.url}/page/a", "content": "故宫博物院 /page/a"}]
+
+
+def test_scrape_deadline_and_early_cancel(server):
+    server = server.url
+    with _scraper(deadline=1) as scraper:
+        start = time.perf_counter()
+        pages = scraper.scrape([f"{server}/slow", f"{server}/page/a"])
+        assert time.perf_counter() - start < 2.5
+    assert [p["url"] for p in pages] == [f"{server}/page/a"]
+
+    with _scraper(deadline=10) as scraper:
+        start = time.perf_counter()
+        urls = [f"{server}/page/a", f"{server}/slow/1", f"{server}/page/b", f"{server}/slow/2"]
+        pages = scraper.scrape(urls, target=2)
+        assert time.perf_counter() - start < 2.5
+    assert len(pages) == 2
+
+
+def test_scrape_per_host_limit(server):
+    with _scraper(max_concurrency=8, per_host_limit=2) as scraper:
+        pages = scraper.scrape([f"{server.url}/busy/{i}" for i in range(6)])
+    assert len(pages) == 6
+    assert server.handler.max_active <= 2
+
+
+def test_scrape_parses_in_process_pool(server):
+    with ConcurrentScraper(parse_workers=1) as scraper:
+        pages = scraper.scrape([f"{server.url}/page/a"])
+    assert pages[0]["content"] == "故宫博物院 /page/a"
+
+
+def test_page_cache_hit_and_conditional_revalidation(server, tmp_path):
+    url = f"{server.url}/etag/a"
+    cache = PageCache(str(tmp_path / "pages.db"))
+    with _scraper(cache=cache) as scraper:
+        first = scraper.scrape([url])
+        second = scraper.scrape([url])
+    assert first == second
+    assert server.handler.requests == 1
+    assert cache.stats["misses"] == 1 and cache.stats["hits"] == 1
+    assert cache.stats["bytes_saved"] > 0
+
+    # TTL 过期：带 If-None-Match 重新校验，304 时复用缓存
+    cache.ttl = 0
+    with _scraper(cache=cache) as scraper:
+        assert scraper.scrape([url]) == first
+    assert server.handler.requests == 2
+    assert cache.stats["revalidated"] == 1
+
+
+def test_truncated_streaming_cache_is_not_reused_for_larger_budget(server, tmp_path):
+    url = f"{server.url}/page/long"
+    cache = PageCache(str(tmp_path / "pages.db"))
+    # 小块读取 + 很小的字符预算：读到预算即停止，缓存中的原始字节不完整
+    with _scraper(cache=cache, streaming=True, max_chars=3, chunk_size=16) as scraper:
+        short = scraper.scrape([url])[0]["content"]
+    assert short == "故宫博..."
+    with _scraper(cache=cache, streaming=True, max_chars=2, chunk_size=16) as scraper:
+        assert scraper.scrape([url])[0]["content"] == "故宫..."
+    assert server.handler.requests == 1
+
+    # 预算变大：截断的缓存不能给出完整正文，重新下载
+    with _scraper(cache=cache, streaming=True, chunk_size=16) as scraper:
+        assert scraper.scrape([url])[0]["content"] == "故宫博物院 /page/long"
+    assert server.handler.requests == 2
+
+
+def test_page_cache_lru_eviction(tmp_path):
+    cache = PageCache(str(tmp_path / "pages.db"), max_bytes=250)
+    cache.put("http://a", b"a" * 100, "a", 5000)
+    cache.put("http://b", b"b" * 100, "b", 5000)
+    time.sleep(0.01)
+    cache.lookup("http://a")
+    cache.put("http://c", b"c" * 100, "c", 5000)
+    assert cache.lookup("http://b") is None
+    assert cache.lookup("http://a") is not None and cache.lookup("http://c") is not None
+    assert cache.stats["evicted"] == 1
+
+
+def test_page_cache_tracks_total_size_without_scanning(tmp_path):
+    path = str(tmp_path / "pages.db")
+    cache = PageCache(path, max_bytes=250)
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    cache.put("http://a", b"a" * 100, "a", 5000)
+    cache.put("http://a", b"a" * 50, "a", 5000)
+    cache.put("http://b", b"b" * 100, "b", 5000)
+    assert cache.total_bytes() == 152
+    cache.put("http://c", b"c" * 100, "c", 5000)
+    assert cache.stats["evicted"] == 1 and cache.total_bytes() == 202
+    assert not any("SUM(" in s for s in statements)
+    cache.close()
+
+    # 总字节数持久化；旧版本没有计数行的缓存文件打开时补算一次
+    assert PageCache(path, max_bytes=250).total_bytes() == 202
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE pages_total")
+    assert PageCache(path, max_bytes=250).total_bytes() == 202
+
+
+def test_agent_streams_search_fetch_and_stops_at_max_docs(server, tmp_path, monkeypatch):
+    import agent as agent_module
+    from llm_runner import ConcurrentLLMRunner
+    from near_dup import NearDuplicateIndex
+    from test_llm_runner import FakeChatModel
+
+    results = [{"title": "故宫博物院", "link": f"{server.url}/page/{name}", "body": "故宫博物院的历史"}
+               for name in ("alpha", "beta", "gamma")]
+    results.append({"title": "无关网页", "link": f"{server.url}/slow/x", "body": "天气预报"})
+
+    class FakeDDGS:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def text(self, query, max_results=20):
+            yield from results
+
+    monkeypatch.setattr("ddgs.DDGS", FakeDDGS)
+    research = agent_module.WebResearchAgent(api_key="test", model_name="fake", base_url="http://127.0.0.1:1",
+                                             max_concurrency=2,
+                                             page_cache=PageCache(str(tmp_path / "pages.db")),
+                                             dedup_index=NearDuplicateIndex(str(tmp_path / "dup.db")))
+    llm = FakeChatModel(latency=0.05)
+    research.llm_runner = ConcurrentLLMRunner(llm)
+
+    start = time.perf_counter()
+    saved = research.research_and_save("故宫博物院", str(tmp_path / "docs"), max_docs=2)
+    # 两份合格文档到手即停止：摘要预估不相关的慢网页排在队尾，即使已发起请求也会被取消
+    assert time.perf_counter() - start < 2.5
+    assert len(saved) == 2 and llm.calls == 2
+    assert all(open(p, encoding="utf-8").read().startswith("标题：故宫") for p in saved)
@@ -0,0 +1,140 @@
+# test_selection.py
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from corpus_index import CorpusIndex
+from selection import CandidateSelector, distances_to_relevance
+from similarity import KnowledgeBoundaryAwareSimilarity
+from test_corpus_index import FakeEmbeddings, _write_corpus
+
+
+def _old_select_documents(sim_calc, candidate_docs, top_k=3, threshold=0.95):
+    """main.py 原先的 SRT + MCT（KnowledgeBoundaryAwareSimilarity.select_documents），作为对照：
+    以首个候选为基准源保留与之最相似的 top_k 个源的候选，再剔除与已保留文档最大相似度达到 threshold 的候选"""
+    if not candidate_docs:
+        return []
+    base_src = candidate_docs[0].metadata["source"]
+    top_srcs = {src for src, _ in sim_calc.rank_similar_documents(base_src, top_k=top_k)}
+    srt_docs = [d for d in candidate_docs if d.metadata["source"] in top_srcs]
+
+    filtered = []
+    for doc in srt_docs:
+        src = doc.metadata["source"]
+        if all(sim_calc.compute_max_similarity(src, kept.metadata["source"]) < threshold
+               for kept in filtered):
+            filtered.append(doc)
+    return filtered
+
+
+def _old_and_new(sources, vectors, relevance, selector):
+    """候选集为语料中的全部切片（按相关度排序），分别用旧的 SRT+MCT 与 CandidateSelector 选择"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    index = SimpleNamespace(doc_texts=[f"切片{i}" for i in range(len(sources))], doc_sources=list(sources),
+                            vectors=vectors)
+    sim_calc = KnowledgeBoundaryAwareSimilarity("", index=index, persist_matrix=False)
+    order = np.argsort(-np.asarray(relevance), kind="stable")
+    docs = [Document(page_content=index.doc_texts[i], metadata={"source": sources[i]}) for i in order]
+    old = _old_select_documents(sim_calc, docs, top_k=selector.top_k, threshold=selector.threshold)
+    new = selector.select(docs, np.asarray(relevance)[order], vectors[order])
+    return old, new
+
+
+def test_default_selection_matches_old_srt_mct():
+    # 默认配置（top_k=3、threshold=0.95、mode="srt"）与旧实现完全一致；
+    # 来源数在 top_k 上下浮动，基准源过滤、SRT 截断与 MCT 去冗余都会生效
+    filtered = truncated = 0
+    rng = np.random.default_rng(0)
+    for trial in range(300):
+        n_src, dim = int(rng.integers(2, 8)), 8
+        sources = [f"doc{s}.txt" for s in range(n_src) for _ in range(int(rng.integers(1, 4)))]
+        base = rng.normal(size=(3, dim))
+        # 部分切片是其他切片的近似副本，保证阈值过滤确实生效
+        vectors = base[rng.integers(0, 3, size=len(sources))] + \
+            rng.normal(scale=rng.choice([0.01, 0.5]), size=(len(sources), dim))
+        relevance = rng.permutation(len(sources)).astype(np.float32) / len(sources)
+        old, new = _old_and_new(sources, vectors, relevance, CandidateSelector())
+        assert new == old, trial
+        filtered += len(new) < min(3, n_src - 1)
+        truncated += n_src - 1 > 3
+    assert filtered > 20 and truncated > 20
+
+
+def test_mmr_selection_differs_from_old_srt_mct_on_purpose():
+    # a 为首个命中；b 与 a 最相似，d 次之，c 与 a 无关但检索得分第二
+    d = np.array([0.3, 0.95, 0.0])
+    vectors = [[1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [1.0, 1.0, 0.0], d / np.linalg.norm(d)]
+    sources = ["a.txt", "c.txt", "b.txt", "d.txt"]
+    relevance = [0.9, 0.8, 0.7, 0.6]
+    old, srt = _old_and_new(sources, vectors, relevance, CandidateSelector(top_k=2))
+    # 旧实现与默认的 srt：去掉基准源本身，按与基准源的相似度保留 b、d
+    assert [doc.metadata["source"] for doc in old] == [doc.metadata["source"] for doc in srt] == ["b.txt", "d.txt"]
+    # mmr：按各候选自己的检索得分选择，首个命中保留
+    _, mmr = _old_and_new(sources, vectors, relevance, CandidateSelector(top_k=2, mode="mmr"))
+    assert [doc.metadata["source"] for doc in mmr] == ["a.txt", "c.txt"]
+
+
+def _reference_select(relevance, vectors, sources, top_k, threshold, lambda_mult):
+    """逐对计算的参考实现：先按得分挑选，再与已选结果逐一比较知识边界最大相似度"""
+    unit = [v / (np.linalg.norm(v) or 1.0) for v in np.asarray(vectors, dtype=np.float64)]
+
+    def source_sim(i, j):
+        if sources[i] == sources[j]:
+            return 1.0
+        return max(float(unit[a] @ unit[b])
+                   for a in range(len(unit)) if sources[a] == sources[i]
+                   for b in range(len(unit)) if sources[b] == sources[j])
+
+    selected, remaining = [], list(range(len(relevance)))
+    while remaining and len(selected) < top_k:
+        def score(i):
+            redundancy = max((source_sim(i, j) for j in selected), default=0.0)
+            return lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+        best = max(remaining, key=lambda i: (score(i), -i))
+        selected.append(best)
+        remaining = [i for i in remaining if i != best and source_sim(i, best) < threshold]
+    return selected
+
+
+@pytest.mark.parametrize("lambda_mult", [1.0, 0.7, 0.3])
+def test_vectorised_selection_matches_pairwise(lambda_mult):
+    rng = np.random.default_rng(0)
+    for trial in range(200):
+        k, dim = int(rng.integers(1, 12)), 8
+        base = rng.normal(size=(3, dim))
+        # 部分候选是其他候选的近似副本，保证阈值过滤确实生效
+        vectors = base[rng.integers(0, 3, size=k)] + rng.normal(scale=rng.choice([0.01, 0.5]), size=(k, dim))
+        sources = [f"doc{s}.txt" for s in rng.integers(0, 5, size=k)]
+        relevance = np.sort(rng.random(k).astype(np.float32))[::-1]
+        top_k, threshold = int(rng.integers(1, 5)), float(rng.choice([0.8, 0.95]))
+
+        selector = CandidateSelector(top_k=top_k, threshold=threshold, lambda_mult=lambda_mult, mode="mmr")
+        expected = _reference_select(relevance, vectors, sources, top_k, threshold, lambda_mult)
+        assert selector.select_indices(relevance, vectors, sources) == expected, trial
+
+
+def test_selection_on_retrieved_candidates(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    _write_corpus(docs_dir)
+    embeddings = FakeEmbeddings()
+    corpus = CorpusIndex(docs_dir, index_dir=str(tmp_path / "index"), embeddings=embeddings)
+    docs, distances, vectors = corpus.search([embeddings.embed_query("北京故宫")], 5)[0]
+    assert len(docs) == len(distances) == len(vectors) == 3
+    assert docs[0].metadata["source"].endswith("beijing.txt")
+    np.testing.assert_allclose(distances_to_relevance(distances)[0],
+                               np.dot(vectors[0], embeddings.embed_query("北京故宫")), rtol=1e-5)
+
+    # 同源的重复切片只保留相关度最高的一个
+    dup = Document(page_content="重复", metadata={"source": docs[0].metadata["source"]})
+    relevance = distances_to_relevance(distances)
+    candidates = (docs[:1] + [dup] + docs[1:], np.concatenate([relevance[:1], relevance]),
+                  np.vstack([vectors[:1], vectors]))
+    assert CandidateSelector(top_k=3, mode="mmr").select(*candidates) == docs
+    # 默认的 srt：基准源（首个命中）本身不保留
+    assert CandidateSelector(top_k=3).select(*candidates) == docs[1:]
+
+    with pytest.raises(ValueError):
+        CandidateSelector(mode="unknown")
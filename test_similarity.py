@@ -0,0 +1,82 @@
+# test_similarity.py
+
+from types import SimpleNamespace
+import numpy as np
+from similarity import KnowledgeBoundaryAwareSimilarity
+
+
+def _make_index(n_sources=7, seed=0):
+    rng = np.random.default_rng(seed)
+    sources, vectors = [], []
+    for s in range(n_sources):
+        for _ in range(rng.integers(1, 6)):
+            sources.append(f"rag_word/doc_{s}.txt")
+            vectors.append(rng.normal(size=16))
+    # 打乱顺序，确保不依赖切片按源连续排列
+    perm = rng.permutation(len(sources))
+    return SimpleNamespace(doc_texts=[str(i) for i in perm],
+                           doc_sources=[sources[i] for i in perm],
+                           vectors=np.asarray(vectors, dtype=np.float32)[perm])
+
+
+def _reference_max_similarity(index, src1, src2):
+    """原始实现：逐对构造数组并计算余弦相似度"""
+    vecs1 = np.array([index.vectors[i] for i, s in enumerate(index.doc_sources) if s == src1], dtype=np.float64)
+    vecs2 = np.array([index.vectors[i] for i, s in enumerate(index.doc_sources) if s == src2], dtype=np.float64)
+    norms = np.linalg.norm(vecs1, axis=1)[:, None] * np.linalg.norm(vecs2, axis=1)[None, :]
+    return float(np.max((vecs1 @ vecs2.T) / norms))
+
+
+def test_source_similarity_matches_pairwise_reference():
+    index = _make_index()
+    for block_size in (None, 1, 3, 1024):
+        sim_calc = KnowledgeBoundaryAwareSimilarity(docs_dir="", index=index, block_size=block_size)
+        for a in sim_calc.list_documents():
+            for b in sim_calc.list_documents():
+                assert abs(sim_calc.compute_max_similarity(a, b) - _reference_max_similarity(index, a, b)) < 1e-5
+
+
+def test_blocked_similarity_never_spans_all_chunks():
+    index = _make_index(n_sources=9, seed=2)
+    full = KnowledgeBoundaryAwareSimilarity(docs_dir="", index=index, block_size=None).source_similarity_matrix()
+    sim_calc = KnowledgeBoundaryAwareSimilarity(docs_dir="", index=index, block_size=4)
+    n = len(index.doc_sources)
+    assert n > 4
+    spans = []
+    inner_products = sim_calc.store.inner_products
+
+    def recording(queries, start=0, end=None):
+        out = inner_products(queries, start, end)
+        spans.append(out.shape)
+        return out
+
+    sim_calc.store.inner_products = recording
+    np.testing.assert_allclose(sim_calc.source_similarity_matrix(), full, atol=1e-6)
+    assert spans and all(rows <= 4 and cols <= 4 for rows, cols in spans)
+
+
+def test_rank_similar_documents_order():
+    index = _make_index()
+    sim_calc = KnowledgeBoundaryAwareSimilarity(docs_dir="", index=index, block_size=4)
+    target = "rag_word/doc_0.txt"
+    expected = sorted(((s, _reference_max_similarity(index, target, s))
+                       for s in sim_calc.list_documents() if s != target),
+                      key=lambda x: x[1], reverse=True)[:3]
+    ranked = sim_calc.rank_similar_documents(target, top_k=3)
+    assert [s for s, _ in ranked] == [s for s, _ in expected]
+    assert len(sim_calc.rank_similar_documents(target, top_k=100)) == len(sim_calc.list_documents()) - 1
+
+
+def test_ann_backend_matches_exact_on_small_corpus():
+    from ann_index import FaissANNBackend
+
+    index = _make_index(n_sources=12, seed=1)
+    exact = KnowledgeBoundaryAwareSimilarity(docs_dir="", index=index)
+    for kind in ("hnsw", "ivf"):
+        backend = FaissANNBackend(kind=kind, ef_search=256, nlist=1)
+        approx = KnowledgeBoundaryAwareSimilarity(docs_dir="", index=index, ann_backend=backend)
+        for target in exact.list_documents():
+            assert ([s for s, _ in approx.rank_similar_documents(target, top_k=3)]
+                    == [s for s, _ in exact.rank_similar_documents(target, top_k=3)])
+        a, b = exact.list_documents()[:2]
+        assert abs(approx.compute_max_similarity(a, b) - exact.compute_max_similarity(a, b)) < 1e-5
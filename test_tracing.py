@@ -0,0 +1,88 @@
+# test_tracing.py
+
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import tracing
+from pipeline import Pipeline
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracing.configure(str(path))
+    yield path
+    tracing.disable()
+    tracing.reset()
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_disabled_tracing_is_a_shared_noop():
+    assert not tracing.enabled()
+    assert tracing.span("vector_search", k=5) is tracing.NOOP_SPAN
+    with tracing.span("vector_search") as s:
+        s.set(hits=3)
+    tracing.count("llm_tokens_total", 10, kind="prompt")
+    assert tracing.prometheus_text() == ""
+
+
+def test_nested_spans_share_trace_and_record_errors(trace_file):
+    with tracing.span("query"):
+        with tracing.span("embed", chunks=2) as s:
+            s.set(dim=4)
+        with pytest.raises(ValueError):
+            with tracing.span("llm_invoke"):
+                raise ValueError("boom")
+
+    embed, llm, query = _records(trace_file)
+    assert embed["trace_id"] == llm["trace_id"] == query["trace_id"]
+    assert embed["parent_id"] == query["span_id"] and query["parent_id"] is None
+    assert embed["attrs"] == {"chunks": 2, "dim": 4}
+    assert llm["error"] == "ValueError: boom"
+
+
+def test_llm_tokens_and_prometheus_histograms(trace_file):
+    response = SimpleNamespace(usage_metadata={"input_tokens": 120, "output_tokens": 30})
+    for _ in range(2):
+        with tracing.span("llm_invoke") as s:
+            tracing.record_llm(s, response)
+    legacy = SimpleNamespace(response_metadata={"token_usage": {"prompt_tokens": 5, "completion_tokens": 1}})
+    assert tracing.token_usage(legacy) == (5, 1)
+
+    text = tracing.prometheus_text()
+    assert 'rag_span_seconds_bucket{span="llm_invoke",le="+Inf"} 2' in text
+    assert 'rag_span_seconds_count{span="llm_invoke"} 2' in text
+    assert 'rag_llm_tokens_total{kind="prompt"} 240' in text
+    assert 'rag_llm_tokens_total{kind="completion"} 60' in text
+    assert _records(trace_file)[0]["attrs"] == {"prompt_tokens": 120, "completion_tokens": 30}
+
+
+def test_pipeline_stage_spans_parent_thread_spans(trace_file):
+    def load():
+        with tracing.span("load_document"):
+            return 1
+
+    Pipeline().add("load", load).run()
+    child, stage = _records(trace_file)
+    assert stage["name"] == "stage.load"
+    assert child["parent_id"] == stage["span_id"]
+
+
+def test_sampling_profiler_collects_folded_stacks(tmp_path):
+    def busy_wait_for_profiler():
+        end = time.perf_counter() + 0.1
+        while time.perf_counter() < end:
+            pass
+
+    with tracing.SamplingProfiler(interval=0.002) as profiler:
+        busy_wait_for_profiler()
+    path = tmp_path / "profile.folded"
+    profiler.write(str(path))
+    assert profiler.samples > 0
+    assert "busy_wait_for_profiler" in path.read_text(encoding="utf-8")
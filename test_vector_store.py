@@ -0,0 +1,84 @@
+# test_vector_store.py
+
+import numpy as np
+import pytest
+from benchmark_vector_store import make_vectors, recall_at_k
+from corpus_index import CorpusIndex
+from similarity import KnowledgeBoundaryAwareSimilarity
+from test_corpus_index import FakeEmbeddings, _write_corpus
+from vector_store import VectorStore
+
+
+def _exact_l2(base, queries, k):
+    d = ((queries[:, None, :] - base[None, :, :]) ** 2).sum(-1)
+    ids = np.argsort(d, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(d, ids, 1), ids
+
+
+@pytest.mark.parametrize("kind,pq_m,min_recall", [("float32", None, 1.0), ("sq8", None, 0.9), ("pq", 16, 0.3)])
+def test_save_open_and_search(tmp_path, kind, pq_m, min_recall):
+    vectors = make_vectors(1200, dim=64, rank=16)
+    base, queries = vectors[:1000], vectors[1000:]
+    store = VectorStore.build(base, kind, pq_m=pq_m)
+    path = str(tmp_path / "vectors.bin")
+    store.save(path)
+    opened = VectorStore.open(path)
+
+    # 打开后的编码是文件上的只读 mmap 视图，解码结果与保存前一致
+    assert isinstance(opened.codes.base, np.memmap) or isinstance(opened.codes, np.memmap)
+    assert not opened.codes.flags.writeable
+    assert opened.kind == kind and len(opened) == 1000
+    assert np.allclose(opened.reconstruct([3, 7]), store.reconstruct([3, 7]))
+
+    distances, ids = opened.search(queries, 10)
+    exact_d, exact_ids = _exact_l2(base, queries, 10)
+    assert recall_at_k(exact_ids, ids) >= min_recall
+    assert np.all(np.diff(distances, axis=1) >= -1e-6)
+    if kind == "float32":
+        assert np.allclose(distances, exact_d, atol=1e-4)
+
+
+def test_sq8_memory_and_reconstruction_error():
+    vectors = make_vectors(500, dim=64, rank=16)
+    store = VectorStore.build(vectors, "sq8")
+    assert store.codes.dtype == np.uint8 and store.codes.nbytes * 4 == vectors.nbytes
+    assert np.abs(store.reconstruct() - vectors).max() < 0.01
+    ip = store.inner_products(vectors[:5])
+    assert np.allclose(ip, vectors[:5] @ store.reconstruct().T, atol=1e-4)
+
+
+def test_updated_keeps_existing_codes():
+    vectors = make_vectors(300, dim=32, rank=8)
+    store = VectorStore.build(vectors[:200], "sq8")
+    keep = np.ones(200, dtype=bool)
+    keep[:50] = False
+    updated = store.updated(keep, vectors[200:])
+    assert len(updated) == 250
+    assert np.array_equal(updated.codes[:150], store.codes[50:])
+    assert np.array_equal(updated.params["lo"], store.params["lo"])
+
+
+def test_corpus_index_with_sq8_store(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    index_dir = str(tmp_path / "index")
+    _write_corpus(docs_dir)
+
+    corpus = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=FakeEmbeddings(), vector_format="sq8")
+    assert corpus.vector_store.kind == "sq8" and len(corpus.vector_store) == len(corpus)
+    docs, distances, vectors = corpus.search([corpus.embeddings.embed_query("西湖十景")], k=1)[0]
+    assert docs[0].metadata["source"].endswith("hangzhou.txt")
+    assert vectors.shape == (1, 32)
+
+    # 重启后 mmap 读取同一个文件；相似度计算直接使用同一份存储
+    reloaded = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=FakeEmbeddings(), vector_format="sq8")
+    assert reloaded.vector_store.path == corpus.vector_store.path
+    calc = KnowledgeBoundaryAwareSimilarity(docs_dir, index=reloaded, persist_matrix=False)
+    assert calc.store is reloaded.vector_store
+    exact = KnowledgeBoundaryAwareSimilarity(
+        docs_dir, index=CorpusIndex(docs_dir, index_dir=str(tmp_path / "exact"), embeddings=FakeEmbeddings()),
+        persist_matrix=False)
+    assert np.allclose(calc.source_similarity_matrix(), exact.source_similarity_matrix(), atol=0.02)
+
+    # 换编码格式会触发重建
+    rebuilt = CorpusIndex(docs_dir, index_dir=index_dir, embeddings=FakeEmbeddings(), vector_format="float32")
+    assert rebuilt.vector_store.kind == "float32"
@@ -0,0 +1,279 @@
+# tracing.py
+
+import os
+import sys
+import json
+import time
+import random
+import bisect
+import threading
+import contextvars
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+
+# 耗时直方图的桶上界（秒）
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = False
+_sample_rate = 1.0
+_writer = None
+_lock = threading.Lock()
+_histograms: Dict[str, "Histogram"] = {}
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Histogram:
+    """固定桶的耗时直方图（桶内计数非累计，输出时再累加）"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _NoopSpan:
+    """关闭追踪时所有 span 共用的空对象"""
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "wall", "trace_id", "span_id", "parent_id", "sampled", "_token")
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """补充属性（如响应字节数、token 数）"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        parent = _current.get()
+        self.span_id = f"{random.getrandbits(64):016x}"
+        if parent is None:
+            self.trace_id, self.parent_id = f"{random.getrandbits(64):016x}", None
+            self.sampled = random.random() < _sample_rate
+        else:
+            self.trace_id, self.parent_id, self.sampled = parent.trace_id, parent.span_id, parent.sampled
+        self._token = _current.set(self)
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current.reset(self._token)
+        with _lock:
+            histogram = _histograms.get(self.name)
+            if histogram is None:
+                histogram = _histograms[self.name] = Histogram()
+            histogram.observe(duration)
+            if self.sampled and _writer is not None:
+                record = {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                          "name": self.name, "start": self.wall, "duration_ms": duration * 1000,
+                          "thread": threading.current_thread().name, "attrs": self.attrs}
+                if exc_type is not None:
+                    record["error"] = f"{exc_type.__name__}: {exc}"
+                _writer.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                _writer.flush()
+        return False
+
+
+# ---------- 开关 ----------
+
+def configure(trace_path: Optional[str] = None, sample_rate: float = 1.0):
+    """开启追踪。trace_path 为 JSONL 追踪文件（追加写入）；
+    sample_rate 按根 span 采样写入追踪文件的比例，直方图与计数器始终全量统计"""
+    global _enabled, _sample_rate, _writer
+    with _lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+        if trace_path:
+            if os.path.dirname(trace_path):
+                os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+            _writer = open(trace_path, "a", encoding="utf-8")
+        _sample_rate = sample_rate
+        _enabled = True
+
+
+def disable():
+    global _enabled, _writer
+    with _lock:
+        _enabled = False
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """清空已统计的直方图与计数器"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+# ---------- 埋点 ----------
+
+def span(name: str, **attrs):
+    """with tracing.span("vector_search", k=5): ...；关闭时返回共享的空对象，几乎没有开销"""
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, attrs)
+
+
+def current_span():
+    return (_current.get() or NOOP_SPAN) if _enabled else NOOP_SPAN
+
+
+def count(name: str, value: float = 1, **labels):
+    """累加计数器，如 count("llm_tokens_total", 120, kind="prompt")"""
+    if not _enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def token_usage(response) -> Tuple[Optional[int], Optional[int]]:
+    """从 LangChain 的 AIMessage 读取 (输入 token 数, 输出 token 数)，接口未返回时为 None"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+
+def record_llm(s, response):
+    """把一次 LLM 调用的 token 数记到 span 属性与计数器上"""
+    if not _enabled:
+        return
+    prompt, completion = token_usage(response)
+    if prompt is not None:
+        s.set(prompt_tokens=prompt)
+        count("llm_tokens_total", prompt, kind="prompt")
+    if completion is not None:
+        s.set(completion_tokens=completion)
+        count("llm_tokens_total", completion, kind="completion")
+
+
+# ---------- 导出 ----------
+
+def _labels(pairs) -> str:
+    return ",".join(f'{k}="{str(v)}"' for k, v in pairs)
+
+
+def prometheus_text(prefix: str = "rag") -> str:
+    """Prometheus 文本格式：各 span 的耗时直方图 + 计数器"""
+    lines = []
+    with _lock:
+        if _histograms:
+            lines.append(f"# TYPE {prefix}_span_seconds histogram")
+        for name in sorted(_histograms):
+            h = _histograms[name]
+            cumulative = 0
+            for bound, n in zip(h.buckets, h.counts):
+                cumulative += n
+                lines.append(f'{prefix}_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_span_seconds_bucket{{span="{name}",le="+Inf"}} {h.count}')
+            lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {h.sum:.6f}')
+            lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {h.count}')
+        declared = set()
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in declared:
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                declared.add(name)
+            suffix = f"{{{_labels(labels)}}}" if labels else ""
+            lines.append(f"{prefix}_{name}{suffix} {value:g}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def write_prometheus(path: str, prefix: str = "rag"):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(prefix))
+
+
+# ---------- 采样剖析 ----------
+
+class SamplingProfiler:
+    """采样剖析器：后台线程每隔 interval 秒读取所有线程的调用栈，
+    按折叠栈（flamegraph.pl / speedscope 可直接读取）计数。只在需要时对单次查询开启"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SamplingProfiler":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for t in threading.enumerate():
+                names[t.ident] = t.name
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def write(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.folded())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
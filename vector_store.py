@@ -0,0 +1,261 @@
+# vector_store.py
+
+import os
+import json
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+MAGIC = b"RAGVEC01"
+KINDS = ("float32", "sq8", "pq")
+_ALIGN = 64
+_BLOCK = 65536
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """训练 k 个码字（只在训练乘积量化码本时导入 faiss）"""
+    import faiss
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    km = faiss.Kmeans(x.shape[1], k, niter=iters, seed=seed)
+    km.train(x)
+    return km.centroids.reshape(k, x.shape[1])
+
+
+class VectorStore:
+    """切片向量的紧凑存储，三种编码：
+
+    - float32：原始向量，每维 4 字节
+    - sq8：逐维标量量化到 uint8（每维 1 字节，4 倍压缩）
+    - pq：乘积量化，向量切成 m 段、每段 256 个码字（每个向量 m 字节）
+
+    整个存储是一个文件（头部 JSON + 对齐的码本与编码数组），打开时 mmap，
+    编码与码本都是文件上的零拷贝 NumPy 视图；相似度检索与相似度矩阵计算共用同一份文件，
+    内积按块解码计算，不在内存中展开完整的 float32 矩阵。
+    """
+
+    def __init__(self, kind: str, dim: int, codes: np.ndarray, params: Optional[Dict[str, np.ndarray]] = None,
+                 path: Optional[str] = None, trained_on: int = 0):
+        if kind not in KINDS:
+            raise ValueError(f"未知的向量编码: {kind}（可选 {', '.join(KINDS)}）")
+        self.kind = kind
+        self.dim = dim
+        self.codes = codes
+        self.params = params or {}
+        self.path = path
+        # 训练量化参数时用的向量数
+        self.trained_on = trained_on
+        self._sq_norms = None
+
+    # ---------- 训练与编码 ----------
+
+    @classmethod
+    def build(cls, vectors, kind: str = "float32", pq_m: Optional[int] = None, seed: int = 0,
+              max_train: int = 20000) -> "VectorStore":
+        """用 vectors 训练量化参数并编码（乘积量化的码本最多用 max_train 个随机样本训练）"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1] if vectors.ndim == 2 else 0
+        if kind == "sq8":
+            if len(vectors):
+                lo, hi = vectors.min(0), vectors.max(0)
+            else:
+                lo, hi = np.full(dim, -1.0, np.float32), np.full(dim, 1.0, np.float32)
+            # 两侧各留 5% 余量：之后增量加入的向量超出范围时截断
+            margin = (hi - lo) * 0.05
+            lo, hi = lo - margin, hi + margin
+            params = {"lo": lo.astype(np.float32),
+                      "scale": np.maximum((hi - lo) / 255.0, 1e-12).astype(np.float32)}
+        elif kind == "pq":
+            m = pq_m or max(dim // 8, 1)
+            if dim % m:
+                raise ValueError(f"维度 {dim} 不能被 pq_m={m} 整除")
+            if not len(vectors):
+                raise ValueError("乘积量化需要训练数据")
+            rng = np.random.default_rng(seed)
+            train = vectors[rng.choice(len(vectors), min(len(vectors), max_train), replace=False)]
+            k = min(256, len(train))
+            dsub = dim // m
+            params = {"centroids": np.stack([kmeans(train[:, j * dsub:(j + 1) * dsub], k, seed=seed + j)
+                                             for j in range(m)])}
+        else:
+            params = {}
+        store = cls(kind, dim, np.zeros((0, 0), np.uint8), params, trained_on=min(len(vectors), max_train))
+        store.codes = store.encode(vectors)
+        return store
+
+    @property
+    def code_width(self) -> int:
+        return self.params["centroids"].shape[0] if self.kind == "pq" else self.dim
+
+    def encode(self, vectors) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if self.kind == "float32":
+            return vectors
+        if self.kind == "sq8":
+            codes = np.rint((vectors - self.params["lo"]) / self.params["scale"])
+            return np.clip(codes, 0, 255).astype(np.uint8)
+        centroids = self.params["centroids"]
+        m, _, dsub = centroids.shape
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        c_sq = (centroids * centroids).sum(2)
+        for j in range(m):
+            sub = vectors[:, j * dsub:(j + 1) * dsub]
+            for s in range(0, len(sub), _BLOCK):
+                block = sub[s:s + _BLOCK]
+                codes[s:s + _BLOCK, j] = (c_sq[j][None, :] - 2 * block @ centroids[j].T).argmin(1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        if self.kind == "float32":
+            return np.asarray(codes, dtype=np.float32)
+        if self.kind == "sq8":
+            return codes.astype(np.float32) * self.params["scale"] + self.params["lo"]
+        centroids = self.params["centroids"]
+        m = centroids.shape[0]
+        return centroids[np.arange(m), np.asarray(codes, dtype=np.intp)].reshape(len(codes), self.dim)
+
+    def updated(self, keep: np.ndarray, new_vectors, max_train: int = 20000) -> "VectorStore":
+        """保留 keep 为真的行并在末尾追加新向量。沿用现有量化参数，已有编码不重新量化；
+        但参数若是在远少于现有数据量的样本上训练的（语料从几篇文档逐步增长），
+        就用解码后的旧向量与新向量重新训练"""
+        new_vectors = np.asarray(new_vectors, dtype=np.float32).reshape(-1, self.dim)
+        kept = np.asarray(self.codes[keep]).reshape(-1, self.code_width)
+        if self.kind != "float32" and self.trained_on < min(len(kept) + len(new_vectors), max_train) / 2:
+            vectors = np.concatenate([self.decode(kept), new_vectors])
+            return VectorStore.build(vectors, self.kind, pq_m=self.code_width if self.kind == "pq" else None,
+                                     max_train=max_train)
+        codes = np.concatenate([kept, self.encode(new_vectors)])
+        return VectorStore(self.kind, self.dim, codes, self.params, trained_on=self.trained_on)
+
+    # ---------- 读取 ----------
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        """编码与码本占用的字节数"""
+        return int(self.codes.nbytes + sum(p.nbytes for p in self.params.values()))
+
+    def reconstruct(self, ids: Optional[Sequence[int]] = None) -> np.ndarray:
+        """解码为 float32；float32 编码且不指定 ids 时直接返回文件上的视图"""
+        if ids is None:
+            return self.decode(self.codes)
+        ids = np.asarray(ids, dtype=np.int64)
+        return self.decode(self.codes[ids]) if ids.size else np.zeros((0, self.dim), np.float32)
+
+    def squared_norms(self) -> np.ndarray:
+        """解码后向量的平方范数（分块计算后缓存）"""
+        if self._sq_norms is None:
+            norms = np.empty(len(self), dtype=np.float32)
+            for s in range(0, len(self), _BLOCK):
+                block = self.decode(self.codes[s:s + _BLOCK])
+                norms[s:s + len(block)] = (block * block).sum(1)
+            self._sq_norms = norms
+        return self._sq_norms
+
+    def inner_products(self, queries, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """queries 与第 start..end 行的内积 (查询数 × 行数)，直接在编码上按块计算，
+        不会把整段编码一次性解码成 float32"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        end = len(self) if end is None else min(end, len(self))
+        if end - start <= _BLOCK:
+            return self._inner_products(queries, self.codes[start:end])
+        out = np.empty((len(queries), end - start), dtype=np.float32)
+        for s in range(start, end, _BLOCK):
+            out[:, s - start:min(s + _BLOCK, end) - start] = self._inner_products(queries, self.codes[s:min(s + _BLOCK, end)])
+        return out
+
+    def _inner_products(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        if self.kind == "float32":
+            return queries @ codes.T
+        if self.kind == "sq8":
+            # q·(lo + scale⊙c) = q·lo + (q⊙scale)·c
+            return (queries * self.params["scale"]) @ codes.T.astype(np.float32) + (queries @ self.params["lo"])[:, None]
+        # 乘积量化：每段先算查询与 256 个码字的内积表，再按编码查表求和
+        centroids = self.params["centroids"]
+        m, _, dsub = centroids.shape
+        tables = np.einsum("qmd,mkd->qmk", queries.reshape(len(queries), m, dsub), centroids)
+        scores = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for j in range(m):
+            scores += tables[:, j, :][:, codes[:, j]]
+        return scores
+
+    def search(self, queries, k: int, metric: str = "l2") -> Tuple[np.ndarray, np.ndarray]:
+        """精确的暴力检索（按块扫描）。metric="l2" 返回升序的平方 L2 距离（与 FAISS IndexFlatL2 一致），
+        "ip" 返回降序的内积；结果为 (查询数 × k) 的 (得分, 行号)"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self))
+        if k <= 0:
+            return np.zeros((len(queries), 0), np.float32), np.zeros((len(queries), 0), np.int64)
+        sign = 1.0 if metric == "l2" else -1.0
+        best_s = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_i = np.zeros((len(queries), 0), dtype=np.int64)
+        q_sq = (queries * queries).sum(1)[:, None] if metric == "l2" else 0.0
+        for s in range(0, len(self), _BLOCK):
+            ip = self.inner_products(queries, s, s + _BLOCK)
+            if metric == "l2":
+                scores = q_sq + self.squared_norms()[s:s + ip.shape[1]][None, :] - 2 * ip
+            else:
+                scores = -ip
+            ids = np.broadcast_to(np.arange(s, s + ip.shape[1]), scores.shape)
+            scores = np.concatenate([best_s, scores], axis=1)
+            ids = np.concatenate([best_i, ids], axis=1)
+            if scores.shape[1] > k:
+                part = np.argpartition(scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, part, 1)
+                ids = np.take_along_axis(ids, part, 1)
+            best_s, best_i = scores, ids
+        order = np.lexsort((best_i, best_s), axis=1) if best_s.size else np.zeros_like(best_i)
+        best_s = np.take_along_axis(best_s, order, 1)
+        best_i = np.take_along_axis(best_i, order, 1)
+        if metric == "l2":
+            best_s = np.maximum(best_s, 0.0)
+        return (sign * best_s).astype(np.float32), best_i
+
+    # ---------- 持久化 ----------
+
+    def save(self, path: str):
+        """写入单个文件：MAGIC + 头部长度 + 头部 JSON，之后是 64 字节对齐的数组；先写临时文件再替换"""
+        arrays = dict(self.params, codes=np.ascontiguousarray(self.codes))
+        layout, offset = {}, 0
+        for name, arr in arrays.items():
+            offset = _align(offset)
+            layout[name] = {"offset": offset, "shape": list(arr.shape), "dtype": arr.dtype.str}
+            offset += arr.nbytes
+        header = json.dumps({"kind": self.kind, "dim": self.dim, "trained_on": self.trained_on,
+                             "arrays": layout}).encode("utf-8")
+        data_start = _align(len(MAGIC) + 8 + len(header))
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + np.uint64(len(header)).tobytes() + header)
+            for name, arr in arrays.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(arr.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, path: str) -> "VectorStore":
+        """mmap 打开；码本与编码都是文件上的只读视图"""
+        buf = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} 不是向量存储文件")
+        header_len = int(buf[len(MAGIC):len(MAGIC) + 8].view(np.uint64)[0])
+        header = json.loads(bytes(buf[len(MAGIC) + 8:len(MAGIC) + 8 + header_len]).decode("utf-8"))
+        data_start = _align(len(MAGIC) + 8 + header_len)
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            start = data_start + spec["offset"]
+            arrays[name] = buf[start:start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+        codes = arrays.pop("codes")
+        return cls(header["kind"], header["dim"], codes, arrays, path=path, trained_on=header.get("trained_on", 0))